@@ -1,6 +1,7 @@
 from django.contrib import admin
+from django.db.models import Count
 from django.utils.html import format_html
-from .models import Category, Product, ProductImage, Review, Offer, Cart, CartItem
+from .models import Category, Product, ProductImage, Review, Offer, Cart, CartItem, Order, OrderLine
 
 
 class ProductImageInline(admin.TabularInline):
@@ -24,9 +25,13 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     readonly_fields = ['created_at', 'updated_at']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(products_total=Count('products'))
+    
     def products_count(self, obj):
-        return obj.products.count()
+        return obj.products_total
     products_count.short_description = 'Products'
+    products_count.admin_order_field = 'products_total'
 
 
 @admin.register(Product)
@@ -34,9 +39,10 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'category', 'price', 'stock', 'is_active', 'featured', 'image_preview', 'created_at']
     list_filter = ['category', 'is_active', 'featured', 'created_at']
     list_editable = ['price', 'stock', 'is_active', 'featured']
+    list_select_related = ['category']
     search_fields = ['name', 'description', 'category__name']
     prepopulated_fields = {'slug': ('name',)}
-    readonly_fields = ['created_at', 'updated_at', 'rating']
+    readonly_fields = ['created_at', 'updated_at', 'rating', 'review_count', 'rating_sum']
     inlines = [ProductImageInline, ReviewInline]
     
     fieldsets = (
@@ -56,16 +62,16 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('featured',)
         }),
         ('Metadata', {
-            'fields': ('rating', 'created_at', 'updated_at'),
+            'fields': ('rating', 'review_count', 'rating_sum', 'created_at', 'updated_at'),
             'classes': ('collapse',)
         })
     )
     
     def image_preview(self, obj):
-        if obj.image:
-            return format_html('<img src="{}" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px;" />', obj.image.url)
-        elif obj.image_url:
-            return format_html('<img src="{}" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px;" />', obj.image_url)
+        if obj.image or obj.image_url:
+            # The smallest variant still covers the 50px preview on high-density screens
+            return format_html('<img src="{}" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px;" />',
+                               obj.get_image_url(width=100))
         return "No image"
     image_preview.short_description = 'Image'
 
@@ -127,6 +133,9 @@ class CartItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ['product', 'quantity', 'get_total_price']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+    
     def get_total_price(self, obj):
         return f"${obj.get_total_price()}"
     get_total_price.short_description = 'Total'
@@ -137,16 +146,38 @@ class CartAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'session_key', 'items_count', 'total_price', 'created_at']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['user__username', 'session_key']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['subtotal', 'item_count', 'created_at', 'updated_at']
     inlines = [CartItemInline]
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+    
     def items_count(self, obj):
-        return obj.get_total_items()
+        return obj.item_count
     items_count.short_description = 'Items'
+    items_count.admin_order_field = 'item_count'
     
     def total_price(self, obj):
-        return f"${obj.get_total_price()}"
+        return f"${obj.subtotal}"
     total_price.short_description = 'Total'
+    total_price.admin_order_field = 'subtotal'
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    readonly_fields = ['product', 'product_name', 'unit_price', 'quantity']
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'item_count', 'total', 'offer_code', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['user__username']
+    list_select_related = ['user']
+    readonly_fields = ['user', 'subtotal', 'item_count', 'offer_code', 'discount', 'total',
+                       'created_at', 'updated_at']
+    inlines = [OrderLineInline]
 
 
 # Customize admin site header and title
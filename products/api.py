@@ -0,0 +1,155 @@
+"""
+Read-only JSON catalog API.
+
+``/api/products/`` takes the same filter (``category``, ``price``,
+``rating``, ``in_stock``), ``q`` and ``sort`` parameters as the
+``product_list`` page and pages through the results with the same keyset
+cursors (search results ranked by relevance use page numbers, as on the
+page). ``?fields=name,price`` limits each product to the
+listed fields and the query to the columns behind them.
+
+Rows are read with ``values_list()`` and zipped straight into dictionaries
+for ``JsonResponse``; no ``Product`` instances are built. The columns the
+cursor needs are appended after the requested ones, where ``zip`` drops
+them again.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from django.db.models.functions import Concat
+from django.http import Http404, JsonResponse
+
+from .models import Category, Product
+from .pagination import CursorPaginator
+from .query_inspector import query_budget
+from .views import filter_products
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+IMAGE_URL = Case(
+    When(Q(image__isnull=True) | Q(image=''), then=F('image_url')),
+    default=Concat(Value(settings.MEDIA_URL), F('image')),
+    output_field=CharField(),
+)
+
+# API field -> column or expression it is read from
+PRODUCT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'slug': 'slug',
+    'category': 'category__slug',
+    'short_description': 'short_description',
+    'description': 'description',
+    'price': 'price',
+    'old_price': 'old_price',
+    'stock': 'stock',
+    'featured': 'featured',
+    'rating': 'rating',
+    'review_count': 'review_count',
+    'image': IMAGE_URL,
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+LIST_FIELDS = ('id', 'name', 'slug', 'category', 'price', 'old_price', 'stock', 'rating',
+               'review_count', 'image')
+DETAIL_FIELDS = tuple(PRODUCT_FIELDS)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def parse_fields(params, default):
+    """The fields named by ``?fields=``, in order, or ``default``"""
+    raw = params.get('fields')
+    if not raw:
+        return default
+    names = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in names if name not in PRODUCT_FIELDS]
+    if unknown or not names:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}" if unknown else 'No fields given.')
+    return names
+
+
+def parse_limit(params):
+    try:
+        limit = int(params.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('limit must be a number.')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def product_rows(queryset, fields, *extra):
+    """``values_list()`` of ``fields``, followed by the ``extra`` columns"""
+    return queryset.values_list(*(PRODUCT_FIELDS[name] for name in fields), *extra)
+
+
+def serialize(rows, fields):
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def page_url(request, query):
+    return f'{request.path}?{query}' if query is not None else None
+
+
+@query_budget(3)
+def product_list(request):
+    """Products matching the listing filters, one page at a time"""
+    try:
+        fields = parse_fields(request.GET, LIST_FIELDS)
+        limit = parse_limit(request.GET)
+        products, ordering = filter_products(request.GET)
+    except BadRequest as exc:
+        return error(str(exc))
+    except Http404:
+        return error('Unknown category.', status=404)
+
+    if ordering:
+        sort_field = ordering.lstrip('-')
+        rows = product_rows(products, fields, sort_field, 'id')
+        page = CursorPaginator(rows, ordering, limit, key=lambda row: row[-2:]).get_page(request.GET)
+        next_query, previous_query = page.next_query, page.previous_query
+    else:
+        page = Paginator(product_rows(products, fields), limit).get_page(request.GET.get('page'))
+        params = request.GET.copy()
+        next_query = previous_query = None
+        if page.has_next():
+            params['page'] = page.next_page_number()
+            next_query = params.urlencode()
+        if page.has_previous():
+            params['page'] = page.previous_page_number()
+            previous_query = params.urlencode()
+
+    return JsonResponse({
+        'results': serialize(page.object_list, fields),
+        'next': page_url(request, next_query),
+        'previous': page_url(request, previous_query),
+    })
+
+
+@query_budget(1)
+def product_detail(request, slug):
+    """One active product"""
+    try:
+        fields = parse_fields(request.GET, DETAIL_FIELDS)
+    except BadRequest as exc:
+        return error(str(exc))
+    row = product_rows(Product.objects.filter(slug=slug, is_active=True), fields).first()
+    if row is None:
+        return error('Product not found.', status=404)
+    return JsonResponse(dict(zip(fields, row)))
+
+
+@query_budget(1)
+def category_list(request):
+    """All categories with their number of active products"""
+    fields = ('id', 'name', 'slug', 'description', 'product_count')
+    rows = Category.objects.annotate(
+        product_count=Count('products', filter=Q(products__is_active=True)),
+    ).values_list(*fields)
+    return JsonResponse({'results': serialize(rows, fields)})
@@ -0,0 +1,277 @@
+"""
+In-memory typeahead index for the navbar search box.
+
+Each process keeps its own index of active product names and category names.
+It is built lazily on the first suggestion request and then kept current by
+the model signals in ``products.signals``, once their transactions commit. Lookups never touch the database:
+
+* query words are matched against a sorted vocabulary with ``bisect``, so
+  "smar" finds every entry containing a word starting with "smar";
+* a word with no prefix match is corrected through a trigram index of the
+  vocabulary, so "headphnes" still finds "headphones".
+
+Entries are numbered by popularity when the index is built, and every
+posting list is kept in that order, so the first ``limit`` hits are already
+the best ones and a lookup stops as soon as it has them. The index holds at
+most ``AUTOCOMPLETE_MAX_ENTRIES`` entries (categories first, then the most
+popular products); once full, a new entry evicts the lowest ranked product,
+found through a heap of the product ranks.
+"""
+import heapq
+import logging
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.conf import settings
+from django.urls import reverse
+
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_LIMIT = 8
+MIN_QUERY_LENGTH = 2
+
+# How many vocabulary words a single prefix or typo may expand to
+MAX_EXPANSIONS = 64
+MAX_CORRECTIONS = 5
+MIN_SIMILARITY = 0.35
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    return _WORD_RE.findall(text.lower())
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AutocompleteIndex:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._next_rank = 0
+        # rank -> (kind, label, url, words)
+        self._entries = {}
+        # (kind, pk) -> rank
+        self._ranks = {}
+        # word -> ranks of the entries containing it, ascending
+        self._postings = {}
+        # sorted vocabulary for prefix lookups
+        self._words = []
+        # trigram -> words containing it
+        self._trigrams = {}
+        # (-rank, pk) of the product entries, lowest ranked first; stale
+        # pairs of removed products are skipped when popped
+        self._evictable = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Maintenance
+
+    def add(self, kind, pk, label, url):
+        """Add or replace an entry; new entries rank below all existing ones.
+
+        A full index makes room by evicting its lowest ranked product; with no
+        product to evict the new entry is dropped.
+        """
+        with self._lock:
+            rank = self._ranks.get((kind, pk))
+            if rank is not None:
+                self._discard(rank)
+            elif len(self._entries) >= self.max_entries and not self._evict(kind, pk):
+                return
+            else:
+                rank = self._next_rank
+                self._next_rank += 1
+                if kind == 'product':
+                    heapq.heappush(self._evictable, (-rank, pk))
+            words = frozenset(tokenize(label))
+            self._entries[rank] = (kind, label, url, words)
+            self._ranks[(kind, pk)] = rank
+            for word in words:
+                postings = self._postings.get(word)
+                if postings is None:
+                    self._postings[word] = [rank]
+                    insort(self._words, word)
+                    for gram in trigrams(word):
+                        self._trigrams.setdefault(gram, set()).add(word)
+                else:
+                    insort(postings, rank)
+
+    def remove(self, kind, pk):
+        with self._lock:
+            rank = self._ranks.pop((kind, pk), None)
+            if rank is not None:
+                self._discard(rank)
+                if len(self._evictable) > 2 * len(self._entries):
+                    self._evictable = [(-entry, key[1]) for key, entry in self._ranks.items()
+                                       if key[0] == 'product']
+                    heapq.heapify(self._evictable)
+
+    def _evict(self, kind, pk):
+        """Drop the lowest ranked product to make room for ``(kind, pk)``; False if there is none"""
+        while self._evictable:
+            rank, product_pk = heapq.heappop(self._evictable)
+            rank = -rank
+            if self._ranks.get(('product', product_pk)) == rank:
+                break
+        else:
+            logger.warning('Autocomplete index full (%d entries), dropped %s %s', self.max_entries, kind, pk)
+            return False
+        label = self._entries[rank][1]
+        del self._ranks[('product', product_pk)]
+        self._discard(rank)
+        logger.info('Autocomplete index full (%d entries), evicted "%s" for %s %s',
+                    self.max_entries, label, kind, pk)
+        return True
+
+    def _discard(self, rank):
+        _, _, _, words = self._entries.pop(rank)
+        for word in words:
+            postings = self._postings[word]
+            postings.pop(bisect_left(postings, rank))
+            if not postings:
+                del self._postings[word]
+                self._words.pop(bisect_left(self._words, word))
+                for gram in trigrams(word):
+                    grams = self._trigrams[gram]
+                    grams.discard(word)
+                    if not grams:
+                        del self._trigrams[gram]
+
+    # Lookup
+
+    def _expand(self, token):
+        """Vocabulary words a query token stands for: prefix matches, else typo corrections"""
+        start = bisect_left(self._words, token)
+        words = []
+        for word in self._words[start:start + MAX_EXPANSIONS]:
+            if not word.startswith(token):
+                break
+            words.append(word)
+        if words or len(token) < 3:
+            return words
+
+        query_grams = trigrams(token)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._trigrams.get(gram, ()))
+        scored = []
+        for word, common in shared.items():
+            similarity = common / (len(query_grams) + len(trigrams(word)) - common)
+            if similarity >= MIN_SIMILARITY:
+                scored.append((similarity, word))
+        return [word for _, word in heapq.nlargest(MAX_CORRECTIONS, scored)]
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """Return up to ``limit`` suggestions as dicts with type, label and url"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        with self._lock:
+            groups = [self._expand(token) for token in tokens]
+            if not all(groups):
+                return []
+
+            # Walk the smallest group's postings in rank order and check the rest
+            groups.sort(key=lambda words: sum(len(self._postings[w]) for w in words))
+            driver, others = groups[0], [set(words) for words in groups[1:]]
+            results = []
+            last_rank = None
+            for rank in heapq.merge(*(self._postings[word] for word in driver)):
+                if rank == last_rank:
+                    continue
+                last_rank = rank
+                kind, label, url, words = self._entries[rank]
+                if all(not other.isdisjoint(words) for other in others):
+                    results.append({'type': kind, 'label': label, 'url': url})
+                    if len(results) == limit:
+                        break
+            return results
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def _url_builder(view_name):
+    placeholder = reverse(view_name, args=['__slug__'])
+    return lambda slug: placeholder.replace('__slug__', slug)
+
+
+def build_index():
+    """Load categories and the most popular active products into a fresh index"""
+    from .models import Category, Product
+
+    max_entries = getattr(settings, 'AUTOCOMPLETE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+    index = AutocompleteIndex(max_entries)
+
+    category_url = _url_builder('products:category_products')
+    for pk, name, slug in Category.objects.values_list('id', 'name', 'slug').order_by('name'):
+        index.add('category', pk, name, category_url(slug))
+
+    product_url = _url_builder('products:product_detail')
+    products = (
+        Product.objects.filter(is_active=True)
+        .order_by('-featured', '-review_count', '-rating', '-id')
+        .values_list('id', 'name', 'slug')[:max(max_entries - len(index), 0)]
+    )
+    for pk, name, slug in products.iterator(chunk_size=2000):
+        index.add('product', pk, name, product_url(slug))
+    return index
+
+
+def get_index():
+    """Return this process's index, building it on first use"""
+    global _index
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _index = build_index()
+    return _index
+
+
+def reset_index():
+    """Forget the index; the next lookup rebuilds it"""
+    global _index
+    _index = None
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    if len(query.strip()) < MIN_QUERY_LENGTH:
+        return []
+    return get_index().suggest(query, limit)
+
+
+def product_changed(product):
+    """Refresh a product's entry if this process has built its index"""
+    if _index is None:
+        return
+    if product.is_active:
+        url = _url_builder('products:product_detail')(product.slug)
+        _index.add('product', product.pk, product.name, url)
+    else:
+        _index.remove('product', product.pk)
+
+
+def product_deleted(product_id):
+    if _index is not None:
+        _index.remove('product', product_id)
+
+
+def category_changed(category):
+    if _index is not None:
+        url = _url_builder('products:category_products')(category.slug)
+        _index.add('category', category.pk, category.name, url)
+
+
+def category_deleted(category_id):
+    if _index is not None:
+        _index.remove('category', category_id)
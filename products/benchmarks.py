@@ -0,0 +1,196 @@
+"""
+Shared helpers for the ``benchmark_*`` management commands.
+
+Benchmarks run against a throwaway test database (in memory on SQLite,
+unless a file is asked for) so they never touch the real data, and seed it
+with a synthetic catalog.
+"""
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import _TestState, setup_test_environment, teardown_test_environment
+
+from . import search
+from .models import Category, Product
+
+ADJECTIVES = [
+    'smart', 'wireless', 'premium', 'classic', 'organic', 'portable', 'compact',
+    'luxury', 'professional', 'eco', 'vintage', 'ultra', 'deluxe', 'rugged',
+]
+NOUNS = [
+    'phone', 'headphones', 'television', 'laptop', 'shirt', 'jacket', 'sneakers',
+    'knife', 'bedding', 'coffee', 'novel', 'cookbook', 'mat', 'tent', 'dumbbells',
+    'skincare', 'dryer', 'mask', 'lamp', 'backpack', 'watch', 'kettle', 'blender',
+]
+FILLER = [
+    'with', 'durable', 'design', 'for', 'everyday', 'use', 'and', 'comfortable',
+    'fit', 'high', 'quality', 'materials', 'perfect', 'gift', 'home', 'travel',
+]
+CATEGORY_NAMES = [
+    'Electronics', 'Clothing', 'Home & Kitchen', 'Books', 'Sports & Outdoors',
+    'Beauty & Personal Care', 'Toys', 'Garden', 'Automotive', 'Office',
+]
+
+
+@contextmanager
+def throwaway_database(path=None):
+    """Swap the default database for a fresh, migrated test database.
+
+    Pass ``path`` to put an SQLite test database in a file, which threads
+    with their own connections can share. Inside a test run the test
+    database's connection is set aside meanwhile (closing an in-memory
+    database would drop it) and put back afterwards.
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if path is not None:
+        test_settings['NAME'] = path
+    # setup_test_environment() refuses to run twice
+    in_test_run = hasattr(_TestState, 'saved_data')
+    if in_test_run:
+        parked, connection.connection = connection.connection, None
+    else:
+        setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if in_test_run:
+            connection.connection = parked
+        else:
+            teardown_test_environment()
+        test_settings['NAME'] = old_test_name
+
+
+@contextmanager
+def wal_database():
+    """A throwaway SQLite database in a temporary file, in WAL mode, for threaded benchmarks"""
+    directory = tempfile.mkdtemp()
+    try:
+        with throwaway_database(os.path.join(directory, 'benchmark.sqlite3')):
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=WAL')
+            yield
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def hammer(task, thread_args, attempts):
+    """Call ``task(*args)`` ``attempts`` times in one thread per ``thread_args`` entry.
+
+    All threads are released at once. Returns ``(successes, errors, seconds)``
+    where ``successes`` counts truthy results and ``errors`` is a ``Counter``
+    of exception descriptions.
+    """
+    barrier = threading.Barrier(len(thread_args) + 1)
+    lock = threading.Lock()
+    successes = 0
+    errors = Counter()
+
+    def worker(args):
+        nonlocal successes
+        barrier.wait()
+        try:
+            for _ in range(attempts):
+                try:
+                    succeeded = task(*args)
+                except Exception as e:
+                    with lock:
+                        errors[f'{type(e).__name__}: {e}'] += 1
+                    continue
+                if succeeded:
+                    with lock:
+                        successes += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(args,)) for args in thread_args]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return successes, errors, time.perf_counter() - started
+
+
+def seed_catalog(count, seed=42, stock=100, batch_size=5000):
+    """Bulk insert ``count`` synthetic products and index them for search.
+
+    Returns the elapsed seconds.
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    categories = Category.objects.bulk_create(
+        Category(name=name, slug=f'category-{i}') for i, name in enumerate(CATEGORY_NAMES)
+    )
+    batch = []
+    for i in range(count):
+        batch.append(Product(
+            name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS).title()} {i}',
+            slug=f'product-{i}',
+            category=rng.choice(categories),
+            short_description=' '.join(rng.choice(FILLER + NOUNS) for _ in range(10)),
+            description=' '.join(rng.choice(FILLER + NOUNS + ADJECTIVES) for _ in range(40)),
+            price=Decimal(rng.randint(100, 100000)) / 100,
+            stock=stock,
+            featured=rng.random() < 0.05,
+        ))
+        if len(batch) == batch_size:
+            Product.objects.bulk_create(batch)
+            batch = []
+    Product.objects.bulk_create(batch)
+    search.rebuild_index()
+    return time.perf_counter() - started
+
+
+# Metrics of a ``bench`` run compared by ``compare_runs``; query counts are
+# exact, so any increase is a regression
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+COUNT_METRICS = ('queries',)
+
+
+def latency_summary(timings):
+    """p50, p95, p99 and mean of ``timings`` (milliseconds)"""
+    if len(timings) < 2:
+        timings = list(timings) * 2
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'p50_ms': round(cuts[49], 3),
+        'p95_ms': round(cuts[94], 3),
+        'p99_ms': round(cuts[98], 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+    }
+
+
+def compare_runs(old, new, threshold):
+    """Regressions of the ``new`` ``bench`` results against ``old``.
+
+    A latency regresses when it grew by more than ``threshold`` (a fraction,
+    0.1 for 10%); the query count when it grew at all. Returns a list of
+    ``(view, metric, old, new)`` tuples; views missing from either run are
+    skipped.
+    """
+    regressions = []
+    for view, metrics in new['views'].items():
+        before = old['views'].get(view)
+        if before is None:
+            continue
+        for metric in LATENCY_METRICS:
+            if metrics[metric] > before[metric] * (1 + threshold):
+                regressions.append((view, metric, before[metric], metrics[metric]))
+        for metric in COUNT_METRICS:
+            if metrics[metric] > before[metric]:
+                regressions.append((view, metric, before[metric], metrics[metric]))
+    return regressions
@@ -0,0 +1,233 @@
+"""
+Anonymous shopping carts kept in a signed cookie.
+
+Visitors who are not logged in get no session row and no ``Cart`` row:
+their cart is a ``{product_id: quantity}`` mapping stored as compact JSON
+in a signed cookie. ``CartCookieMiddleware`` writes the cookie back only
+when a view changed the cart, and ``merge_cookie_cart`` folds it into the
+user's ``Cart`` in one transaction when they log in.
+
+``CookieCart`` offers the same small API as the ``Cart`` model
+(``get_quantity``, ``add``, ``set_quantity``, ``remove``, ``line_items``,
+``item_count`` and ``subtotal``) so the cart views don't care which one
+``views.get_cart`` hands them.
+
+The navbar badge count comes from ``cart_count``: the cookie for anonymous
+visitors, a per-user cache entry for logged-in users. Only the views that
+change a cart (and the login merge) refresh that entry, so rendering the
+badge costs no cart queries.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+from .models import Cart, CartItem, Product
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'products.cart'
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Keeps the cookie well below the 4KB browsers accept
+MAX_LINES = 50
+
+CART_COUNT_KEY = 'cart-count:{}'
+CART_COUNT_TIMEOUT = 60 * 60
+
+
+class CartFull(Exception):
+    pass
+
+
+class CartLine:
+    """A product and quantity in a cookie cart, standing in for a ``CartItem``"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    def get_total_price(self):
+        return self.quantity * self.product.price
+
+
+class CookieCart:
+    # Offer codes need an account; see views.apply_offer
+    offer_code = ''
+
+    def __init__(self, lines=None):
+        self.lines = dict(lines or {})
+        self.modified = False
+        self._line_items = None
+
+    @classmethod
+    def from_request(cls, request):
+        raw = request.get_signed_cookie(
+            COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE
+        )
+        try:
+            lines = {int(pk): int(quantity) for pk, quantity in json.loads(raw or '{}').items()}
+        except (ValueError, TypeError, AttributeError):
+            lines = {}
+        return cls({pk: quantity for pk, quantity in lines.items() if quantity > 0})
+
+    def serialize(self):
+        return json.dumps(self.lines, separators=(',', ':'))
+
+    def _changed(self):
+        self.modified = True
+        self._line_items = None
+
+    def get_quantity(self, product):
+        return self.lines.get(product.pk, 0)
+
+    def add(self, product, quantity):
+        if quantity <= 0:
+            return False
+        return self.set_quantity(product, self.get_quantity(product) + quantity)
+
+    def set_quantity(self, product, quantity):
+        if quantity <= 0:
+            self.remove(product)
+            return True
+        if quantity > product.stock:
+            return False
+        if product.pk not in self.lines and len(self.lines) >= MAX_LINES:
+            raise CartFull(f'A cart holds at most {MAX_LINES} different products.')
+        self.lines[product.pk] = quantity
+        self._changed()
+        return True
+
+    def remove(self, product):
+        if self.lines.pop(product.pk, None) is not None:
+            self._changed()
+
+    def clear(self):
+        if self.lines:
+            self.lines = {}
+            self._changed()
+
+    def line_items(self):
+        """The cart lines with their active products, loaded in one query"""
+        if self._line_items is None:
+            products = Product.objects.filter(is_active=True).select_related('category').in_bulk(list(self.lines))
+            self._line_items = [
+                CartLine(products[pk], quantity)
+                for pk, quantity in self.lines.items() if pk in products
+            ]
+        return self._line_items
+
+    @property
+    def item_count(self):
+        return sum(self.lines.values())
+
+    @property
+    def subtotal(self):
+        return sum((line.get_total_price() for line in self.line_items()), 0)
+
+
+def get_cookie_cart(request):
+    """The anonymous visitor's cart, read from the cookie once per request"""
+    if not hasattr(request, '_cookie_cart'):
+        request._cookie_cart = CookieCart.from_request(request)
+    return request._cookie_cart
+
+
+def cart_count(request):
+    """Number of items to show on the cart badge"""
+    if not request.user.is_authenticated:
+        return get_cookie_cart(request).item_count
+    count = cache.get(CART_COUNT_KEY.format(request.user.pk))
+    if count is None:
+        count = load_cart_count(request.user)
+    return count
+
+
+def load_cart_count(user):
+    """Read the stored item count of ``user``'s cart into the cache"""
+    count = Cart.objects.filter(user=user).values_list('item_count', flat=True).first() or 0
+    cache.set(CART_COUNT_KEY.format(user.pk), count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def remember_cart_count(cart):
+    """Cache the badge count of a ``Cart`` whose totals are known to be current"""
+    if isinstance(cart, Cart):
+        cache.set(CART_COUNT_KEY.format(cart.user_id), cart.item_count, CART_COUNT_TIMEOUT)
+
+
+def update_cart_count(cart):
+    """Refresh the badge count after a view changed ``cart``"""
+    if isinstance(cart, Cart):
+        # The stored totals were updated in SQL by the CartItem signals
+        cart.refresh_from_db(fields=['item_count', 'subtotal'])
+        remember_cart_count(cart)
+
+
+def merge_cookie_cart(request, user):
+    """Fold the request's cookie cart into ``user``'s ``Cart`` and empty it.
+
+    Products already in the user's cart have the quantities added up; every
+    line is capped at the product's stock, and sold out products are left
+    out. All writes are batched: one
+    ``bulk_update``, one ``bulk_create`` and one totals refresh.
+    """
+    cookie_cart = get_cookie_cart(request)
+    if not cookie_cart.lines:
+        return None
+
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(user=user)
+        stock = dict(
+            Product.objects.filter(pk__in=list(cookie_cart.lines), is_active=True)
+            .values_list('pk', 'stock')
+        )
+        existing = {item.product_id: item for item in cart.items.filter(product_id__in=list(stock))}
+        now = timezone.now()
+        to_update, to_create = [], []
+        for product_id, quantity in cookie_cart.lines.items():
+            if product_id not in stock:
+                continue
+            item = existing.get(product_id)
+            capped = min(quantity + (item.quantity if item is not None else 0), stock[product_id])
+            if capped <= 0:
+                # Sold out: nothing to add, and no line may drop to 0
+                continue
+            if item is not None:
+                item.quantity = capped
+                item.updated_at = now
+                to_update.append(item)
+            else:
+                to_create.append(CartItem(cart=cart, product_id=product_id, quantity=capped))
+        CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+        CartItem.objects.bulk_create(to_create)
+        # bulk operations skip the CartItem signals, so refresh the totals once
+        Cart.refresh_totals(pk=cart.pk)
+
+    update_cart_count(cart)
+    cookie_cart.clear()
+    return cart
+
+
+class CartCookieMiddleware:
+    """Write the cookie cart back to the browser when a view changed it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cart = getattr(request, '_cookie_cart', None)
+        if cart is None:
+            return response
+        patch_vary_headers(response, ('Cookie',))
+        if cart.modified:
+            if cart.lines:
+                response.set_signed_cookie(
+                    COOKIE_NAME, cart.serialize(), salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE,
+                    secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+                )
+            else:
+                response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        return response
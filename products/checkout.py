@@ -0,0 +1,102 @@
+"""
+Turning a cart into an ``Order``.
+
+``place_order`` runs in one transaction whose first statement is a single
+conditional UPDATE decrementing the stock of every product in the cart,
+each by its line's quantity (read by a correlated subquery), and only on
+rows whose stock still covers it. If fewer rows change than the cart has
+lines, some product is short and the whole transaction is rolled back.
+The cart's offer code, if any, is priced by ``products.offers`` and
+redeemed with its own conditional UPDATE in the same transaction. The
+cart lines are then snapshotted into ``OrderLine`` rows with their current
+prices in one ``bulk_create``, and the cart is emptied. The cached pages
+showing the products' stock are invalidated once the order commits.
+
+Leading with the write also means that on SQLite the transaction takes
+the write lock up front instead of upgrading a read snapshot, which fails
+under concurrent checkouts.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from . import offers, page_cache
+from .models import Cart, CartItem, Order, OrderLine, Product
+
+
+class OutOfStock(Exception):
+    """Raised when some cart lines ask for more than the stock left"""
+
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.name for product in products)
+        super().__init__(f'Not enough stock left for: {names}')
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class _ShortLines(Exception):
+    """Internal signal to roll back the stock decrement"""
+
+
+def place_order(cart):
+    """Create an ``Order`` from ``cart``, decrement stock and empty the cart"""
+    try:
+        with transaction.atomic():
+            line_quantity = Subquery(
+                CartItem.objects.filter(cart=cart, product=OuterRef('pk')).values('quantity')[:1]
+            )
+            decremented = Product.objects.filter(
+                pk__in=CartItem.objects.filter(cart=cart).values('product'),
+                is_active=True,
+                stock__gte=line_quantity,
+            ).update(stock=F('stock') - line_quantity, updated_at=timezone.now())
+
+            items = list(cart.items.select_related('product'))
+            if not items:
+                raise EmptyCart('The cart is empty.')
+            if decremented != len(items):
+                raise _ShortLines
+
+            subtotal = sum((item.get_total_price() for item in items), Decimal('0'))
+            offer, discount = None, Decimal('0')
+            if cart.offer_code:
+                # Raises OfferNotApplicable, rolling back the stock decrement
+                offer, discount = offers.price(cart.offer_code, subtotal)
+                if not offers.redeem(offer):
+                    raise offers.OfferNotApplicable(f'The code {offer.code} has been used up.')
+
+            order = Order.objects.create(
+                user=cart.user,
+                subtotal=subtotal,
+                item_count=sum(item.quantity for item in items),
+                offer_code=offer.code if offer else '',
+                discount=discount,
+                total=subtotal - discount,
+            )
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, product=item.product, product_name=item.product.name,
+                          unit_price=item.product.price, quantity=item.quantity)
+                for item in items
+            )
+            # One DELETE; a queryset delete would fire the per-item signals
+            # and recompute the cart totals once per line.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {CartItem._meta.db_table} WHERE cart_id = %s', [cart.pk]
+                )
+            Cart.objects.filter(pk=cart.pk).update(subtotal=0, item_count=0, offer_code='')
+            page_cache.invalidate_tags(
+                'catalog', *(tag for item in items for tag in page_cache.product_tags(item.product))
+            )
+    except _ShortLines:
+        # The decrement has been rolled back; find out which lines were short
+        raise OutOfStock([
+            item.product for item in cart.items.select_related('product')
+            if not item.product.is_active or item.quantity > item.product.stock
+        ])
+    return order
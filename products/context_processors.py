@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import cart_count
+
+
+def cart(request):
+    """Expose ``cart_count`` for the navbar badge, computed only if a template uses it"""
+    return {'cart_count': SimpleLazyObject(lambda: cart_count(request))}
@@ -0,0 +1,229 @@
+"""
+Deterministic synthetic datasets for load tests and benchmarks.
+
+``DatasetGenerator`` fills an empty catalog with categories, products,
+users, reviews, carts and cart items drawn from one ``random.Random(seed)``
+and a fixed anchor date, so the same arguments always produce the same rows.
+Everything is written with ``bulk_create`` in ``batch_size`` chunks (the
+generated product and review timestamps with a follow-up ``UPDATE``) and
+the derived data (review aggregates, cart totals, search index) is computed
+afterwards with set-based statements.
+
+Popularity follows Zipf's law: category ``k`` of ``n`` gets a share of the
+products proportional to ``1 / k ** exponent``, and so does the ``k``-th
+most popular product of the reviews and cart items. A few categories and a
+few bestsellers therefore dominate, as in a real shop, which is what makes
+query plans, cache hit rates and pagination behave realistically.
+"""
+import itertools
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, Round
+
+from . import autocomplete, search
+from .benchmarks import ADJECTIVES, CATEGORY_NAMES, FILLER, NOUNS
+from .models import Cart, CartItem, Category, Product, Review
+
+ANCHOR = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+HISTORY = timedelta(days=730)
+BATCH_SIZE = 5000
+ZIPF_EXPONENT = 1.1
+# Share of 1 to 5 star reviews
+RATING_WEIGHTS = [5, 7, 15, 33, 40]
+REVIEW_TITLES = ['Great value', 'Not bad', 'Disappointed', 'Exactly as described',
+                 'Would buy again', 'Too small', 'Excellent quality', 'Arrived late']
+
+
+def set_timestamps(model, rows):
+    """Write ``(created_at, updated_at, pk)`` rows to ``model``'s table in one executemany"""
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {model._meta.db_table} SET created_at = %s, updated_at = %s WHERE id = %s',
+            [(adapt(created_at), adapt(updated_at), pk) for created_at, updated_at, pk in rows],
+        )
+
+
+def zipf_cum_weights(n, exponent=ZIPF_EXPONENT):
+    """Cumulative Zipf weights for ranks 1..n, for ``random.choices``"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def scale_counts(products):
+    """Default users, reviews and carts for a catalog of ``products``"""
+    return {
+        'products': products,
+        'users': max(products // 10, 10),
+        'reviews': products * 2,
+        'carts': max(products // 20, 1),
+    }
+
+
+class DatasetGenerator:
+    def __init__(self, products, users, reviews, carts, seed=42, batch_size=BATCH_SIZE,
+                 exponent=ZIPF_EXPONENT, report=None):
+        self.counts = {'products': products, 'users': users, 'reviews': reviews, 'carts': carts}
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.exponent = exponent
+        self.report = report or (lambda label, rows, seconds: None)
+
+    def _moment(self, after=None):
+        start = after or ANCHOR - HISTORY
+        return start + timedelta(seconds=self.rng.random() * (ANCHOR - start).total_seconds())
+
+    def _insert(self, label, model, objects, timestamps=False):
+        """``bulk_create`` the ``objects`` iterable in batches; returns the row count.
+
+        ``bulk_create`` stamps ``auto_now`` fields with the current time, so
+        with ``timestamps`` the objects' own ``created_at``/``updated_at`` are
+        written over them afterwards.
+        """
+        started = time.perf_counter()
+        total = 0
+        with transaction.atomic():
+            while batch := list(itertools.islice(objects, self.batch_size)):
+                stamps = [(obj.created_at, obj.updated_at) for obj in batch] if timestamps else None
+                model.objects.bulk_create(batch)
+                if timestamps:
+                    set_timestamps(model, [(*stamp, obj.pk) for stamp, obj in zip(stamps, batch)])
+                total += len(batch)
+        self.report(label, total, time.perf_counter() - started)
+        return total
+
+    def generate(self):
+        self.generate_categories()
+        self.generate_products()
+        self.generate_users()
+        self.generate_reviews()
+        self.generate_carts()
+        self.refresh_derived_data()
+
+    def generate_categories(self):
+        count = max(len(CATEGORY_NAMES), self.counts['products'] // 5000)
+        self._insert('categories', Category, (
+            Category(
+                name=CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + (f' {i // len(CATEGORY_NAMES) + 1}'
+                                                                if i >= len(CATEGORY_NAMES) else ''),
+                slug=f'category-{i}',
+                description=f'Synthetic category {i}',
+            )
+            for i in range(count)
+        ))
+        self.category_ids = list(Category.objects.order_by('pk').values_list('pk', flat=True))
+
+    def generate_products(self):
+        rng = self.rng
+        category_weights = zipf_cum_weights(len(self.category_ids), self.exponent)
+
+        def products():
+            for start in range(0, self.counts['products'], self.batch_size):
+                size = min(self.batch_size, self.counts['products'] - start)
+                categories = rng.choices(self.category_ids, cum_weights=category_weights, k=size)
+                for i, category_id in enumerate(categories, start):
+                    price = Decimal(min(max(rng.lognormvariate(3.5, 1.0), 1), 5000)).quantize(Decimal('0.01'))
+                    created_at = self._moment()
+                    yield Product(
+                        name=f'{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS).title()} {i}',
+                        slug=f'product-{i}',
+                        category_id=category_id,
+                        short_description=' '.join(rng.choices(FILLER + NOUNS, k=10)),
+                        description=' '.join(rng.choices(FILLER + NOUNS + ADJECTIVES, k=40)),
+                        price=price,
+                        old_price=(price * Decimal('1.25')).quantize(Decimal('0.01')) if rng.random() < 0.15 else None,
+                        stock=0 if rng.random() < 0.08 else int(rng.expovariate(1 / 40)) + 1,
+                        is_active=rng.random() >= 0.03,
+                        featured=rng.random() < 0.02,
+                        rating=Decimal(rng.randint(30, 50)) / 10,
+                        created_at=created_at,
+                        updated_at=created_at,
+                    )
+
+        self._insert('products', Product, products(), timestamps=True)
+        # Popularity ranks: a shuffled product order, the first the bestseller
+        self.product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        self.by_popularity = self.product_ids[:]
+        rng.shuffle(self.by_popularity)
+        self.popularity_weights = zipf_cum_weights(len(self.by_popularity), self.exponent)
+
+    def generate_users(self):
+        password = make_password(None)
+        joined = ANCHOR - HISTORY
+        self._insert('users', User, (
+            User(username=f'shopper{i}', email=f'shopper{i}@example.com', password=password,
+                 date_joined=joined)
+            for i in range(self.counts['users'])
+        ))
+        self.user_ids = list(User.objects.filter(username__startswith='shopper').order_by('pk')
+                             .values_list('pk', flat=True))
+
+    def popular_products(self, k):
+        return self.rng.choices(self.by_popularity, cum_weights=self.popularity_weights, k=k)
+
+    def generate_reviews(self):
+        rng = self.rng
+        user_count = len(self.user_ids)
+        per_product = Counter()
+        remaining = self.counts['reviews']
+        while remaining:
+            size = min(remaining, 100_000)
+            per_product.update(self.popular_products(size))
+            remaining -= size
+
+        def reviews():
+            for product_id in self.product_ids:
+                # Consecutive users from a random offset: one review per user and product
+                offset = rng.randrange(user_count)
+                count = min(per_product[product_id], user_count)
+                ratings = rng.choices(range(1, 6), weights=RATING_WEIGHTS, k=count)
+                for k, rating in enumerate(ratings):
+                    created_at = self._moment()
+                    yield Review(
+                        product_id=product_id,
+                        user_id=self.user_ids[(offset + k) % user_count],
+                        rating=rating,
+                        title=rng.choice(REVIEW_TITLES),
+                        comment=' '.join(rng.choices(FILLER + NOUNS, k=20)),
+                        created_at=created_at,
+                        updated_at=created_at,
+                    )
+
+        self._insert('reviews', Review, reviews(), timestamps=True)
+
+    def generate_carts(self):
+        rng = self.rng
+        owners = rng.sample(self.user_ids, min(self.counts['carts'], len(self.user_ids)))
+        self._insert('carts', Cart, (Cart(user_id=user_id) for user_id in owners))
+        cart_ids = list(Cart.objects.filter(user_id__in=owners).values_list('pk', flat=True))
+
+        def items():
+            for cart_id in cart_ids:
+                size = min(int(rng.expovariate(1 / 3)) + 1, 20)
+                for product_id in set(self.popular_products(size)):
+                    yield CartItem(cart_id=cart_id, product_id=product_id, quantity=rng.randint(1, 3))
+
+        self._insert('cart items', CartItem, items())
+
+    def refresh_derived_data(self):
+        """Review aggregates, cart totals and the search index, one statement each"""
+        started = time.perf_counter()
+        reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        count = Coalesce(Subquery(reviews.annotate(n=Count('pk')).values('n')), 0)
+        total = Coalesce(Subquery(reviews.annotate(s=Sum('rating')).values('s')), 0)
+        with transaction.atomic():
+            Product.objects.update(review_count=count, rating_sum=total)
+            Product.objects.filter(review_count__gt=0).update(
+                rating=Round(Cast(F('rating_sum'), FloatField()) / F('review_count'), 1)
+            )
+            Cart.refresh_totals()
+            search.rebuild_index()
+        autocomplete.reset_index()
+        self.report('derived data', self.counts['products'], time.perf_counter() - started)
@@ -0,0 +1,147 @@
+"""
+Streaming catalog export as CSV or JSON Lines.
+
+``export_rows`` reads the products with ``values_list()`` and
+``iterator(chunk_size=...)``, so rows are fetched from the database cursor
+a chunk at a time and never collected in a list. The writers turn that
+iterator into text chunks of roughly ``BUFFER_SIZE`` characters, and
+``gzip_chunks`` compresses them incrementally. Memory use therefore
+depends on the chunk sizes, not on the size of the catalog.
+
+Both the ``export_products`` command and the staff-only export view are
+thin wrappers around ``stream_export``.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Product
+
+FORMATS = ('csv', 'jsonl')
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+# Column -> field it is read from; ``import_products`` reads the same columns
+COLUMNS = {
+    'id': 'id',
+    'slug': 'slug',
+    'name': 'name',
+    'category': 'category__slug',
+    'category_name': 'category__name',
+    'short_description': 'short_description',
+    'description': 'description',
+    'price': 'price',
+    'old_price': 'old_price',
+    'stock': 'stock',
+    'is_active': 'is_active',
+    'featured': 'featured',
+    'image': 'image',
+    'image_url': 'image_url',
+    'rating': 'rating',
+    'review_count': 'review_count',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_moment(value):
+    """An aware datetime from an ISO datetime or date (midnight) string; None if empty"""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime.combine(day, time.min)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ExportError(f'Not a date or datetime: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_rows(categories=(), active=None, updated_after=None, updated_before=None,
+                chunk_size=CHUNK_SIZE):
+    """Iterate over the matching products as tuples in ``COLUMNS`` order.
+
+    ``categories`` are category slugs; ``updated_after`` is inclusive and
+    ``updated_before`` exclusive.
+    """
+    products = Product.objects.all()
+    if categories:
+        products = products.filter(category__slug__in=categories)
+    if active is not None:
+        products = products.filter(is_active=active)
+    if updated_after is not None:
+        products = products.filter(updated_at__gte=updated_after)
+    if updated_before is not None:
+        products = products.filter(updated_at__lt=updated_before)
+    return products.order_by('pk').values_list(*COLUMNS.values()).iterator(chunk_size=chunk_size)
+
+
+def _buffered(lines):
+    """Join ``lines`` into chunks of about ``BUFFER_SIZE`` characters"""
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def csv_lines(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def line(values):
+        writer.writerow(values)
+        text = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return text
+
+    yield line(COLUMNS)
+    for row in rows:
+        yield line(row)
+
+
+def jsonl_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    names = tuple(COLUMNS)
+    for row in rows:
+        yield encoder.encode(dict(zip(names, row))) + '\n'
+
+
+def gzip_chunks(chunks):
+    """Compress text ``chunks`` into a gzip stream, one piece at a time"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(rows, fmt='csv', compress=False):
+    """Encode ``rows`` as ``fmt``; yields ``bytes`` chunks, gzipped with ``compress``"""
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt}; use {' or '.join(FORMATS)}")
+    lines = csv_lines(rows) if fmt == 'csv' else jsonl_lines(rows)
+    chunks = _buffered(lines)
+    if compress:
+        return gzip_chunks(chunks)
+    return (chunk.encode() for chunk in chunks)
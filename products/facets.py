@@ -0,0 +1,172 @@
+"""
+Faceted navigation for the product listing.
+
+The listing filters by any number of categories and price bands, a
+minimum rating and "in stock only". ``normalize_filters`` reduces the
+query parameters to a canonical filter state (known values only, sorted,
+deduplicated), which ``apply_filters`` turns into a queryset filter and
+``facet_counts`` into counts for every facet value.
+
+The counts follow the usual multi-select rule: a facet's own selection
+does not narrow its counts (ticking a second category adds to the
+results), every other selection does. All of them come from one grouped
+aggregate over the categories, with a conditional ``COUNT`` per facet
+value computed under the other facets' filters. The aggregate groups the
+active products by category, reading the covering ``product_facet_idx``
+index in order instead of the table; the price, rating and stock counts
+per category are summed over the selected categories in Python.
+Categories without matching active products are only listed while
+selected, with a count of 0.
+
+Counts are cached per normalized state and search query under the
+``catalog`` page cache tag's version, so any product, category, review or
+stock change that expires the cached listings expires them too.
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+
+from . import page_cache
+from .models import Category, Product
+from .search import search_products
+
+# key, label, lower bound (inclusive), upper bound (exclusive)
+PRICE_BANDS = [
+    ('under-25', 'Under $25', None, Decimal('25')),
+    ('25-50', '$25 to $50', Decimal('25'), Decimal('50')),
+    ('50-100', '$50 to $100', Decimal('50'), Decimal('100')),
+    ('100-250', '$100 to $250', Decimal('100'), Decimal('250')),
+    ('over-250', '$250 & above', Decimal('250'), None),
+]
+RATING_THRESHOLDS = (4, 3, 2, 1)
+FACET_KEY = 'facets:{}:{}'
+FACET_CACHE_TIMEOUT = page_cache.PAGE_CACHE_TIMEOUT
+
+
+def normalize_filters(params):
+    """The canonical filter state of the ``category``, ``price``, ``rating`` and ``in_stock`` parameters"""
+    bands = set(params.getlist('price'))
+    rating = params.get('rating')
+    return {
+        'category': sorted({slug for slug in params.getlist('category') if slug}),
+        'price': [key for key, _, _, _ in PRICE_BANDS if key in bands],
+        'rating': int(rating) if rating in {str(threshold) for threshold in RATING_THRESHOLDS} else None,
+        'in_stock': params.get('in_stock') in ('1', 'on', 'true'),
+    }
+
+
+def filter_query(state):
+    """``state`` as query string pairs, in the order ``normalize_filters`` reads them"""
+    pairs = [('category', slug) for slug in state['category']]
+    pairs += [('price', key) for key in state['price']]
+    if state['rating']:
+        pairs.append(('rating', state['rating']))
+    if state['in_stock']:
+        pairs.append(('in_stock', 1))
+    return pairs
+
+
+def price_band_q(key, prefix=''):
+    _, _, low, high = next(band for band in PRICE_BANDS if band[0] == key)
+    q = Q()
+    if low is not None:
+        q &= Q(**{f'{prefix}price__gte': low})
+    if high is not None:
+        q &= Q(**{f'{prefix}price__lt': high})
+    return q
+
+
+def _facet_conditions(state, prefix=''):
+    """Per-facet conditions for the price, rating and stock selections (category is handled by the caller)"""
+    price = Q()
+    for key in state['price']:
+        price |= price_band_q(key, prefix)
+    return {
+        'price': price,
+        'rating': Q(**{f'{prefix}rating__gte': state['rating']}) if state['rating'] else Q(),
+        'in_stock': Q(**{f'{prefix}stock__gt': 0}) if state['in_stock'] else Q(),
+    }
+
+
+def apply_filters(products, state, category_ids=None):
+    """Narrow ``products`` to ``state``; ``category_ids`` are the ids of the selected category slugs"""
+    if category_ids:
+        products = products.filter(category__in=category_ids)
+    for condition in _facet_conditions(state).values():
+        products = products.filter(condition)
+    return products
+
+
+def _without(conditions, facet):
+    q = Q()
+    for name, condition in conditions.items():
+        if name != facet:
+            q &= condition
+    return q
+
+
+def _count_facets(state, products):
+    conditions = _facet_conditions(state)
+    counts = {'n_category': Count('pk', filter=_without(conditions, None))}
+    for key, _, _, _ in PRICE_BANDS:
+        counts[f'n_price_{key}'] = Count('pk', filter=_without(conditions, 'price') & price_band_q(key))
+    for threshold in RATING_THRESHOLDS:
+        counts[f'n_rating_{threshold}'] = Count('pk', filter=_without(conditions, 'rating') & Q(rating__gte=threshold))
+    counts['n_in_stock'] = Count('pk', filter=_without(conditions, 'in_stock') & Q(stock__gt=0))
+    # Grouped by category id alone, in index order; the names ride along
+    # as aggregates of the joined category row
+    rows = products.order_by().values('category_id').annotate(
+        name=Max('category__name'), slug=Max('category__slug'), **counts,
+    )
+    rows = list(rows)
+    selected = set(state['category'])
+    # Selected categories stay listed (and untickable) without matches
+    missing = selected - {row['slug'] for row in rows}
+    if missing:
+        rows += [
+            {'slug': slug, 'name': name, 'n_category': 0, **dict.fromkeys(counts, 0)}
+            for slug, name in Category.objects.filter(slug__in=missing).values_list('slug', 'name')
+        ]
+    rows.sort(key=lambda row: row['name'])
+    counted = [row for row in rows if row['slug'] in selected] if selected else rows
+
+    def total(name):
+        return sum(row[name] for row in counted)
+
+    return {
+        'categories': [
+            {'slug': row['slug'], 'name': row['name'], 'count': row['n_category'], 'selected': row['slug'] in selected}
+            for row in rows
+        ],
+        'price': [
+            {'key': key, 'label': label, 'count': total(f'n_price_{key}'), 'selected': key in state['price']}
+            for key, label, _, _ in PRICE_BANDS
+        ],
+        'rating': [
+            {'value': threshold, 'label': f'{threshold}★ & up', 'count': total(f'n_rating_{threshold}'),
+             'selected': threshold == state['rating']}
+            for threshold in RATING_THRESHOLDS
+        ],
+        'in_stock': {'count': total('n_in_stock'), 'selected': state['in_stock']},
+    }
+
+
+def facet_counts(state, query=None):
+    """Counts of every facet value for ``state`` among the active products matching ``query``.
+
+    Cached per normalized state and search query.
+    """
+    query = ' '.join(query.split()) if query else ''
+    raw = json.dumps([query.lower(), state], sort_keys=True)
+    key = FACET_KEY.format(page_cache.tag_version('catalog'), hashlib.md5(raw.encode()).hexdigest())
+    facets = cache.get(key)
+    if facets is None:
+        products = Product.objects.filter(is_active=True)
+        if query:
+            products = search_products(products, query, ranked=False)
+        facets = _count_facets(state, products)
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
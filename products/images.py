@@ -0,0 +1,152 @@
+"""
+Resized WebP and JPEG variants of uploaded product images.
+
+Every uploaded image (``Product.image`` and ``ProductImage.image``) gets a
+variant per format at each of ``VARIANT_WIDTHS``, capped at the image's own
+width, stored next to it under ``variants/``::
+
+    product_images/shoe.png -> product_images/variants/shoe-320w.webp
+                               product_images/variants/shoe-320w.jpg
+
+Variant names follow from the image name and width alone, so once a row's
+``image_width`` is set (the width of the original, recorded when its
+variants were written) URLs and ``srcset`` lists are built without touching
+the storage. Rows whose ``image_width`` is still empty keep serving the
+original.
+
+Variants are written on upload by the model signals, after the transaction
+commits, and for existing images by the ``generate_image_variants``
+command, which spreads the work over a process pool.
+"""
+import io
+import logging
+import os
+import posixpath
+from collections import defaultdict
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+FORMATS = {
+    # format -> (file extension, Pillow format, save options)
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANT_DIRECTORY = 'variants'
+ORIENTATION_TAG = 0x0112
+
+
+def variant_widths(image_width):
+    """The variant widths of an image ``image_width`` pixels wide"""
+    return sorted({min(width, image_width) for width in VARIANT_WIDTHS})
+
+
+def variant_name(name, width, fmt):
+    directory, filename = posixpath.split(name)
+    stem = os.path.splitext(filename)[0]
+    return posixpath.join(directory, VARIANT_DIRECTORY, f'{stem}-{width}w.{FORMATS[fmt][0]}')
+
+
+def variant_url(name, image_width, width, fmt='jpeg', storage=default_storage):
+    """URL of the smallest variant at least ``width`` wide, or of the widest one"""
+    widths = variant_widths(image_width)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return storage.url(variant_name(name, chosen, fmt))
+
+
+def srcset(name, image_width, fmt='jpeg', storage=default_storage):
+    return ', '.join(
+        f'{storage.url(variant_name(name, width, fmt))} {width}w'
+        for width in variant_widths(image_width)
+    )
+
+
+def _flatten(image):
+    """``image`` as RGB, transparent areas on white (JPEG has no alpha)"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_variants(name, storage=default_storage):
+    """Write the variants of the stored image ``name``; returns its width.
+
+    Existing variants are overwritten. Raises ``OSError`` (Pillow's
+    ``UnidentifiedImageError`` included) when the file cannot be read.
+    """
+    with storage.open(name, 'rb') as f, Image.open(f) as original:
+        # The displayed width: EXIF orientations 5 to 8 turn the image sideways
+        sideways = original.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8)
+        image_width = original.height if sideways else original.width
+        # Let the JPEG decoder scale huge photos down while decoding
+        original.draft('RGB', (VARIANT_WIDTHS[-1] * 2, VARIANT_WIDTHS[-1] * 2))
+        image = _flatten(ImageOps.exif_transpose(original))
+
+    for width in variant_widths(image_width):
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for fmt, (_, pil_format, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            target = variant_name(name, width, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+    return image_width
+
+
+def delete_variants(name, image_width, storage=default_storage):
+    for width in variant_widths(image_width):
+        for fmt in FORMATS:
+            storage.delete(variant_name(name, width, fmt))
+
+
+def record_image_widths(model, rows):
+    """Store the widths of ``(pk, image name, width)`` rows, one UPDATE per width.
+
+    Rows whose image was replaced in the meantime are left alone. Models
+    with an ``updated_at`` column have it moved on, since the cached
+    product cards key on it.
+    """
+    by_width = defaultdict(list)
+    for pk, name, width in rows:
+        by_width[width].append((pk, name))
+    values = {}
+    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        values['updated_at'] = timezone.now()
+    for width, entries in by_width.items():
+        pks, names = zip(*entries)
+        model.objects.filter(pk__in=pks, image__in=names).update(image_width=width, **values)
+
+
+def try_generate_variants(name):
+    """``(name, width, error)``: ``generate_variants`` that reports failures instead of raising.
+
+    Module-level so the backfill command can run it in a process pool.
+    """
+    try:
+        return name, generate_variants(name), None
+    except (OSError, Image.DecompressionBombError) as exc:
+        return name, None, str(exc)
+
+
+def refresh_variants(model, pk, name):
+    """Generate the variants of row ``pk``'s image and record its width.
+
+    An unreadable image is logged and left without variants, so the
+    original keeps being served. Returns the width, or None.
+    """
+    _, image_width, error = try_generate_variants(name)
+    if error:
+        logger.warning('Could not generate variants of %s: %s', name, error)
+        return None
+    record_image_widths(model, [(pk, name, image_width)])
+    return image_width
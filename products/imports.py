@@ -0,0 +1,342 @@
+"""
+Bulk product import from CSV or JSON Lines feeds.
+
+``read_rows`` streams dictionaries from the feed (plain or gzipped) and
+``ProductImporter`` writes them in batches. Each batch costs a handful of
+queries however large it is:
+
+* categories named by the batch are looked up with one query and the
+  missing ones created with one ``bulk_create``; known ones are remembered
+  for the rest of the import;
+* rows are upserted by ``slug``: one query finds which slugs exist, then
+  new products go through ``bulk_create`` and existing ones through
+  ``bulk_create(update_conflicts=True)``, an ``INSERT ... ON CONFLICT (slug)
+  DO UPDATE`` of just the columns the row carries. (``bulk_update`` builds
+  a ``CASE WHEN id = ...`` per row and column, which made updates several
+  times slower than inserts);
+* rows without a slug are new products; their slugs are derived from the
+  name and made unique against the database with one ``slug__in`` query
+  per allocation round instead of one query per product.
+
+The columns are those written by ``products.exports``; ``id``, ``rating``,
+``review_count`` and the timestamps are ignored. Bulk writes skip the
+model signals, so each batch refreshes the search index, the totals of
+carts holding repriced products and the page cache itself.
+"""
+import csv
+import gzip
+import io
+import json
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from . import autocomplete, page_cache, search
+from .models import Cart, Category, Product
+
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+
+SLUG_LENGTH = Product._meta.get_field('slug').max_length
+TEXT_FIELDS = {'name': 255, 'short_description': 500, 'description': None, 'image': 100,
+               'image_url': 2550}
+DECIMAL_FIELDS = ('price', 'old_price')
+BOOLEAN_VALUES = {'1': True, 'true': True, 'yes': True, 't': True, 'y': True,
+                  '0': False, 'false': False, 'no': False, 'f': False, 'n': False}
+SKIPPED_WHEN_EMPTY = {'name', 'price', 'stock', 'is_active', 'featured'}
+REQUIRED_FOR_CREATE = ('name', 'price', 'category_id')
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_rows(path, fmt=None):
+    """Stream the feed at ``path`` (``-`` for standard input) as dictionaries"""
+    name = path.removesuffix('.gz')
+    fmt = fmt or ('jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv')
+    if path == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    elif path.endswith('.gz'):
+        stream = gzip.open(path, 'rt', encoding='utf-8', newline='')
+    else:
+        stream = open(path, encoding='utf-8', newline='')
+    with stream:
+        if fmt == 'csv':
+            yield from csv.DictReader(stream)
+        else:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def slug_base(name):
+    """The slug derived from ``name``, leaving room for a ``-N`` suffix"""
+    return slugify(name)[:SLUG_LENGTH - 8].strip('-') or 'product'
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def clean_row(raw):
+    """Split a feed row into ``(slug, category, values)``.
+
+    ``slug`` is None when the row has none, ``category`` a ``(slug, name)``
+    pair or None, and ``values`` holds the model fields the row sets.
+    """
+    # An empty name, price, stock or flag means "not given"; other empty
+    # values clear the field
+    raw = {name: value for name, value in raw.items()
+           if name not in SKIPPED_WHEN_EMPTY or _text(value)}
+    values = {}
+    for name, max_length in TEXT_FIELDS.items():
+        if name in raw:
+            values[name] = _text(raw[name])
+            if max_length and len(values[name]) > max_length:
+                raise ImportRowError(f'{name} is longer than {max_length} characters')
+    for name in DECIMAL_FIELDS:
+        if name in raw:
+            text = _text(raw[name])
+            try:
+                values[name] = Decimal(text) if text else None
+            except InvalidOperation:
+                raise ImportRowError(f'{name} is not a number: {text}')
+    if 'stock' in raw:
+        try:
+            values['stock'] = int(_text(raw['stock']))
+        except ValueError:
+            raise ImportRowError(f"stock is not a whole number: {raw['stock']}")
+    for name in ('is_active', 'featured'):
+        if name in raw:
+            value = raw[name]
+            if not isinstance(value, bool):
+                value = BOOLEAN_VALUES.get(_text(value).lower())
+                if value is None:
+                    raise ImportRowError(f'{name} is not a boolean: {raw[name]}')
+            values[name] = value
+
+    slug = _text(raw.get('slug')) or None
+    if slug is not None and slugify(slug) != slug:
+        raise ImportRowError(f'slug is not a valid slug: {slug}')
+    category = (_text(raw.get('category')) or None, _text(raw.get('category_name')) or None)
+    return slug, category if any(category) else None, values
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    categories_created: int = 0
+    errors: list = field(default_factory=list)
+
+    def error(self, row, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'row {row}: {message}')
+
+
+class ProductImporter:
+    """Upsert feed rows into the catalog, ``batch_size`` rows per transaction.
+
+    With ``dry_run`` nothing is written; the statistics report what the
+    import would have done.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.stats = ImportStats()
+        self.category_ids = {}
+        # Slugs a dry run would have created, and where the suffix search of
+        # each derived slug that collided continues
+        self.created_slugs = set()
+        self.next_suffix = {}
+        self._fake_category_id = 0
+
+    def run(self, rows, start=0):
+        """Import ``rows``, numbered from ``start``; yields the rows done after each batch"""
+        batch = []
+        number = start
+        for number, raw in enumerate(rows, start + 1):
+            batch.append((number, raw))
+            if len(batch) == self.batch_size:
+                self.import_batch(batch)
+                batch = []
+                yield number
+        if batch:
+            self.import_batch(batch)
+            yield number
+        if not self.dry_run:
+            autocomplete.reset_index()
+
+    def import_batch(self, batch):
+        self.stats.rows += len(batch)
+        parsed = []
+        for number, raw in batch:
+            try:
+                parsed.append((number, *clean_row(raw)))
+            except ImportRowError as exc:
+                self.stats.error(number, exc)
+
+        with transaction.atomic():
+            self.resolve_categories(category for _, _, category, _ in parsed if category)
+            # Later rows for the same slug win
+            keyed, unkeyed = {}, []
+            for number, slug, category, values in parsed:
+                if category:
+                    values['category_id'] = self.category_ids[category]
+                if slug is None:
+                    unkeyed.append((number, values))
+                else:
+                    keyed[slug] = (number, values)
+
+            # The current name, price and category let an upserted row pass the
+            # NOT NULL checks of the INSERT it turns into an UPDATE
+            existing = {
+                slug: (pk, {'name': name, 'price': price, 'category_id': category_id})
+                for slug, pk, name, price, category_id in Product.objects.filter(
+                    slug__in=keyed
+                ).values_list('slug', 'pk', 'name', 'price', 'category_id')
+            }
+            creates, updates = [], defaultdict(list)
+            for slug, (number, values) in keyed.items():
+                if slug in existing:
+                    pk, current = existing[slug]
+                    updates[tuple(sorted(values)) + ('updated_at',)].append(
+                        (pk, Product(slug=slug, **{**current, **values}))
+                    )
+                elif slug in self.created_slugs:
+                    # Created earlier in this dry run
+                    self.stats.updated += 1
+                else:
+                    creates.append((number, slug, values))
+            slugs = self.allocate_slugs(
+                [slug_base(values.get('name', '')) for _, values in unkeyed],
+                reserved=set(keyed),
+            )
+            creates += [(number, slug, values) for (number, values), slug in zip(unkeyed, slugs)]
+
+            new_products = []
+            for number, slug, values in creates:
+                missing = [name for name in REQUIRED_FOR_CREATE if values.get(name) is None]
+                if missing:
+                    self.stats.error(number, f"new product needs {', '.join(missing)}")
+                    continue
+                values.setdefault('description', '')
+                new_products.append(Product(slug=slug, **values))
+                if self.dry_run:
+                    self.created_slugs.add(slug)
+            self.stats.created += len(new_products)
+            self.stats.updated += sum(len(objs) for objs in updates.values())
+            if self.dry_run:
+                return
+
+            Product.objects.bulk_create(new_products, batch_size=self.batch_size)
+            for fields, rows in updates.items():
+                objs = [obj for _, obj in rows]
+                Product.objects.bulk_create(
+                    objs, batch_size=self.batch_size,
+                    update_conflicts=True, unique_fields=['slug'], update_fields=fields,
+                )
+                for pk, obj in rows:
+                    obj.pk = pk
+            self.after_write(new_products, updates)
+
+    def after_write(self, new_products, updates):
+        """Do what the skipped model signals would have done for the batch"""
+        updated = [obj for rows in updates.values() for _, obj in rows]
+        changed = new_products + updated
+        search.index_products([product.pk for product in changed])
+        repriced = [obj.pk for fields, rows in updates.items() if 'price' in fields for _, obj in rows]
+        if repriced:
+            Cart.refresh_totals(items__product__in=repriced)
+        tags = {'catalog'}
+        for product in changed:
+            tags.add(f'product:{product.pk}')
+            if product.category_id:
+                tags.add(f'category:{product.category_id}')
+        page_cache.invalidate_tags(*tags)
+
+    def resolve_categories(self, keys):
+        """Map every ``(slug, name)`` key to a category id, creating missing categories"""
+        wanted = {}
+        for key in set(keys) - set(self.category_ids):
+            slug, name = key
+            slug = slug or slugify(name)
+            wanted[key] = (slug, name or slug.replace('-', ' ').title())
+        if not wanted:
+            return
+
+        by_slug, by_name = {}, {}
+        for pk, slug, name in Category.objects.filter(
+            Q(slug__in={slug for slug, _ in wanted.values()})
+            | Q(name__in={name for _, name in wanted.values()})
+        ).values_list('pk', 'slug', 'name'):
+            by_slug[slug], by_name[name] = pk, pk
+
+        new_categories = []
+        for key, (slug, name) in wanted.items():
+            category = by_slug.get(slug) or by_name.get(name)
+            if category is None:
+                category = Category(slug=slug, name=name)
+                by_slug[slug] = by_name[name] = category
+                new_categories.append(category)
+            self.category_ids[key] = category
+
+        if new_categories:
+            if self.dry_run:
+                for category in new_categories:
+                    self._fake_category_id -= 1
+                    category.pk = self._fake_category_id
+            else:
+                Category.objects.bulk_create(new_categories)
+            self.stats.categories_created += len(new_categories)
+        for key in wanted:
+            if isinstance(self.category_ids[key], Category):
+                self.category_ids[key] = self.category_ids[key].pk
+
+    def allocate_slugs(self, bases, reserved=()):
+        """Unique slugs for new products named ``bases`` (already slugified).
+
+        Each round proposes ``base``, ``base-2``, ... for every base still
+        short of slugs and keeps the candidates that neither the database
+        (one ``slug__in`` query) nor this import has taken. Bases that
+        collided remember where to continue, so a name repeated across
+        batches does not re-probe its earlier suffixes.
+        """
+        wanted = defaultdict(int)
+        for base in bases:
+            wanted[base] += 1
+        taken = set(reserved) | self.created_slugs
+        found = defaultdict(list)
+        while wanted:
+            candidates = {}
+            for base, count in wanted.items():
+                start = self.next_suffix.get(base, 1)
+                for suffix in range(start, start + count + 2):
+                    candidates[base if suffix == 1 else f'{base}-{suffix}'] = (base, suffix)
+            taken.update(Product.objects.filter(slug__in=candidates).values_list('slug', flat=True))
+            for slug, (base, suffix) in candidates.items():
+                if base not in wanted:
+                    continue
+                if slug in taken:
+                    self.next_suffix[base] = suffix + 1
+                    continue
+                found[base].append(slug)
+                taken.add(slug)
+                if suffix > 1:
+                    self.next_suffix[base] = suffix + 1
+                wanted[base] -= 1
+                if not wanted[base]:
+                    del wanted[base]
+        found = {base: iter(slugs) for base, slugs in found.items()}
+        return [next(found[base]) for base in bases]
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from products.models import Product, Review
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored review count, rating sum and average rating of every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products written per bulk update (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        # One grouped query for every product that has reviews
+        stats = {
+            row['product']: (row['count'], row['total'])
+            for row in Review.objects.values('product').annotate(
+                count=Count('id'), total=Sum('rating')
+            ).order_by()
+        }
+        
+        updated = 0
+        batch = []
+        # Cached product cards key on updated_at
+        now = timezone.now()
+        products = Product.objects.only('id', 'rating', 'review_count', 'rating_sum')
+        with transaction.atomic():
+            for product in products.iterator(chunk_size=batch_size):
+                count, total = stats.get(product.id, (0, 0))
+                if count:
+                    product.rating = round(total / count, 1)
+                product.review_count = count
+                product.rating_sum = total
+                product.updated_at = now
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    Product.objects.bulk_update(batch, ['rating', 'review_count', 'rating_sum', 'updated_at'])
+                    updated += len(batch)
+                    batch = []
+            if batch:
+                Product.objects.bulk_update(batch, ['rating', 'review_count', 'rating_sum', 'updated_at'])
+                updated += len(batch)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Backfilled review stats for {updated} products '
+                f'({len(stats)} with reviews)'
+            )
+        )
@@ -0,0 +1,163 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from products.benchmarks import compare_runs, latency_summary, throwaway_database
+from products.datasets import DatasetGenerator, scale_counts
+from products.models import Cart, Product
+
+VIEWS = ('index', 'product_list', 'product_detail', 'cart_detail', 'search')
+
+
+class Command(BaseCommand):
+    help = ('Time the main views through the test client on a generated dataset and report '
+            'latency percentiles, SQL queries and peak memory as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=10000,
+                            help='Products in the generated dataset (default: 10000)')
+        parser.add_argument('--seed', type=int, default=42, help='Dataset seed (default: 42)')
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Timed requests per view (default: 100)')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Untimed requests per view first (default: 5)')
+        parser.add_argument('--view', action='append', choices=VIEWS, dest='views',
+                            help='Only benchmark this view (repeatable)')
+        parser.add_argument('--page-cache', action='store_true',
+                            help='Keep the anonymous page cache on (off by default, so views do their work)')
+        parser.add_argument('-o', '--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='Compare with the JSON of an earlier run and fail on regressions')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='Allowed latency growth in percent before --compare fails (default: 10)')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read {options['compare']}: {exc}")
+
+        settings = override_settings(QUERY_INSPECTOR_ENABLED=False,
+                                     PAGE_CACHE_ENABLED=options['page_cache'])
+        with throwaway_database(), settings:
+            started = time.perf_counter()
+            DatasetGenerator(**scale_counts(options['scale']), seed=options['seed']).generate()
+            self.stdout.write(f"Generated {options['scale']} products in {time.perf_counter() - started:.1f}s")
+            results = {
+                'meta': self.meta(options),
+                'views': self.run(options['views'] or VIEWS, options['requests'], options['warmup']),
+            }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if baseline is not None:
+            regressions = compare_runs(baseline, results, options['threshold'] / 100)
+            for view, metric, before, after in regressions:
+                self.stdout.write(self.style.ERROR(f'{view} {metric}: {before} -> {after}'))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS(
+                f"No regressions against {options['compare']} (threshold {options['threshold']:g}%)"
+            ))
+
+    def meta(self, options):
+        try:
+            revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                      text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            revision = None
+        return {
+            'revision': revision,
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'scale': options['scale'],
+            'seed': options['seed'],
+            'requests': options['requests'],
+            'page_cache': options['page_cache'],
+        }
+
+    def targets(self):
+        """``{view: (url, client)}`` for every benchmarked view"""
+        anonymous = Client()
+        shopper = Client()
+        cart = Cart.objects.filter(user__isnull=False).order_by('-item_count', 'pk').first()
+        shopper.force_login(cart.user)
+        bestseller = Product.objects.order_by('-review_count', 'pk').first()
+        return {
+            'index': (reverse('products:index'), anonymous),
+            'product_list': (reverse('products:product_list'), anonymous),
+            'product_detail': (reverse('products:product_detail', args=[bestseller.slug]), anonymous),
+            'cart_detail': (reverse('products:cart_detail'), shopper),
+            'search': (reverse('products:search') + '?q=wireless+phone', anonymous),
+        }
+
+    def run(self, views, requests, warmup):
+        targets = self.targets()
+        results = {}
+        self.stdout.write(f"{'view':<16}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                          f"{'queries':>9}{'sql ms':>9}{'peak KiB':>10}")
+        for view in views:
+            url, client = targets[view]
+            for _ in range(warmup):
+                self.request(client, url)
+
+            timings, sql = [], {'queries': 0, 'seconds': 0.0}
+            with connection.execute_wrapper(self.timed_query(sql)):
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    self.request(client, url)
+                    timings.append((time.perf_counter() - started) * 1000)
+
+            # tracemalloc slows Python down, so memory is measured on one
+            # extra request outside the timed ones
+            tracemalloc.start()
+            self.request(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[view] = {
+                'url': url,
+                **latency_summary(timings),
+                'queries': round(sql['queries'] / requests, 2),
+                'sql_ms': round(sql['seconds'] * 1000 / requests, 3),
+                'peak_kib': round(peak / 1024, 1),
+            }
+            row = results[view]
+            self.stdout.write(f"{view:<16}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+                              f"{row['queries']:>9g}{row['sql_ms']:>9.2f}{row['peak_kib']:>10.1f}")
+        return results
+
+    @staticmethod
+    def timed_query(totals):
+        """An ``execute_wrapper`` adding every query and its time to ``totals``"""
+        def wrapper(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                totals['queries'] += 1
+                totals['seconds'] += time.perf_counter() - started
+        return wrapper
+
+    def request(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'GET {url} returned {response.status_code}')
+        return response
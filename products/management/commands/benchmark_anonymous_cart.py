@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+from products.benchmarks import seed_catalog, throwaway_database
+from products.models import Cart, Product
+from products.query_inspector import record_queries
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def session_get_cart(request):
+    """The previous get_cart: a session row and a Cart row per anonymous visitor"""
+    if request.user.is_authenticated:
+        cart, created = Cart.objects.get_or_create(user=request.user)
+    else:
+        session_key = request.session.session_key
+        if not session_key:
+            request.session.create()
+            session_key = request.session.session_key
+        cart, created = Cart.objects.get_or_create(session_key=session_key)
+    return cart
+
+
+class Command(BaseCommand):
+    help = 'Count database writes per anonymous page view for session-backed and cookie carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--visitors', type=int, default=200,
+                            help='Simulated anonymous visitors (default: 200)')
+        parser.add_argument('--buyers', type=float, default=0.2,
+                            help='Share of visitors who add something to the cart (default: 0.2)')
+
+    def handle(self, *args, **options):
+        # The legacy path would trip the inspector's budget warnings on every view
+        with throwaway_database(), override_settings(QUERY_INSPECTOR_ENABLED=False):
+            seed_catalog(200)
+            products = list(Product.objects.order_by('pk')[:20])
+
+            with mock.patch('products.views.get_cart', session_get_cart):
+                before = self.simulate(products, options['visitors'], options['buyers'])
+            self.reset()
+            after = self.simulate(products, options['visitors'], options['buyers'])
+
+        self.stdout.write(f"{'':<24}{'views':>8}{'writes':>9}{'per view':>10}{'carts':>8}{'sessions':>10}")
+        for label, (views, writes, carts, sessions) in [('session + Cart row', before),
+                                                       ('signed cookie', after)]:
+            self.stdout.write(
+                f'{label:<24}{views:>8}{writes:>9}{writes / views:>10.2f}{carts:>8}{sessions:>10}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Writes per anonymous page view: {before[1] / before[0]:.2f} -> {after[1] / after[0]:.2f}'
+        ))
+
+    def reset(self):
+        Cart.objects.all().delete()
+        Session.objects.all().delete()
+
+    def simulate(self, products, visitors, buyers):
+        """Each visitor browses the catalog and opens the cart; some add a product"""
+        views = writes = 0
+        buyer_every = round(1 / buyers) if buyers else 0
+        for i in range(visitors):
+            client = Client()
+            product = products[i % len(products)]
+            requests = [
+                ('get', reverse('products:index')),
+                ('get', reverse('products:product_list')),
+                ('get', reverse('products:product_detail', args=[product.slug])),
+                ('get', reverse('products:cart_detail')),
+            ]
+            if buyer_every and i % buyer_every == 0:
+                requests += [
+                    ('post', reverse('products:add_to_cart', args=[product.pk])),
+                    ('get', reverse('products:cart_detail')),
+                ]
+            for method, url in requests:
+                with record_queries(locate=False) as recorder:
+                    getattr(client, method)(url)
+                views += 1
+                writes += sum(1 for sql, _, _ in recorder.queries if sql.startswith(WRITE_PREFIXES))
+        return views, writes, Cart.objects.count(), Session.objects.count()
@@ -0,0 +1,85 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from products.benchmarks import hammer, seed_catalog, wal_database
+from products.models import Cart, CartItem, Product
+
+
+def legacy_add(cart, product, quantity):
+    """The previous add_to_cart: read the stock, compare in Python, then write"""
+    product = Product.objects.get(pk=product.pk)
+    if quantity > product.stock:
+        return False
+    cart_item, created = CartItem.objects.get_or_create(
+        cart=cart, product=product, defaults={'quantity': quantity}
+    )
+    if not created:
+        new_quantity = cart_item.quantity + quantity
+        if new_quantity > product.stock:
+            return False
+        cart_item.quantity = new_quantity
+        cart_item.save()
+    return True
+
+
+def atomic_add(cart, product, quantity):
+    return cart.add(product, quantity)
+
+
+class Command(BaseCommand):
+    help = 'Stress add-to-cart with concurrent buyers of one product on SQLite in WAL mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32,
+                            help='Concurrent buyers (default: 32)')
+        parser.add_argument('--adds', type=int, default=20,
+                            help='Add-to-cart attempts per buyer (default: 20)')
+        parser.add_argument('--stock', type=int, default=50,
+                            help='Stock of the contended product (default: 50)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This stress test drives SQLite in WAL mode.')
+
+        with wal_database():
+            seed_catalog(10)
+            self.run(options['threads'], options['adds'], options['stock'])
+
+    def run(self, threads, adds, stock):
+        product = Product.objects.order_by('pk').first()
+        Product.objects.filter(pk=product.pk).update(stock=stock)
+        User.objects.bulk_create(User(username=f'buyer{i}') for i in range(threads))
+        buyers = list(User.objects.order_by('pk'))
+
+        self.stdout.write(
+            f'{threads} buyers x {adds} adds of one product with stock {stock}\n\n'
+            f"{'':<38}{'added':>7}{'in carts':>10}{'lost':>6}{'overfilled':>12}"
+            f"{'errors':>8}{'adds/s':>9}"
+        )
+        failures = []
+        for scenario in ('one cart each', 'one shared cart'):
+            for label, add in (('read-modify-write', legacy_add), ('conditional upsert', atomic_add)):
+                CartItem.objects.all().delete()
+                Cart.objects.all().delete()
+                if scenario == 'one cart each':
+                    carts = [Cart.objects.create(user=buyer) for buyer in buyers]
+                else:
+                    carts = [Cart.objects.create(user=buyers[0])] * threads
+
+                added, errors, elapsed = hammer(add, [(cart, product, 1) for cart in carts], adds)
+                in_carts = CartItem.objects.aggregate(total=Sum('quantity'))['total'] or 0
+                overfilled = CartItem.objects.filter(quantity__gt=stock).count()
+                lost = added - in_carts
+                self.stdout.write(
+                    f'{scenario + ", " + label:<38}{added:>7}{in_carts:>10}{lost:>6}{overfilled:>12}'
+                    f'{sum(errors.values()):>8}{threads * adds / elapsed:>9.0f}'
+                )
+                for error, count in errors.items():
+                    self.stdout.write(f'    {count} x {error}')
+                if add is atomic_add and (lost or overfilled or errors):
+                    failures.append(scenario)
+
+        if failures:
+            raise CommandError(f"Conditional upsert was inconsistent in: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('\nConditional upsert: no lost updates, no overfilled lines'))
@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from products import api
+from products.benchmarks import seed_catalog, throwaway_database
+from products.models import Product
+
+
+def serialize_instances(fields):
+    """The model-instance path: build ``Product`` objects, then read their attributes"""
+    getters = {
+        'category': lambda product: product.category.slug,
+        'image': lambda product: product.get_image_url(),
+    }
+    rows = []
+    for product in Product.objects.select_related('category'):
+        rows.append({
+            name: getters[name](product) if name in getters else getattr(product, name)
+            for name in fields
+        })
+    return rows
+
+
+def serialize_values(fields):
+    """The API path: ``values_list()`` tuples zipped into dictionaries"""
+    return api.serialize(api.product_rows(Product.objects.all(), fields), fields)
+
+
+class Command(BaseCommand):
+    help = 'Compare catalog API serialization from values_list() tuples with model instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000,
+                            help='Number of synthetic products (default: 20000)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per path (default: 5)')
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            seed_catalog(options['products'])
+            self.run(options['products'], options['repeat'])
+
+    def run(self, count, repeat):
+        self.stdout.write(f"{'fields':<10}{'path':<14}{'rows/s':>12}{'speedup':>9}")
+        for label, fields in (('list', api.LIST_FIELDS), ('sparse', ('name', 'price'))):
+            baseline = None
+            for path, serialize in (('instances', serialize_instances), ('values_list', serialize_values)):
+                rate = count / self.time(serialize, fields, repeat)
+                baseline = baseline or rate
+                self.stdout.write(f'{label:<10}{path:<14}{rate:>12,.0f}{rate / baseline:>8.1f}x')
+        self.stdout.write(self.style.SUCCESS(f'Serialized {count} products per run'))
+
+    def time(self, serialize, fields, repeat):
+        """Median seconds to serialize the whole catalog"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize(fields)
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
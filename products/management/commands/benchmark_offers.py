@@ -0,0 +1,89 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from products import offers
+from products.benchmarks import hammer, wal_database
+from products.models import Offer
+from products.query_inspector import record_queries
+
+
+def legacy_redeem(offer):
+    """Read the offer, check it in Python, then save the incremented count"""
+    offer = Offer.objects.get(pk=offer.pk)
+    if not offer.is_valid():
+        return False
+    offer.used_count += 1
+    offer.save()
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Price carts against the compiled offers and race concurrent redemptions of one code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32,
+                            help='Concurrent checkouts (default: 32)')
+        parser.add_argument('--attempts', type=int, default=10,
+                            help='Redemption attempts per thread (default: 10)')
+        parser.add_argument('--limit', type=int, default=100,
+                            help='Usage limit of the contended offer (default: 100)')
+        parser.add_argument('--lookups', type=int, default=100000,
+                            help='Cart pricings timed against the compiled offers (default: 100000)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This stress test drives SQLite in WAL mode.')
+
+        with wal_database():
+            now = timezone.now()
+            offer = Offer.objects.create(
+                code='FLASH', name='Flash Sale', description='Flash sale', discount=Decimal('15'),
+                minimum_amount=Decimal('20'), usage_limit=options['limit'],
+                valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1),
+            )
+            self.time_pricing(options['lookups'])
+            self.race(offer, options['threads'], options['attempts'], options['limit'])
+
+    def time_pricing(self, lookups):
+        offers.get_offers()
+        subtotals = [Decimal(i % 500) + Decimal('0.99') for i in range(lookups)]
+        with record_queries(locate=False) as recorder:
+            started = time.perf_counter()
+            for subtotal in subtotals:
+                try:
+                    offers.price('flash', subtotal)
+                except offers.OfferNotApplicable:
+                    pass
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Priced {lookups} carts in {elapsed * 1000:.0f}ms '
+            f'({elapsed / lookups * 1e6:.1f}us each, {len(recorder)} queries)\n'
+        )
+
+    def race(self, offer, threads, attempts, limit):
+        self.stdout.write(
+            f'{threads} threads x {attempts} redemptions of a code limited to {limit} uses\n\n'
+            f"{'':<22}{'redeemed':>10}{'used_count':>12}{'over limit':>12}{'errors':>8}"
+        )
+        compiled = offers.get_offer(offer.code)
+        failed = False
+        for label, redeem in (('read-modify-write', legacy_redeem), ('conditional UPDATE', offers.redeem)):
+            Offer.objects.filter(pk=offer.pk).update(used_count=0)
+            redeemed, errors, _ = hammer(redeem, [(compiled,)] * threads, attempts)
+            used_count = Offer.objects.get(pk=offer.pk).used_count
+            over = max(redeemed - limit, 0)
+            self.stdout.write(
+                f'{label:<22}{redeemed:>10}{used_count:>12}{over:>12}{sum(errors.values()):>8}'
+            )
+            for error, count in errors.items():
+                self.stdout.write(f'    {count} x {error}')
+            if redeem is offers.redeem and (redeemed != limit or used_count != limit or errors):
+                failed = True
+
+        if failed:
+            raise CommandError('The conditional UPDATE over- or under-redeemed the offer')
+        self.stdout.write(self.style.SUCCESS('\nConditional UPDATE redeemed exactly the usage limit'))
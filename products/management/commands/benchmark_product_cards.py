@@ -0,0 +1,51 @@
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+from products.benchmarks import seed_catalog, throwaway_database
+from products.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Time the catalog listings with the product card cache cold and warm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000,
+                            help='Number of synthetic products (default: 2000)')
+        parser.add_argument('--repeat', type=int, default=30,
+                            help='Timed requests per page and cache state (default: 30)')
+
+    def handle(self, *args, **options):
+        with throwaway_database(), override_settings(QUERY_INSPECTOR_ENABLED=False):
+            seed_catalog(options['products'])
+            self.run(options['repeat'])
+
+    def run(self, repeat):
+        category = Category.objects.first()
+        pages = [
+            ('index', reverse('products:index')),
+            ('product_list', reverse('products:product_list')),
+            ('category_products', reverse('products:category_products', args=[category.slug])),
+            ('search', reverse('products:search') + '?q=smart'),
+        ]
+        client = Client()
+        self.stdout.write(f"{'page':<20}{'cold ms':>9}{'warm ms':>9}{'speedup':>9}")
+        for name, url in pages:
+            cold = self.time_page(client, url, repeat, clear=True)
+            warm = self.time_page(client, url, repeat, clear=False)
+            self.stdout.write(f'{name:<20}{cold:>9.2f}{warm:>9.2f}{cold / warm:>8.1f}x')
+
+    def time_page(self, client, url, repeat, clear):
+        """Median response time; ``clear`` empties the cache before every request"""
+        client.get(url)
+        timings = []
+        for _ in range(repeat):
+            if clear:
+                cache.clear()
+            started = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
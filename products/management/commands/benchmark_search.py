@@ -0,0 +1,57 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from products import search
+from products.benchmarks import seed_catalog, throwaway_database
+from products.models import Product
+
+QUERIES = ['smart', 'wireless headphones', 'organic skincare', 'kitchen', 'prof', 'nomatchxyz']
+
+
+class Command(BaseCommand):
+    help = 'Compare FTS5 search against the icontains search on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000,
+                            help='Number of synthetic products (default: 100000)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per query and path (default: 5)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.ERROR('The FTS5 benchmark needs an SQLite database.'))
+            return
+
+        with throwaway_database():
+            elapsed = seed_catalog(options['products'], options['seed'])
+            self.stdout.write(f"Seeded {options['products']} products in {elapsed:.1f}s\n")
+            self.run(options['repeat'])
+
+    def time_first_page(self, queryset, repeat):
+        """Median time to count the results and fetch the first page, like the views do"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            page = Paginator(queryset, 12).get_page(1)
+            list(page)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), page.paginator.count
+
+    def run(self, repeat):
+        base = Product.objects.filter(is_active=True)
+        self.stdout.write(
+            f'{"query":<22}{"icontains hits":>16}{"fts5 hits":>11}'
+            f'{"icontains ms":>15}{"fts5 ms":>10}{"speedup":>10}'
+        )
+        for query in QUERIES:
+            legacy_ms, legacy_count = self.time_first_page(
+                search.icontains_search(base, query).order_by('-created_at'), repeat
+            )
+            fts_ms, fts_count = self.time_first_page(search.search_products(base, query), repeat)
+            self.stdout.write(
+                f'{query:<22}{legacy_count:>16}{fts_count:>11}{legacy_ms:>15.2f}{fts_ms:>10.2f}'
+                f'{legacy_ms / fts_ms if fts_ms else 0:>9.1f}x'
+            )
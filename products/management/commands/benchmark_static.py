@@ -0,0 +1,84 @@
+import gzip
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.contrib.staticfiles.views import serve
+from django.core.management import call_command
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import re_path
+
+ASSETS = ('css/style.css', 'js/main.js')
+# URLconf of the "before" run: the plain files served by the staticfiles view,
+# as runserver does
+urlpatterns = [re_path(r'^static/(?P<path>.*)$', serve, {'insecure': True})]
+
+PRODUCTION_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Compare transfer bytes and time to first byte of the static assets served plainly '
+            'and through collectstatic + WhiteNoise')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Requests per asset and encoding (default: 200)')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        plain_middleware = [name for name in settings.MIDDLEWARE if not name.startswith('whitenoise.')]
+        static_root = tempfile.mkdtemp()
+        try:
+            with override_settings(STATIC_ROOT=static_root, STORAGES=PRODUCTION_STORAGES, DEBUG=False,
+                                   ALLOWED_HOSTS=['testserver']):
+                call_command('collectstatic', interactive=False, verbosity=0)
+                # Each client builds its middleware on its first request
+                plain, whitenoise = Client(), Client()
+                self.stdout.write(f"{'asset':<26}{'bytes':>8}{'TTFB ms':>9}  {'encoding':<9}cache-control")
+                for path in ASSETS:
+                    with override_settings(MIDDLEWARE=plain_middleware, ROOT_URLCONF=__name__):
+                        self.report(f'{path} before', repeat, lambda: plain.get(
+                            f'/static/{path}', HTTP_ACCEPT_ENCODING='gzip, deflate, br',
+                        ))
+                    url = staticfiles_storage.url(path)
+                    for encoding in ('gzip', 'br'):
+                        self.report(f'{path} {encoding}', repeat, lambda: whitenoise.get(
+                            url, HTTP_ACCEPT_ENCODING=encoding,
+                        ))
+        finally:
+            shutil.rmtree(static_root, ignore_errors=True)
+        with open(finders.find('css/critical.css'), 'rb') as f:
+            critical = f.read()
+        self.stdout.write(
+            f'First paint: css/critical.css ({len(critical)} bytes, {len(gzip.compress(critical))} gzipped) '
+            f'is inlined into every page, so style.css, Font Awesome and Google Fonts no longer block rendering.'
+        )
+        self.stdout.write(
+            'Repeat visits: the plain files have no Cache-Control and are fetched or revalidated again; '
+            'the hashed files are immutable for a year and not requested at all.'
+        )
+
+    def report(self, label, repeat, fetch):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = fetch()
+            if response.status_code != 200:
+                raise CommandError(f'{label}: HTTP {response.status_code}')
+            chunks = iter(response.streaming_content) if response.streaming else iter([response.content])
+            first = next(chunks, b'')
+            timings.append((time.perf_counter() - started) * 1000)
+            size = len(first) + sum(len(chunk) for chunk in chunks)
+            response.close()
+        self.stdout.write(
+            f"{label:<26}{size:>8}{statistics.median(timings):>9.3f}  "
+            f"{response.get('Content-Encoding', 'identity'):<9}{response.get('Cache-Control', '-')}"
+        )
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+from products.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Verify the stored cart subtotals and item counts against their cart items'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Recompute the totals of inconsistent carts',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help='Maximum number of inconsistent carts to list (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        expressions = Cart.totals_expressions()
+        mismatched = Cart.objects.annotate(
+            real_item_count=expressions['item_count'],
+            real_subtotal=expressions['subtotal'],
+        ).filter(
+            ~Q(item_count=F('real_item_count')) | ~Q(subtotal=F('real_subtotal'))
+        )
+
+        rows = list(mismatched.values_list(
+            'id', 'item_count', 'real_item_count', 'subtotal', 'real_subtotal'
+        ))
+        checked = Cart.objects.count()
+
+        if not rows:
+            self.stdout.write(self.style.SUCCESS(f'All {checked} cart totals are consistent'))
+            return
+
+        for cart_id, item_count, real_item_count, subtotal, real_subtotal in rows[:options['limit']]:
+            self.stdout.write(
+                f'Cart {cart_id}: items {item_count} (expected {real_item_count}), '
+                f'subtotal {subtotal} (expected {real_subtotal:.2f})'
+            )
+
+        if options['fix']:
+            fixed = Cart.refresh_totals(pk__in=[row[0] for row in rows])
+            self.stdout.write(self.style.SUCCESS(f'Recomputed totals for {fixed} carts'))
+        else:
+            raise CommandError(f'{len(rows)} of {checked} carts have inconsistent totals')
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+from products import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Precompute every product\'s related products from co-review similarity, '
+            'recomputing only the products changed since the last run unless --full is given')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every product')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K,
+                            help=f'Related products stored per product (default: {recommendations.TOP_K})')
+        parser.add_argument('--since', type=parse_datetime,
+                            help='Recompute the products changed since this ISO timestamp instead of the last run')
+
+    def handle(self, *args, **options):
+        since = options['since'] or recommendations.last_run()
+        started = time.perf_counter()
+        if options['full'] or since is None:
+            refreshed, changed = recommendations.refresh_recommendations(top_k=options['top_k'])
+        else:
+            affected = recommendations.affected_products(since)
+            if not affected:
+                self.stdout.write(self.style.SUCCESS(f'No product changed since {since:%Y-%m-%d %H:%M:%S}.'))
+                return
+            refreshed, changed = recommendations.refresh_recommendations(affected, top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Computed related products of {refreshed} products in {time.perf_counter() - started:.1f}s, '
+            f'{changed} changed'
+        ))
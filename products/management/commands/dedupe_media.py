@@ -0,0 +1,123 @@
+import os
+import shutil
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from products import images, page_cache
+from products.models import IMAGE_STORAGE, Product, ProductImage
+from products.storage import content_addressed_name, content_hash, is_content_addressed
+
+MODELS = (Product, ProductImage)
+
+
+class Command(BaseCommand):
+    help = ('Move the uploaded product images to content-addressed names, '
+            'storing identical images once and pointing every row at the shared copy')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it')
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help='Also delete uploaded files no product or gallery image refers to')
+
+    def handle(self, *args, **options):
+        storage = IMAGE_STORAGE
+        dry_run = options['dry_run']
+
+        # Every stored name in use, with the widest recorded variant width
+        widths = {}
+        for model in MODELS:
+            for name, width in model.objects.exclude(image='').exclude(image__isnull=True).values_list(
+                'image', 'image_width'
+            ):
+                widths[name] = max(widths.get(name) or 0, width or 0) or None
+
+        targets, missing = defaultdict(list), []
+        for name in widths:
+            if is_content_addressed(name):
+                continue
+            if not storage.exists(name):
+                missing.append(name)
+                continue
+            with storage.open(name, 'rb') as f:
+                targets[content_addressed_name(name, content_hash(f))].append(name)
+
+        moved = sum(len(sources) for sources in targets.values())
+        freed = sum(storage.size(name) for sources in targets.values() for name in sources)
+        created = [target for target in targets if not storage.exists(target)]
+        freed -= sum(storage.size(targets[target][0]) for target in created)
+        orphans = self.orphans(storage, set(widths) | set(targets)) if options['delete_orphans'] else []
+        freed += sum(storage.size(name) for name in orphans)
+
+        for name in missing:
+            self.stdout.write(self.style.WARNING(f'Missing file, left alone: {name}'))
+        summary = (f'{moved} images in {len(targets)} distinct files, {len(orphans)} orphans, '
+                   f'{freed / 1024 / 1024:.1f} MiB freed')
+        if dry_run:
+            self.stdout.write(f'Would move {summary}')
+            return
+
+        old_names = []
+        for target, sources in targets.items():
+            width = widths.get(target) or next((widths[name] for name in sources if widths[name]), None)
+            if not storage.exists(target):
+                source = next((name for name in sources if widths[name] == width), sources[0])
+                self.link(storage, source, target)
+                if width:
+                    for variant_width in images.variant_widths(width):
+                        for fmt in images.FORMATS:
+                            variant = images.variant_name(source, variant_width, fmt)
+                            if storage.exists(variant):
+                                self.link(storage, variant, images.variant_name(target, variant_width, fmt))
+            with transaction.atomic():
+                for model in MODELS:
+                    values = {'image': target, 'image_width': width}
+                    if model is Product:
+                        values['updated_at'] = timezone.now()
+                    model.objects.filter(image__in=sources).update(**values)
+                page_cache.invalidate_tags('catalog', *(
+                    f'product:{pk}' for pk in Product.objects.filter(image=target).values_list('pk', flat=True)
+                ))
+            old_names += [(name, widths[name]) for name in sources]
+
+        for name, width in old_names + [(name, None) for name in orphans]:
+            storage.delete(name)
+            if width:
+                images.delete_variants(name, width, storage)
+        self.stdout.write(self.style.SUCCESS(f'Moved {summary}'))
+        if Product.objects.filter(image_width__isnull=True).exclude(image='').exclude(image__isnull=True).exists():
+            self.stdout.write('Run generate_image_variants for the images without variants.')
+
+    def link(self, storage, source, target):
+        """Give ``source``'s file the name ``target`` as well, without copying where possible"""
+        target_path = storage.path(target)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            os.link(storage.path(source), target_path)
+        except OSError:
+            shutil.copyfile(storage.path(source), target_path)
+
+    def orphans(self, storage, referenced):
+        """Files in the image upload directory that nothing refers to, variants included"""
+        referenced_stems = {os.path.splitext(name)[0] for name in referenced}
+        upload_to = Product._meta.get_field('image').upload_to.rstrip('/')
+        found = []
+        stack = [upload_to]
+        while stack:
+            directory = stack.pop()
+            if not storage.exists(directory):
+                continue
+            subdirectories, files = storage.listdir(directory)
+            stack += [f'{directory}/{name}' for name in subdirectories]
+            for filename in files:
+                name = f'{directory}/{filename}'
+                parent, base = os.path.split(directory)
+                if base == images.VARIANT_DIRECTORY:
+                    # <dir>/variants/<stem>-<width>w.<ext> belongs to <dir>/<stem>.*
+                    stem = f"{parent}/{os.path.splitext(filename)[0].rsplit('-', 1)[0]}"
+                    if stem not in referenced_stems:
+                        found.append(name)
+                elif name not in referenced:
+                    found.append(name)
+        return found
@@ -0,0 +1,69 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from products import exports
+
+
+class Command(BaseCommand):
+    help = 'Stream the product catalog to a CSV or JSON Lines file, optionally gzipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-',
+                            help='File to write, or - for standard output (default: -)')
+        parser.add_argument('--format', choices=exports.FORMATS,
+                            help='Output format (default: from the file name, else csv)')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress the output (implied by a .gz file name)')
+        parser.add_argument('--category', action='append', default=[],
+                            help='Only products in this category slug; repeat for several')
+        active = parser.add_mutually_exclusive_group()
+        active.add_argument('--active', dest='active', action='store_const', const=True,
+                            help='Only active products')
+        active.add_argument('--inactive', dest='active', action='store_const', const=False,
+                            help='Only inactive products')
+        parser.add_argument('--updated-after', help='Only products updated at or after this date/datetime')
+        parser.add_argument('--updated-before', help='Only products updated before this date/datetime')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE,
+                            help=f'Rows fetched from the database at a time (default: {exports.CHUNK_SIZE})')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        name = output.removesuffix('.gz')
+        fmt = options['format'] or ('jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv')
+        compress = options['gzip'] or output.endswith('.gz')
+        try:
+            rows = exports.export_rows(
+                categories=options['category'],
+                active=options['active'],
+                updated_after=exports.parse_moment(options['updated_after']),
+                updated_before=exports.parse_moment(options['updated_before']),
+                chunk_size=options['chunk_size'],
+            )
+        except exports.ExportError as exc:
+            raise CommandError(exc)
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for count, row in enumerate(rows, 1):
+                yield row
+
+        started = time.perf_counter()
+        target = sys.stdout.buffer if output == '-' else open(output, 'wb')
+        try:
+            for chunk in exports.stream_export(counted(rows), fmt, compress):
+                target.write(chunk)
+        finally:
+            if output == '-':
+                target.flush()
+            else:
+                target.close()
+        elapsed = time.perf_counter() - started
+
+        # Keep standard output clean when the export itself goes there
+        report = self.stderr if output == '-' else self.stdout
+        report.write(self.style.SUCCESS(
+            f'Exported {count} products in {elapsed:.2f}s ({count / max(elapsed, 1e-9):,.0f} rows/s)'
+        ))
@@ -0,0 +1,50 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from products import datasets
+from products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic dataset of products, users, reviews and carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=100000,
+                            help='Number of products; users, reviews and carts scale with it (default: 100000)')
+        parser.add_argument('--users', type=int, help='Number of users (default: scale / 10)')
+        parser.add_argument('--reviews', type=int, help='Number of reviews (default: scale * 2)')
+        parser.add_argument('--carts', type=int, help='Number of carts (default: scale / 20)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--zipf', type=float, default=datasets.ZIPF_EXPONENT,
+                            help=f'Zipf exponent of category sizes and product popularity '
+                                 f'(default: {datasets.ZIPF_EXPONENT})')
+        parser.add_argument('--batch-size', type=int, default=datasets.BATCH_SIZE,
+                            help=f'Rows per bulk insert (default: {datasets.BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        if Product.objects.exists() or Category.objects.exists():
+            raise CommandError('The catalog is not empty; generate the dataset into a fresh database.')
+        if User.objects.filter(username__startswith='shopper').exists():
+            raise CommandError('Synthetic users (shopper*) already exist.')
+
+        counts = datasets.scale_counts(options['scale'])
+        for name in ('users', 'reviews', 'carts'):
+            if options[name] is not None:
+                counts[name] = options[name]
+        if counts['users'] < 1 and (counts['reviews'] or counts['carts']):
+            raise CommandError('Reviews and carts need at least one user.')
+
+        generator = datasets.DatasetGenerator(
+            **counts, seed=options['seed'], batch_size=options['batch_size'],
+            exponent=options['zipf'], report=self.report,
+        )
+        started = time.perf_counter()
+        generator.generate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {counts['products']} products, {counts['users']} users, up to "
+            f"{counts['reviews']} reviews and {counts['carts']} carts in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def report(self, label, rows, seconds):
+        self.stdout.write(f'{label:<14}{rows:>12,} rows {seconds:>8.1f}s {rows / max(seconds, 1e-9):>10,.0f} rows/s')
@@ -0,0 +1,69 @@
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from products import images, page_cache
+from products.models import Product, ProductImage
+
+MODELS = (Product, ProductImage)
+RECORD_EVERY = 200
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized WebP and JPEG variants of uploaded product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Worker processes (default: one per CPU)')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate the variants of images that already have them')
+
+    def handle(self, *args, **options):
+        # Rows sharing a stored file share its variants
+        pending = defaultdict(list)
+        for model in MODELS:
+            rows = model.objects.exclude(image='').exclude(image__isnull=True)
+            if not options['force']:
+                rows = rows.filter(image_width__isnull=True)
+            for pk, name in rows.values_list('pk', 'image'):
+                pending[name].append((model, pk))
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('All images have their variants.'))
+            return
+
+        self.stdout.write(f"Generating variants of {len(pending)} images with {options['workers']} workers")
+        started = time.perf_counter()
+        # Workers only read and write files; don't let them inherit the connection
+        connections.close_all()
+        done, failed, widths = 0, [], defaultdict(list)
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for name, width, error in pool.map(images.try_generate_variants, pending, chunksize=4):
+                if error:
+                    failed.append(f'{name}: {error}')
+                else:
+                    for model, pk in pending[name]:
+                        widths[model].append((pk, name, width))
+                done += 1
+                if done % RECORD_EVERY == 0:
+                    self.record(widths)
+                    self.stdout.write(f'{done}/{len(pending)} images')
+        self.record(widths)
+
+        for message in failed:
+            self.stdout.write(self.style.WARNING(message))
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated variants of {done - len(failed)} images in {time.perf_counter() - started:.1f}s'
+            + (f', {len(failed)} could not be read' if failed else '')
+        ))
+
+    def record(self, widths):
+        """Store the widths collected so far and expire the pages showing those products"""
+        for model, rows in widths.items():
+            images.record_image_widths(model, rows)
+        if widths.get(Product):
+            page_cache.invalidate_tags('catalog', *(f'product:{pk}' for pk, _, _ in widths[Product]))
+        widths.clear()
@@ -0,0 +1,80 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from products import imports
+
+
+class Command(BaseCommand):
+    help = 'Upsert products by slug from a CSV or JSON Lines feed in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Feed to read (.csv, .jsonl, optionally .gz), or - for standard input')
+        parser.add_argument('--format', choices=imports.FORMATS,
+                            help='Feed format (default: from the file name, else csv)')
+        parser.add_argument('--batch-size', type=int, default=imports.BATCH_SIZE,
+                            help=f'Rows written per transaction (default: {imports.BATCH_SIZE})')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate the feed and report what would change without writing')
+        parser.add_argument('--checkpoint',
+                            help='File recording the rows done after each batch; an interrupted '
+                                 'import run again with the same file resumes after them')
+        parser.add_argument('--progress', type=float, default=5,
+                            help='Seconds between progress reports (default: 5)')
+
+    def handle(self, *args, **options):
+        source = options['input']
+        if source != '-' and not os.path.exists(source):
+            raise CommandError(f'No such file: {source}')
+        checkpoint = None if options['dry_run'] else options['checkpoint']
+        start = self.read_checkpoint(checkpoint, source)
+        if start:
+            self.stdout.write(f'Resuming after row {start}')
+
+        importer = imports.ProductImporter(options['batch_size'], dry_run=options['dry_run'])
+        rows = islice(imports.read_rows(source, options['format']), start, None)
+        started = last_report = time.perf_counter()
+        done = start
+        try:
+            for done in importer.run(rows, start):
+                if checkpoint:
+                    self.write_checkpoint(checkpoint, source, done)
+                now = time.perf_counter()
+                if now - last_report >= options['progress']:
+                    last_report = now
+                    self.stdout.write(f'{done:>12,} rows  {(done - start) / (now - started):>10,.0f} rows/s')
+        except (ValueError, UnicodeDecodeError) as exc:
+            # An unreadable feed line; the checkpoint holds the last full batch
+            raise CommandError(f'Could not read the feed after row {done}: {exc}')
+        elapsed = time.perf_counter() - started
+
+        stats = importer.stats
+        for error in stats.errors:
+            self.stdout.write(self.style.WARNING(error))
+        if stats.skipped > len(stats.errors):
+            self.stdout.write(self.style.WARNING(f'... {stats.skipped - len(stats.errors)} more rows skipped'))
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {stats.rows} rows in {elapsed:.2f}s ({stats.rows / max(elapsed, 1e-9):,.0f} rows/s): '
+            f'{stats.created} created, {stats.updated} updated, {stats.skipped} skipped, '
+            f'{stats.categories_created} new categories'
+        ))
+
+    def read_checkpoint(self, path, source):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('source') != os.path.abspath(source):
+            raise CommandError(f"Checkpoint {path} belongs to {state.get('source')}")
+        return state['rows']
+
+    def write_checkpoint(self, path, source, rows):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'source': os.path.abspath(source), 'rows': rows}, f)
+        os.replace(temporary, path)
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# The index as this migration created it; later changes to products.search
+# must not change what an old migration does
+FTS_TABLE = 'products_product_fts'
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, short_description, description, category_name, "
+    "tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+DROP_TABLE_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+POPULATE_SQL = (
+    f"INSERT INTO {FTS_TABLE} "
+    "(rowid, name, short_description, description, category_name) "
+    "SELECT p.id, p.name, p.short_description, p.description, c.name "
+    "FROM products_product p JOIN products_category c ON c.id = p.category_id"
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(DROP_TABLE_SQL)
+    schema_editor.execute(CREATE_TABLE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_review_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.6 on 2026-10-18 00:31
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('products', 'Order')
+    Order.objects.update(total=F('subtotal'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='offer_code',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='offer_code',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
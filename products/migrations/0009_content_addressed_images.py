@@ -0,0 +1,24 @@
+# Generated by Django 4.2.6 on 2026-10-18 01:12
+
+from django.db import migrations, models
+import products.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=products.storage.ContentAddressedStorage(), upload_to='product_images/'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(db_index=True, storage=products.storage.ContentAddressedStorage(), upload_to='product_images/'),
+        ),
+    ]
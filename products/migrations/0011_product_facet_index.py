@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_related_products'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'is_active', 'price', 'rating', 'stock'], name='product_facet_idx'),
+        ),
+    ]
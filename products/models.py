@@ -1,8 +1,18 @@
-from django.db import models
+from decimal import Decimal
+
 from django.contrib.auth.models import User
+from django.db import connection, models, transaction
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import slugify
 
+from . import images
+from .storage import ContentAddressedStorage
+
+IMAGE_STORAGE = ContentAddressedStorage()
+
 
 class Category(models.Model):
     name = models.CharField(max_length=200, unique=True)
@@ -28,7 +38,22 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class ImageVariantsMixin:
+    """Size-aware URLs of a model's ``image``, once ``image_width`` records its variants"""
+
+    def image_variant_url(self, width=None, fmt='jpeg'):
+        """URL of the smallest variant at least ``width`` pixels wide, or of the original"""
+        if width and self.image_width:
+            return images.variant_url(self.image.name, self.image_width, width, fmt)
+        return self.image.url
+
+    def image_srcset(self, fmt='jpeg'):
+        if not (self.image and self.image_width):
+            return ''
+        return images.srcset(self.image.name, self.image_width, fmt)
+
+
+class Product(ImageVariantsMixin, models.Model):
     name = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
@@ -37,20 +62,43 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     old_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     stock = models.IntegerField(default=0)
-    image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+    image = models.ImageField(upload_to='product_images/', storage=IMAGE_STORAGE, blank=True, null=True,
+                              db_index=True)
+    # Width of the uploaded image, set once its resized variants exist
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
     image_url = models.CharField(max_length=2550, blank=True)  # Keeping for backward compatibility
     is_active = models.BooleanField(default=True)
     featured = models.BooleanField(default=False)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        # Listings only ever show active products, so the sort indexes are
+        # partial indexes over active rows; the id tiebreaker used by cursor
+        # pagination comes for free as SQLite's implicit rowid suffix.
         indexes = [
             models.Index(fields=['slug']),
-            models.Index(fields=['category']),
-            models.Index(fields=['featured']),
+            models.Index(fields=['created_at'], condition=models.Q(is_active=True),
+                         name='product_active_created_idx'),
+            models.Index(fields=['price'], condition=models.Q(is_active=True),
+                         name='product_active_price_idx'),
+            models.Index(fields=['rating'], condition=models.Q(is_active=True),
+                         name='product_active_rating_idx'),
+            models.Index(fields=['created_at'], condition=models.Q(is_active=True, featured=True),
+                         name='product_featured_created_idx'),
+            models.Index(fields=['category', 'created_at'], condition=models.Q(is_active=True),
+                         name='product_cat_created_idx'),
+            models.Index(fields=['category', 'price'], condition=models.Q(is_active=True),
+                         name='product_cat_price_idx'),
+            models.Index(fields=['category', 'rating'], condition=models.Q(is_active=True),
+                         name='product_cat_rating_idx'),
+            # Covers the facet counts, grouped by category
+            models.Index(fields=['category', 'is_active', 'price', 'rating', 'stock'],
+                         name='product_facet_idx'),
         ]
     
     def save(self, *args, **kwargs):
@@ -69,9 +117,34 @@ class Product(models.Model):
     def is_in_stock(self):
         return self.stock > 0
     
-    def get_image_url(self):
+    @classmethod
+    def apply_review_delta(cls, product_id, count_delta, rating_delta):
+        """Adjust the stored review aggregates of a product in one UPDATE.
+
+        The average is only recomputed while the product still has reviews,
+        so seeded ratings survive until the first review arrives; removing
+        the last review resets it to 0. ``updated_at`` moves too, since
+        cached product cards key on it.
+        """
+        new_count = F('review_count') + count_delta
+        new_sum = F('rating_sum') + rating_delta
+        cases = [When(review_count__gt=-count_delta, then=Round(Cast(new_sum, FloatField()) / new_count, 1))]
+        if count_delta < 0:
+            cases.append(When(review_count__lte=-count_delta, then=Value(0)))
+        cls.objects.filter(pk=product_id).update(
+            updated_at=timezone.now(),
+            review_count=new_count,
+            rating_sum=new_sum,
+            rating=Case(
+                *cases,
+                default=F('rating'),
+                output_field=models.DecimalField(max_digits=3, decimal_places=2),
+            ),
+        )
+    
+    def get_image_url(self, width=None, fmt='jpeg'):
         if self.image:
-            return self.image.url
+            return self.image_variant_url(width, fmt)
         elif self.image_url:
             return self.image_url
         return '/static/images/no-image.png'
@@ -80,16 +153,84 @@ class Product(models.Model):
         return self.name
 
 
-class ProductImage(models.Model):
+class RelatedProduct(models.Model):
+    """A product's precomputed "related products", best first.
+
+    Written by the ``compute_recommendations`` command: neighbours by
+    co-review similarity, topped up with popular products of the same
+    category. ``computed_at`` is when the product's list last changed.
+    """
+    SOURCES = [
+        ('reviews', 'Co-reviewed'),
+        ('category', 'Same category'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_for')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(default=0)
+    source = models.CharField(max_length=10, choices=SOURCES)
+    computed_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['product', 'rank']
+        # Also the index product_detail reads a product's list through
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='related_product_rank'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} (#{self.rank})"
+
+
+class RecommendationRun(models.Model):
+    """One completed ``compute_recommendations`` run.
+
+    The next incremental run recomputes the products updated since the
+    latest ``started_at``.
+    """
+    started_at = models.DateTimeField(db_index=True)
+    full = models.BooleanField(default=False)
+    products = models.PositiveIntegerField(default=0)
+    changed = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Recommendations at {self.started_at:%Y-%m-%d %H:%M}"
+
+
+class ProductImage(ImageVariantsMixin, models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='product_images/')
+    image = models.ImageField(upload_to='product_images/', storage=IMAGE_STORAGE, db_index=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
     alt_text = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    def get_image_url(self, width=None, fmt='jpeg'):
+        return self.image_variant_url(width, fmt)
+    
     def __str__(self):
         return f"Image for {self.product.name}"
 
 
+def image_references(name):
+    """How many product and gallery images use the stored file ``name``"""
+    return (Product.objects.filter(image=name).count()
+            + ProductImage.objects.filter(image=name).count())
+
+
+def known_image_width(name):
+    """The recorded width of ``name`` if another row sharing it has its variants, else None"""
+    for model in (Product, ProductImage):
+        width = (model.objects.filter(image=name, image_width__isnull=False)
+                 .values_list('image_width', flat=True).first())
+        if width:
+            return width
+    return None
+
+
 class Review(models.Model):
     RATING_CHOICES = [
         (1, '1 Star'),
@@ -110,6 +251,15 @@ class Review(models.Model):
     class Meta:
         unique_together = ['product', 'user']
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='review_product_created_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        # Keep the review write and the product aggregate update (done by the
+        # post_save signal) in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     def __str__(self):
         return f"Review by {self.user.username} for {self.product.name}"
@@ -148,14 +298,83 @@ class Offer(models.Model):
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
     session_key = models.CharField(max_length=40, null=True, blank=True)
+    # Denormalized totals, refreshed whenever an item or a product price changes
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    # Priced by products.offers and only redeemed at checkout
+    offer_code = models.CharField(max_length=20, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    @staticmethod
+    def totals_expressions():
+        """Subquery expressions computing a cart's real item count and subtotal"""
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        return {
+            'item_count': Coalesce(
+                Subquery(items.annotate(total=Sum('quantity')).values('total')), 0
+            ),
+            'subtotal': Coalesce(
+                Subquery(items.annotate(
+                    total=Round(Sum(F('quantity') * F('product__price')), 2,
+                                output_field=models.DecimalField(max_digits=12, decimal_places=2))
+                ).values('total')),
+                Decimal('0'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+        }
+    
+    @classmethod
+    def refresh_totals(cls, **filters):
+        """Recompute the stored totals of the matching carts in one UPDATE"""
+        return cls.objects.filter(**filters).update(**cls.totals_expressions())
+
+    def get_quantity(self, product):
+        return self.items.filter(product=product).values_list('quantity', flat=True).first() or 0
+
+    def add(self, product, quantity):
+        """Add ``quantity`` of ``product`` if its stock allows it; returns whether it did.
+
+        The line is created or grown by one ``INSERT ... ON CONFLICT DO UPDATE``
+        that only writes while the product's stock covers the new quantity,
+        so concurrent adds can neither lose an increment nor overfill the line.
+        """
+        if quantity <= 0:
+            return False
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(CART_ADD_SQL, [self.pk, quantity, now, now, product.pk, quantity])
+            added = cursor.rowcount == 1
+            if added:
+                # Raw SQL skips the CartItem signals
+                Cart.refresh_totals(pk=self.pk)
+        return added
+
+    def set_quantity(self, product, quantity):
+        """Set the line's quantity in one conditional UPDATE; False if stock is short"""
+        if quantity <= 0:
+            self.remove(product)
+            return True
+        with transaction.atomic():
+            updated = self.items.filter(product=product, product__stock__gte=quantity).update(
+                quantity=quantity, updated_at=timezone.now()
+            )
+            if updated:
+                Cart.refresh_totals(pk=self.pk)
+        return bool(updated)
+
+    def remove(self, product):
+        for item in self.items.filter(product=product):
+            item.delete()
+
+    def line_items(self):
+        return list(self.items.select_related('product__category'))
+
     def get_total_price(self):
-        return sum(item.get_total_price() for item in self.items.all())
+        return self.subtotal
     
     def get_total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
     
     def __str__(self):
         if self.user:
@@ -173,9 +392,69 @@ class CartItem(models.Model):
     class Meta:
         unique_together = ['cart', 'product']
     
+    def save(self, *args, **kwargs):
+        # The cart totals are refreshed by the post_save signal in the same
+        # transaction as the item write.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
     def get_total_price(self):
         return self.quantity * self.product.price
     
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
-    
\ No newline at end of file
+    
+
+# Create or grow a cart line, only while stock covers the line's new quantity
+CART_ADD_SQL = f"""
+    INSERT INTO {CartItem._meta.db_table} (cart_id, product_id, quantity, created_at, updated_at)
+    SELECT %s, id, %s, %s, %s FROM {Product._meta.db_table} WHERE id = %s AND stock >= %s
+    ON CONFLICT (cart_id, product_id) DO UPDATE
+    SET quantity = {CartItem._meta.db_table}.quantity + excluded.quantity,
+        updated_at = excluded.updated_at
+    WHERE {CartItem._meta.db_table}.quantity + excluded.quantity <= (
+        SELECT stock FROM {Product._meta.db_table} WHERE id = excluded.product_id
+    )
+"""
+
+
+class Order(models.Model):
+    STATUS_CHOICES = [
+        ('placed', 'Placed'),
+        ('shipped', 'Shipped'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='placed')
+    # Snapshot of the cart at checkout; later price changes don't touch it
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    offer_code = models.CharField(max_length=20, blank=True)
+    discount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def get_absolute_url(self):
+        return reverse('products:order_detail', args=[self.pk])
+    
+    def __str__(self):
+        return f"Order #{self.pk} by {self.user.username}"
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, related_name='+')
+    product_name = models.CharField(max_length=255)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    
+    def get_total_price(self):
+        return self.quantity * self.unit_price
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product_name}"
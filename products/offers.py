@@ -0,0 +1,141 @@
+"""
+In-memory offer engine for coupon codes.
+
+Each process compiles the active offers into plain ``CompiledOffer``
+records keyed by upper-cased code, on first use. Pricing a cart against a
+code is then a dictionary lookup and some ``Decimal`` arithmetic, with no
+database access. The compiled offers are dropped when an ``Offer`` is
+saved or deleted (see ``products.signals``) and, as a safety net for
+changes made by other processes, after ``OFFER_CACHE_SECONDS``.
+
+``used_count`` is deliberately not compiled: it changes on every order.
+``check_available`` reads it when a shopper applies a code, and ``redeem`` claims one use with a single conditional UPDATE
+(``used_count < usage_limit``), so concurrent checkouts can never redeem
+an offer more often than its limit.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Offer
+
+OFFER_CACHE_SECONDS = 60
+CENT = Decimal('0.01')
+
+
+class OfferNotApplicable(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class CompiledOffer:
+    pk: int
+    code: str
+    name: str
+    percentage: bool
+    discount: Decimal
+    minimum_amount: Decimal
+    valid_from: datetime
+    valid_to: datetime
+
+    def check(self, subtotal, now=None):
+        """Raise ``OfferNotApplicable`` unless the offer applies to ``subtotal``"""
+        now = now or timezone.now()
+        if not self.valid_from <= now <= self.valid_to:
+            raise OfferNotApplicable(f'The code {self.code} has expired.')
+        if subtotal < self.minimum_amount:
+            raise OfferNotApplicable(
+                f'The code {self.code} needs a subtotal of at least ${self.minimum_amount}.'
+            )
+
+    def discount_for(self, subtotal):
+        if self.percentage:
+            amount = (subtotal * self.discount / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+        else:
+            amount = self.discount
+        return min(amount, subtotal)
+
+
+_offers = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def compile_offers():
+    now = timezone.now()
+    rows = Offer.objects.filter(is_active=True, valid_to__gte=now).values(
+        'pk', 'code', 'name', 'discount_type', 'discount', 'minimum_amount',
+        'valid_from', 'valid_to',
+    )
+    return {
+        row['code'].upper(): CompiledOffer(
+            pk=row['pk'],
+            code=row['code'],
+            name=row['name'],
+            percentage=row['discount_type'] == 'percentage',
+            discount=row['discount'],
+            minimum_amount=row['minimum_amount'],
+            valid_from=row['valid_from'],
+            valid_to=row['valid_to'],
+        )
+        for row in rows
+    }
+
+
+def get_offers():
+    """Return this process's compiled offers, compiling them when missing or stale"""
+    global _offers, _loaded_at
+    if _offers is None or time.monotonic() - _loaded_at > OFFER_CACHE_SECONDS:
+        with _lock:
+            if _offers is None or time.monotonic() - _loaded_at > OFFER_CACHE_SECONDS:
+                _offers = compile_offers()
+                _loaded_at = time.monotonic()
+    return _offers
+
+
+def invalidate():
+    """Forget the compiled offers; the next lookup recompiles them"""
+    global _offers
+    _offers = None
+
+
+def get_offer(code):
+    """The compiled offer for ``code`` (case-insensitive), or raise ``OfferNotApplicable``"""
+    offer = get_offers().get((code or '').strip().upper())
+    if offer is None:
+        raise OfferNotApplicable(f'{code} is not a valid code.')
+    return offer
+
+
+def price(code, subtotal):
+    """Return ``(offer, discount)`` for ``code`` against ``subtotal``.
+
+    Raises ``OfferNotApplicable`` with a message for the shopper when the
+    code is unknown, expired or below its minimum amount.
+    """
+    offer = get_offer(code)
+    offer.check(subtotal)
+    return offer, offer.discount_for(subtotal)
+
+
+def check_available(offer):
+    """Raise ``OfferNotApplicable`` if every use of ``offer`` has been redeemed"""
+    if Offer.objects.filter(pk=offer.pk, used_count__gte=F('usage_limit')).exists():
+        raise OfferNotApplicable(f'The code {offer.code} has been used up.')
+
+
+def redeem(offer):
+    """Claim one use of ``offer``; False when it is used up or no longer active"""
+    now = timezone.now()
+    return Offer.objects.filter(
+        pk=offer.pk,
+        is_active=True,
+        valid_from__lte=now,
+        valid_to__gte=now,
+        used_count__lt=F('usage_limit'),
+    ).update(used_count=F('used_count') + 1) == 1
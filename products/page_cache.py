@@ -0,0 +1,206 @@
+"""
+Full-page cache for the anonymous catalog.
+
+``@cache_anonymous_page`` stores a view's rendered HTML and serves it again
+to visitors who have nothing personal on the page: no session cookie (so
+they cannot be logged in and have no session messages), no ``messages``
+cookie and no cookie cart. Only those cookies are inspected, so a hit runs
+no queries at all.
+
+Pages are keyed on the path plus the query parameters that change them
+(``q``, the listing filters, ``sort``, ``page`` and ``cursor``). Each page is
+tagged - every listing with ``catalog``, a product page also with
+``product:<id>`` and ``category:<id>`` via ``tag_page`` - and remembers
+the version of each tag it was rendered under. ``invalidate_tags`` (called
+from ``products.signals`` and checkout) moves those versions on, and a
+page whose tags moved is re-rendered on its next request instead of
+waiting out ``PAGE_CACHE_TIMEOUT``.
+
+Cached pages keep the CSRF inputs of their forms as placeholders; each
+visitor gets a fresh token for their own CSRF cookie.
+
+``conditional_page`` adds a weak ETag and Last-Modified to the same
+anonymous pages, both derived from one aggregate over the products the
+page shows (their count and latest ``updated_at``, and their category's).
+A revalidation is answered with 304 before the view builds its querysets
+or renders anything; a page cache hit answers it from the stored headers.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Subquery
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+from django.views.decorators.http import condition
+
+from .cart import COOKIE_NAME as CART_COOKIE_NAME
+
+PAGE_CACHE_TIMEOUT = 60 * 60
+VARY_ON_PARAMS = ('q', 'category', 'price', 'rating', 'in_stock', 'sort', 'page', 'cursor')
+PAGE_KEY = 'page:{}'
+TAG_KEY = 'page-tag:{}'
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+
+CSRF_PLACEHOLDER = 'page-cache-csrf-token'
+_CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def is_enabled():
+    return getattr(settings, 'PAGE_CACHE_ENABLED', True)
+
+
+def is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    personal_cookies = (settings.SESSION_COOKIE_NAME, CookieStorage.cookie_name, CART_COOKIE_NAME)
+    return not any(name in request.COOKIES for name in personal_cookies)
+
+
+def page_key(request):
+    params = [(name, value) for name in VARY_ON_PARAMS for value in sorted(request.GET.getlist(name)) if value]
+    raw = f'{request.path}?{urlencode(params)}'
+    return PAGE_KEY.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def tag_page(request, *tags):
+    """Add invalidation tags to the page being rendered for ``request``"""
+    if hasattr(request, '_page_cache_tags'):
+        request._page_cache_tags.update(tags)
+
+
+def product_tags(product):
+    """Tags of the pages showing ``product``: its own page and its category's product pages"""
+    return (f'product:{product.pk}', f'category:{product.category_id}')
+
+
+def _tag_versions(tags):
+    """Current version of each tag, creating versions for tags never seen before"""
+    keys = {tag: TAG_KEY.format(tag) for tag in tags}
+    found = cache.get_many(keys.values())
+    missing = {key: time.time_ns() for key in keys.values() if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {tag: found[key] for tag, key in keys.items()}
+
+
+def tag_version(tag):
+    """Current version of ``tag``, for caches of their own that expire with the tagged pages"""
+    return _tag_versions([tag])[tag]
+
+
+def _is_current(entry):
+    keys = {TAG_KEY.format(tag): version for tag, version in entry['tags'].items()}
+    current = cache.get_many(keys.keys())
+    return all(current.get(key) == version for key, version in keys.items())
+
+
+def invalidate_tags(*tags):
+    """Expire every cached page carrying one of ``tags`` once the transaction commits"""
+    def bump():
+        version = time.time_ns()
+        cache.set_many({TAG_KEY.format(tag): version for tag in tags}, None)
+    transaction.on_commit(bump)
+
+
+def _serve(entry, request):
+    content = entry['content']
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+    response = HttpResponse(content, content_type=entry['content_type'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    response['X-Page-Cache'] = 'hit'
+    return get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+        response=response,
+    )
+
+
+def _store(key, request, response):
+    if response.status_code != 200 or response.streaming:
+        return
+    # Anything that sets a cookie other than the CSRF one made the page personal
+    if set(response.cookies) - {settings.CSRF_COOKIE_NAME}:
+        return
+    content = _CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode())
+    cache.set(key, {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'headers': {header: response[header] for header in VALIDATOR_HEADERS if response.has_header(header)},
+        'tags': _tag_versions(request._page_cache_tags),
+    }, PAGE_CACHE_TIMEOUT)
+
+
+def cache_anonymous_page(*tags):
+    """Cache the view's page for anonymous visitors, tagged with ``tags``"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not is_enabled() or not is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            key = page_key(request)
+            entry = cache.get(key)
+            if entry is not None and _is_current(entry):
+                response = _serve(entry, request)
+            else:
+                request._page_cache_tags = set(tags)
+                response = view_func(request, *args, **kwargs)
+                _store(key, request, response)
+                response['X-Page-Cache'] = 'miss'
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+def _page_validators(request, products, modified=None):
+    """``(etag, last_modified)`` for an anonymous page showing ``products``, memoized per request"""
+    if not is_cacheable_request(request):
+        # The page carries the visitor's own header and cart badge
+        return None, None
+    if not hasattr(request, '_page_validators'):
+        # In the same query as the products' aggregate
+        extra = {'modified': Max(Subquery(modified))} if modified is not None else {}
+        row = products.aggregate(
+            count=Count('pk'),
+            latest=Max('updated_at'),
+            category_updated=Max('category__updated_at'),
+            **extra,
+        )
+        if row['latest'] is None:
+            request._page_validators = (None, None)
+        else:
+            last_modified = max(row['latest'], row['category_updated'], row.get('modified') or row['latest'])
+            version = int(last_modified.timestamp() * 1_000_000)
+            request._page_validators = (f'W/"{row["count"]}-{version}"', last_modified)
+    return request._page_validators
+
+
+def conditional_page(products, modified=None):
+    """Send ETag and Last-Modified on anonymous pages and answer revalidations with 304.
+
+    ``products`` receives the view's arguments and returns the products
+    (active or not) whose changes alter the page. ``modified``, if given,
+    receives them too and returns a queryset of one datetime: when anything
+    else on the page last changed.
+    """
+    def validators(request, *args, **kwargs):
+        return _page_validators(request, products(*args, **kwargs), modified and modified(*args, **kwargs))
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs)[1],
+    )
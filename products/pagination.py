@@ -0,0 +1,159 @@
+"""
+Keyset (cursor) pagination for the catalog listings.
+
+Instead of ``OFFSET n`` plus a ``COUNT(*)`` on every request, each page is
+fetched with a ``WHERE (sort_key, id) > (last_value, last_id)`` condition
+and ``LIMIT per_page + 1``, so a deep page costs the same as the first one.
+Cursors are opaque URL-safe strings encoding the direction and the boundary
+row's sort value and id.
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+# Orderings the catalog can paginate by, mapped to how their value is decoded
+SUPPORTED_ORDERINGS = {
+    '-created_at': datetime.fromisoformat,
+    'price': Decimal,
+    '-price': Decimal,
+    '-rating': Decimal,
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, value, pk):
+    value = value.isoformat() if isinstance(value, datetime) else str(value)
+    raw = json.dumps([direction, value, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, value, pk = json.loads(raw)
+        value, pk = SUPPORTED_ORDERINGS[ordering](value), int(pk)
+        # NaN, infinities and out of range ids would fail in the query instead
+        if direction not in ('next', 'prev') or not 0 < pk < 2 ** 63 or (
+            isinstance(value, Decimal) and not value.is_finite()
+        ):
+            raise InvalidCursor(cursor)
+        return direction, value, pk
+    except (ValueError, TypeError, InvalidOperation, UnicodeDecodeError) as exc:
+        raise InvalidCursor(cursor) from exc
+
+
+class CursorPage:
+    uses_cursor = True
+
+    def __init__(self, object_list, next_query=None, previous_query=None, first_query=None):
+        self.object_list = object_list
+        self.next_query = next_query
+        self.previous_query = previous_query
+        self.first_query = first_query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_query is not None
+
+    def has_previous(self):
+        return self.previous_query is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Paginate ``queryset`` by ``ordering`` with ``id`` as the tiebreaker.
+
+    ``get_page`` takes the request's GET parameters, reads ``cursor`` from
+    them and returns a ``CursorPage`` whose ``next_query``/``previous_query``
+    are ready-made query strings preserving the other parameters.
+
+    Rows are model instances by default; for ``values()``/``values_list()``
+    querysets pass ``key``, a function returning a row's ``(sort value, id)``.
+    """
+
+    def __init__(self, queryset, ordering, per_page=12, key=None):
+        if ordering not in SUPPORTED_ORDERINGS:
+            raise ValueError(f'Unsupported cursor ordering: {ordering}')
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.descending = ordering.startswith('-')
+        self.field = ordering.lstrip('-')
+        self.key = key or (lambda obj: (getattr(obj, self.field), obj.pk))
+
+    def _order(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        return [f'{prefix}{self.field}', f'{prefix}id']
+
+    def _after(self, value, pk, reverse=False):
+        """Rows strictly after (value, pk) in the (possibly reversed) ordering.
+
+        The redundant ``field <= value`` bound gives the planner an index range
+        to seek into; the OR alone would make it scan from the start.
+        """
+        lookup = 'lt' if self.descending != reverse else 'gt'
+        return Q(**{f'{self.field}__{lookup}e': value}) & (
+            Q(**{f'{self.field}__{lookup}': value}) | Q(**{f'id__{lookup}': pk})
+        )
+
+    def _query(self, params, cursor=None):
+        params = params.copy()
+        params.pop('page', None)
+        if cursor is None:
+            params.pop('cursor', None)
+        else:
+            params['cursor'] = cursor
+        return params.urlencode()
+
+    def _cursor(self, direction, obj):
+        return encode_cursor(direction, *self.key(obj))
+
+    def get_page(self, params):
+        direction, value, pk = 'next', None, None
+        cursor = params.get('cursor')
+        if cursor:
+            try:
+                direction, value, pk = decode_cursor(cursor, self.ordering)
+            except InvalidCursor:
+                cursor = None
+
+        backwards = direction == 'prev'
+        queryset = self.queryset.order_by(*self._order(reverse=backwards))
+        if cursor:
+            queryset = queryset.filter(self._after(value, pk, reverse=backwards))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        if not rows:
+            return CursorPage(rows, first_query=self._query(params))
+
+        if backwards:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+        return CursorPage(
+            rows,
+            next_query=self._query(params, self._cursor('next', rows[-1])) if has_next else None,
+            previous_query=self._query(params, self._cursor('prev', rows[0])) if has_previous else None,
+            first_query=self._query(params),
+        )
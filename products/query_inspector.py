@@ -0,0 +1,151 @@
+"""
+Development and test helpers for keeping an eye on SQL per request.
+
+``QueryInspectorMiddleware`` records every query a request runs, groups
+them by fingerprint (the SQL with literals and IN-lists normalized away)
+and logs any shape repeated ``QUERY_INSPECTOR_REPEAT_THRESHOLD`` times or
+more, with the template line or code line that issued it - the classic
+N+1 pattern. It also checks the view's declared query budget:
+
+    @query_budget(4)
+    def cart_detail(request):
+        ...
+
+The middleware is only active when ``QUERY_INSPECTOR_ENABLED`` is set
+(it defaults to ``DEBUG``); tests check budgets directly with
+``record_queries`` and ``repeated_queries``.
+"""
+import logging
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPEAT_THRESHOLD = 3
+
+_IN_LIST_RE = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+_DJANGO_DIR = os.path.dirname(django.__file__)
+
+
+def fingerprint(sql):
+    """Reduce SQL to its shape so the same query with other values compares equal"""
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    sql = _STRING_RE.sub('?', sql)
+    return _NUMBER_RE.sub('N', sql)
+
+
+def query_budget(max_queries):
+    """Declare the most queries a view may run per request"""
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+def _caller():
+    """Template line or project code line responsible for the current query"""
+    from django.template.base import Node
+
+    frame = sys._getframe(2)
+    code_location = None
+    while frame is not None:
+        # type() rather than isinstance(): the latter would evaluate lazy
+        # objects such as request.user and recurse into another query
+        node = frame.f_locals.get('self')
+        if issubclass(type(node), Node) and getattr(node, 'token', None) is not None:
+            origin = getattr(node, 'origin', None)
+            name = getattr(origin, 'template_name', None) or getattr(origin, 'name', '?')
+            return f'{name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if (code_location is None and not filename.startswith(_DJANGO_DIR)
+                and filename != __file__ and 'site-packages' not in filename):
+            code_location = f'{os.path.relpath(filename)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return code_location or '?'
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` hook collecting (sql, seconds, location)"""
+
+    def __init__(self, locate=True):
+        self.locate = locate
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            location = _caller() if self.locate else None
+            self.queries.append((sql, time.perf_counter() - started, location))
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+
+@contextmanager
+def record_queries(locate=True, using=None):
+    recorder = QueryRecorder(locate=locate)
+    with (using or connection).execute_wrapper(recorder):
+        yield recorder
+
+
+def repeated_queries(queries, threshold=DEFAULT_REPEAT_THRESHOLD):
+    """Return ``(fingerprint, count, locations)`` for shapes run ``threshold`` times or more"""
+    groups = defaultdict(list)
+    for sql, _, location in queries:
+        groups[fingerprint(sql)].append(location)
+    return [
+        (shape, len(locations), sorted({loc for loc in locations if loc}))
+        for shape, locations in groups.items()
+        if len(locations) >= threshold
+    ]
+
+
+class QueryInspectorMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSPECTOR_ENABLED', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(
+            settings, 'QUERY_INSPECTOR_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD
+        )
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(len(recorder))
+        response['X-Query-Time-Ms'] = f'{recorder.total_time * 1000:.1f}'
+
+        for shape, count, locations in repeated_queries(recorder.queries, self.threshold):
+            logger.warning(
+                '%s %s ran the same query %d times (from %s): %s',
+                request.method, request.path, count, ', '.join(locations) or '?', shape,
+            )
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and len(recorder) > budget:
+            logger.warning(
+                '%s %s ran %d queries, over its budget of %d',
+                request.method, request.path, len(recorder), budget,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
@@ -0,0 +1,183 @@
+"""
+Precomputed "related products" from co-review similarity.
+
+``refresh_recommendations`` builds the product x user matrix of review
+ratings as a SciPy sparse matrix, scales every product's row to unit
+length, and multiplies blocks of rows with the transpose: entry ``(i, j)``
+of ``X[block] @ X.T`` is then the cosine similarity of products ``i`` and
+``j`` over the users who reviewed both. The ``top_k`` most similar active
+products of every row are kept (``argpartition``, no full sort) and
+products with fewer neighbours, including those without reviews, are
+topped up with the most reviewed products of their category.
+
+The lists are stored in ``RelatedProduct``, so ``product_detail`` reads
+its related products with a single lookup on the ``(product, rank)``
+index instead of computing anything per request.
+
+An incremental refresh recomputes only the products whose lists can have
+changed since the previous run: products updated since then (new, edited
+or deleted reviews move ``updated_at``, as do edits and deactivation),
+products sharing a reviewer with them, and products listing them. Each
+completed run is recorded in ``RecommendationRun``; its start time, not
+any product timestamp, is the next run's watermark, so edits made while a
+run is going are picked up by the next one. Only lists that actually
+changed are rewritten, with ``computed_at`` set to the write time, and
+only their pages are expired; ``product_detail`` folds ``computed_at``
+into its ETag.
+
+Needs NumPy and SciPy; only this batch job imports them.
+"""
+from itertools import islice
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from scipy import sparse
+
+from . import page_cache
+from .models import Product, RecommendationRun, RelatedProduct, Review
+
+TOP_K = 8
+BLOCK_SIZE = 1000
+WRITE_BATCH_SIZE = 2000
+# Plain executemany: model instances cost more than the whole similarity
+# computation at catalog scale
+INSERT_SQL = f"""
+    INSERT INTO {RelatedProduct._meta.db_table} (product_id, related_id, rank, score, source, computed_at)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+def review_matrix():
+    """``(product_ids, X)``: the sorted ids of reviewed products and their row-normalized rating matrix"""
+    reviews = np.array(Review.objects.values_list('product_id', 'user_id', 'rating'), dtype=np.int64)
+    if not len(reviews):
+        return np.empty(0, dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.float32)
+    product_ids, rows = np.unique(reviews[:, 0], return_inverse=True)
+    _, columns = np.unique(reviews[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix((reviews[:, 2].astype(np.float32), (rows, columns)))
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+    return product_ids, sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+def similar_products(product_ids, matrix, rows, candidates, top_k=TOP_K):
+    """Yield ``(product_id, [(neighbour_id, score), ...])`` for the matrix ``rows``.
+
+    ``candidates`` is a boolean mask over ``product_ids`` of the products
+    that may be recommended. Neighbours are ordered by score, then id.
+    """
+    transposed = matrix.T.tocsr()
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = rows[start:start + BLOCK_SIZE]
+        similarity = matrix[block].dot(transposed).tocsr()
+        for i, row in enumerate(block):
+            begin, end = similarity.indptr[i], similarity.indptr[i + 1]
+            columns, scores = similarity.indices[begin:end], similarity.data[begin:end]
+            keep = (columns != row) & candidates[columns]
+            columns, scores = columns[keep], scores[keep]
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k)[:top_k]
+                columns, scores = columns[best], scores[best]
+            order = np.lexsort((product_ids[columns], -scores))
+            yield int(product_ids[row]), [
+                (int(product_ids[column]), float(score))
+                for column, score in zip(columns[order], scores[order])
+            ]
+
+
+def category_favourites(top_k=TOP_K):
+    """``{category_id: [product_id, ...]}``: the ``top_k + 1`` most reviewed active products per category"""
+    ranked = Product.objects.filter(is_active=True).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=F('category_id'),
+            order_by=[F('review_count').desc(), F('rating').desc(), F('pk').asc()],
+        ),
+    ).filter(position__lte=top_k + 1).order_by('category_id', 'position')
+    favourites = {}
+    for category_id, pk in ranked.values_list('category_id', 'pk'):
+        favourites.setdefault(category_id, []).append(pk)
+    return favourites
+
+
+def last_run():
+    """Start of the latest completed run, or None"""
+    return RecommendationRun.objects.aggregate(latest=Max('started_at'))['latest']
+
+
+def affected_products(since):
+    """Ids of the products whose lists may have changed since ``since``"""
+    changed = set(Product.objects.filter(updated_at__gt=since).values_list('pk', flat=True))
+    if not changed:
+        return changed
+    reviewers = Review.objects.filter(product__in=changed).values('user_id')
+    co_reviewed = Review.objects.filter(user__in=reviewers).values_list('product_id', flat=True).distinct()
+    listing = RelatedProduct.objects.filter(related__in=changed).values_list('product_id', flat=True).distinct()
+    return changed | set(co_reviewed) | set(listing)
+
+
+def _chunks(values, size):
+    values = iter(values)
+    while chunk := list(islice(values, size)):
+        yield chunk
+
+
+def refresh_recommendations(product_ids=None, top_k=TOP_K):
+    """Recompute and store the lists of ``product_ids`` (every product if None).
+
+    Returns ``(refreshed, changed)``: how many lists were computed and how
+    many of them differed from the stored ones.
+    """
+    started = timezone.now()
+    categories = dict(
+        (Product.objects.all() if product_ids is None else Product.objects.filter(pk__in=product_ids))
+        .values_list('pk', 'category_id')
+    )
+    if not categories:
+        return 0, 0
+
+    reviewed_ids, matrix = review_matrix()
+    active = set(Product.objects.filter(is_active=True).values_list('pk', flat=True))
+    candidates = np.fromiter((pk in active for pk in reviewed_ids.tolist()), dtype=bool, count=len(reviewed_ids))
+    targets = np.fromiter(categories, dtype=np.int64, count=len(categories))
+    rows = np.searchsorted(reviewed_ids, targets[np.isin(targets, reviewed_ids)])
+    neighbours = dict(similar_products(reviewed_ids, matrix, rows, candidates, top_k))
+
+    favourites = category_favourites(top_k)
+    lists = {}
+    for pk, category_id in categories.items():
+        chosen = [(related, score, 'reviews') for related, score in neighbours.get(pk, [])]
+        seen = {pk, *(related for related, _, _ in chosen)}
+        for related in favourites.get(category_id, []):
+            if len(chosen) >= top_k:
+                break
+            if related not in seen:
+                chosen.append((related, 0.0, 'category'))
+                seen.add(related)
+        lists[pk] = chosen
+
+    changed = []
+    for chunk in _chunks(lists, WRITE_BATCH_SIZE):
+        stored = {}
+        for pk, related in RelatedProduct.objects.filter(product__in=chunk).order_by('product', 'rank').values_list(
+            'product_id', 'related_id'
+        ):
+            stored.setdefault(pk, []).append(related)
+        changed_chunk = [pk for pk in chunk if stored.get(pk, []) != [related for related, _, _ in lists[pk]]]
+        # When the lists are written, so that their pages' ETags move on
+        computed_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic():
+            RelatedProduct.objects.filter(product__in=changed_chunk).delete()
+            with connection.cursor() as cursor:
+                cursor.executemany(INSERT_SQL, [
+                    (pk, related, rank, score, source, computed_at)
+                    for pk in changed_chunk
+                    for rank, (related, score, source) in enumerate(lists[pk], 1)
+                ])
+            page_cache.invalidate_tags(*(f'product:{pk}' for pk in changed_chunk))
+        changed += changed_chunk
+    RecommendationRun.objects.create(started_at=started, full=product_ids is None, products=len(lists),
+                                     changed=len(changed))
+    return len(lists), len(changed)
@@ -0,0 +1,152 @@
+"""
+Full-text product search backed by an SQLite FTS5 index.
+
+The index lives in the ``products_product_fts`` virtual table, keyed by the
+product id (its ``rowid``). It is kept in sync by the model signals in
+``products.signals`` and can be rebuilt from scratch with the
+``rebuild_search_index`` management command. On other databases the search
+falls back to the original ``icontains`` filters.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+FTS_TABLE = 'products_product_fts'
+
+# bm25() column weights: name, short_description, description, category_name
+BM25_WEIGHTS = (10.0, 4.0, 1.0, 2.0)
+
+MAX_QUERY_TERMS = 16
+
+# Ids bound per statement by index_products; SQLite allows 999 variables
+# on older builds (32766 since 3.32)
+INDEX_BATCH_SIZE = 900
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, short_description, description, category_name, "
+    "tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+DROP_TABLE_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+
+POPULATE_SQL = (
+    f"INSERT INTO {FTS_TABLE} "
+    "(rowid, name, short_description, description, category_name) "
+    "SELECT p.id, p.name, p.short_description, p.description, c.name "
+    "FROM products_product p JOIN products_category c ON c.id = p.category_id"
+)
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_available(using=None):
+    """Return True when the database carries the FTS5 index.
+
+    The index table is created by a migration on SQLite only.
+    """
+    return (using or connection).vendor == 'sqlite'
+
+
+def build_match_expression(query):
+    """Turn free text into a safe FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term, so user input can never inject
+    FTS5 operators and partially typed words still match.
+    """
+    terms = _TERM_RE.findall(query.lower())[:MAX_QUERY_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def icontains_search(queryset, query):
+    """The original substring search, used when FTS5 is unavailable"""
+    return queryset.filter(
+        Q(name__icontains=query) |
+        Q(description__icontains=query) |
+        Q(category__name__icontains=query)
+    )
+
+
+def search_products(queryset, query, ranked=True):
+    """Filter a product queryset down to the rows matching ``query``.
+
+    With ``ranked`` the results are ordered by BM25 relevance (best first);
+    callers that apply their own ordering can pass ``ranked=False``.
+    """
+    if not is_available():
+        return icontains_search(queryset, query)
+
+    match = build_match_expression(query)
+    if not match:
+        return queryset.none()
+
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    queryset = queryset.extra(
+        tables=[FTS_TABLE],
+        where=[
+            f'{FTS_TABLE}.rowid = products_product.id',
+            f'{FTS_TABLE} MATCH %s',
+        ],
+        params=[match],
+        select={'search_rank': f'bm25({FTS_TABLE}, {weights})'},
+    )
+    if ranked:
+        queryset = queryset.order_by('search_rank', '-id')
+    return queryset
+
+
+def index_product(product_id):
+    """Insert or refresh the index row of a single product"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+        cursor.execute(f'{POPULATE_SQL} WHERE p.id = %s', [product_id])
+
+
+def index_products(product_ids):
+    """Insert or refresh the index rows of many products, two statements per ``INDEX_BATCH_SIZE`` ids"""
+    if not is_available():
+        return
+    product_ids = list(product_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+            batch = product_ids[start:start + INDEX_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+            cursor.execute(f'{POPULATE_SQL} WHERE p.id IN ({placeholders})', batch)
+
+
+def remove_product(product_id):
+    """Drop a product from the index"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def reindex_category(category):
+    """Propagate a category rename to the index rows of its products"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {FTS_TABLE} SET category_name = %s WHERE rowid IN '
+            '(SELECT id FROM products_product WHERE category_id = %s)',
+            [category.name, category.pk],
+        )
+
+
+def rebuild_index(using=None):
+    """Recreate the index from the product table; returns the row count"""
+    conn = using or connection
+    if not is_available(conn):
+        return 0
+    with conn.cursor() as cursor:
+        cursor.execute(DROP_TABLE_SQL)
+        cursor.execute(CREATE_TABLE_SQL)
+        cursor.execute(POPULATE_SQL)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
@@ -0,0 +1,232 @@
+from functools import partial
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import autocomplete, images, offers, page_cache, search
+from .cart import load_cart_count, merge_cookie_cart
+from .models import (Cart, CartItem, Category, Offer, Product, ProductImage, Review, image_references,
+                     known_image_width)
+
+SEARCH_INDEXED_FIELDS = {'name', 'slug', 'short_description', 'description', 'category', 'is_active'}
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_review_rating(sender, instance, raw=False, **kwargs):
+    """Record what an edited review counted for before the change"""
+    instance._previous_rating = None
+    if instance.pk and not raw:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk)
+            .values_list('product_id', 'rating')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def update_product_rating_on_save(sender, instance, created, raw=False, **kwargs):
+    """Fold a created or edited review into the product's stored aggregates"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        Product.apply_review_delta(instance.product_id, 1, instance.rating)
+        return
+    previous_product_id, previous_rating = previous
+    if previous_product_id == instance.product_id:
+        # Also run for text-only edits: it moves the product's updated_at,
+        # which the product page's ETag is derived from
+        Product.apply_review_delta(instance.product_id, 0, instance.rating - previous_rating)
+    else:
+        Product.apply_review_delta(previous_product_id, -1, -previous_rating)
+        Product.apply_review_delta(instance.product_id, 1, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_product_rating_on_delete(sender, instance, **kwargs):
+    """Remove a deleted review from the product's stored aggregates"""
+    Product.apply_review_delta(instance.product_id, -1, -instance.rating)
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Refresh the full-text index row when searchable fields change"""
+    if raw:
+        return
+    if update_fields is not None and not SEARCH_INDEXED_FIELDS.intersection(update_fields):
+        return
+    search.index_product(instance.pk)
+    # The process-wide index must not see changes that get rolled back
+    transaction.on_commit(partial(autocomplete.product_changed, instance))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_on_delete(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+    transaction.on_commit(partial(autocomplete.product_deleted, instance.pk))
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_on_save(sender, instance, created, raw=False, **kwargs):
+    """A renamed category changes the searchable text of all its products"""
+    if raw:
+        return
+    transaction.on_commit(partial(autocomplete.category_changed, instance))
+    if not created:
+        search.reindex_category(instance)
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(autocomplete.category_deleted, instance.pk))
+
+
+def forget_replaced_image(instance, previous_image, previous_width):
+    """A newly uploaded image has no variants yet; the old file may be unused now"""
+    instance._replaced_image = None
+    if (previous_image or '') != (instance.image.name or ''):
+        instance.image_width = None
+        if previous_image:
+            instance._replaced_image = (previous_image, previous_width)
+
+
+def release_image(storage, name, image_width):
+    """Delete the stored file ``name`` and its variants once no row refers to it"""
+    def release():
+        if image_references(name):
+            return
+        storage.delete(name)
+        if image_width:
+            images.delete_variants(name, image_width, storage)
+
+    transaction.on_commit(release)
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_price(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_price = instance._previous_category_id = None
+    if instance.pk and not raw and (update_fields is None or {'price', 'category', 'image'} & set(update_fields)):
+        instance._previous_price, instance._previous_category_id, *previous_image = (
+            Product.objects.filter(pk=instance.pk)
+            .values_list('price', 'category_id', 'image', 'image_width').first()
+            or (None, None, None, None)
+        )
+        if update_fields is None or 'image' in update_fields:
+            forget_replaced_image(instance, *previous_image)
+
+
+@receiver(pre_save, sender=ProductImage)
+def remember_previous_image(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        forget_replaced_image(instance, *(
+            ProductImage.objects.filter(pk=instance.pk).values_list('image', 'image_width').first()
+            or (None, None)
+        ))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def generate_image_variants_on_upload(sender, instance, raw=False, **kwargs):
+    """Resize a new upload once the transaction has stored it.
+
+    An image already stored for another row shares that row's variants.
+    """
+    if raw:
+        return
+    replaced = getattr(instance, '_replaced_image', None)
+    if replaced:
+        instance._replaced_image = None
+        previous_image, previous_width = replaced
+        if previous_image == instance.image.name and previous_width:
+            # The same bytes uploaded again: same name, same variants
+            instance.image_width = previous_width
+            images.record_image_widths(sender, [(instance.pk, previous_image, previous_width)])
+        else:
+            release_image(instance.image.storage, previous_image, previous_width)
+    if not instance.image or instance.image_width is not None:
+        return
+    pk, name = instance.pk, instance.image.name
+
+    def generate():
+        width = known_image_width(name)
+        if width:
+            images.record_image_widths(sender, [(pk, name, width)])
+        else:
+            width = images.refresh_variants(sender, pk, name)
+        instance.image_width = width
+        if width and sender is Product:
+            page_cache.invalidate_tags('catalog', *page_cache.product_tags(instance))
+
+    transaction.on_commit(generate)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def release_image_on_delete(sender, instance, **kwargs):
+    if instance.image:
+        release_image(instance.image.storage, instance.image.name, instance.image_width)
+
+
+@receiver(post_save, sender=Product)
+def refresh_cart_totals_on_price_change(sender, instance, created, raw=False, **kwargs):
+    """Carts holding a repriced product get their subtotal recomputed"""
+    previous = getattr(instance, '_previous_price', None)
+    if raw or created or previous is None or previous == instance.price:
+        return
+    Cart.refresh_totals(items__product=instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def expire_pages_on_product_change(sender, instance, raw=False, **kwargs):
+    """Drop the cached listings, the product's page and its category siblings' pages"""
+    if raw:
+        return
+    tags = ['catalog', *page_cache.product_tags(instance)]
+    previous_category_id = getattr(instance, '_previous_category_id', None)
+    if previous_category_id and previous_category_id != instance.category_id:
+        tags.append(f'category:{previous_category_id}')
+    page_cache.invalidate_tags(*tags)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def expire_pages_on_category_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    page_cache.invalidate_tags('catalog', f'category:{instance.pk}')
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def expire_pages_on_review_change(sender, instance, raw=False, **kwargs):
+    """Reviews change the product's page and the ratings shown on every card"""
+    if raw:
+        return
+    category_id = Product.objects.filter(pk=instance.product_id).values_list('category_id', flat=True).first()
+    page_cache.invalidate_tags('catalog', f'product:{instance.product_id}', f'category:{category_id}')
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def refresh_cart_totals_on_item_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Cart.refresh_totals(pk=instance.cart_id)
+
+
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+def recompile_offers_on_change(sender, **kwargs):
+    # After commit, or a lookup in between would compile the old rows again
+    transaction.on_commit(offers.invalidate)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart_on_login(sender, request, user, **kwargs):
+    """Move what the visitor put in their cookie cart into their account's cart"""
+    if request is None or merge_cookie_cart(request, user) is None:
+        # Nothing merged: still warm the badge count so pages don't look it up
+        load_cart_count(user)
@@ -0,0 +1,62 @@
+"""
+Content-addressed storage for product images.
+
+``ContentAddressedStorage`` names every upload after the SHA-256 of its
+bytes, in a two-character shard of the field's upload directory::
+
+    product_images/shoe.jpg -> product_images/3f/3fa2...9c.jpg
+
+Uploading the same image again, for another product or as a gallery
+image, therefore lands on the same name, and the file (and the variants
+generated from it) is written only once. A stored file never changes, so
+it can be served with a far-future ``immutable`` cache header.
+
+Several rows can share a file, so a file is only deleted once no
+``Product.image`` or ``ProductImage.image`` refers to it any more (see
+``products.models.image_references``).
+"""
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# <upload dir>/<shard>/<sha256>.<ext>, and the variants generated from it
+CONTENT_ADDRESSED_RE = re.compile(r'(^|/)([0-9a-f]{2})/(variants/)?\2[0-9a-f]{62}(-\d+w)?\.\w+$')
+
+
+def content_hash(content):
+    """Hex SHA-256 of a Django ``File``, read in chunks; rewinds it afterwards"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def content_addressed_name(name, digest):
+    directory, filename = posixpath.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return posixpath.join(directory, digest[:2], f'{digest}{extension}')
+
+
+def is_content_addressed(name):
+    """Whether ``name`` is a stored upload or one of its variants, whose bytes never change"""
+    return bool(CONTENT_ADDRESSED_RE.search(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = content_addressed_name(name, content_hash(content))
+        if self.exists(name):
+            return name
+        # Two simultaneous first uploads of an image race for the name; the
+        # loser is stored under a suffixed name, which is merely not shared
+        return super().save(name, content, max_length)
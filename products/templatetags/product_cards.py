@@ -0,0 +1,46 @@
+"""
+``{% product_card product %}``: the catalog's product card, cached per product.
+
+The rendered card is stored in the default cache under a key built from the
+product's id and ``updated_at``. Every change that shows on a card (edits,
+new reviews, stock sold at checkout) moves ``updated_at`` forward, so stale
+cards are never served; they simply age out of the cache.
+
+Cards hold an add-to-cart form, so the card is rendered with a placeholder
+CSRF token and the visitor's real token is swapped in on every use.
+"""
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+CARD_TEMPLATE = 'products/includes/product_card.html'
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+CSRF_PLACEHOLDER = 'product-card-csrf-token'
+
+
+def card_cache_key(product, latest=False):
+    variant = 'latest' if latest else 'card'
+    return f'product-card:{variant}:{product.pk}:{product.updated_at.timestamp()}'
+
+
+def render_card(product, latest=False):
+    return render_to_string(CARD_TEMPLATE, {
+        'product': product,
+        'latest': latest,
+        'csrf_token': CSRF_PLACEHOLDER,
+    })
+
+
+@register.simple_tag(takes_context=True)
+def product_card(context, product, latest=False):
+    key = card_cache_key(product, latest)
+    html = cache.get(key)
+    if html is None:
+        html = render_card(product, latest)
+        cache.set(key, html, CARD_CACHE_TIMEOUT)
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, str(context.get('csrf_token', '')))
+    return mark_safe(html)
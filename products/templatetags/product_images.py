@@ -0,0 +1,21 @@
+"""
+Responsive image filters for models with resized image variants.
+
+``{{ product|image_url:640 }}`` is the URL of the smallest variant at least
+640 pixels wide (the original when there are no variants yet), and
+``{{ product|image_srcset:'webp' }}`` the ``srcset`` list of all variants
+in one format, empty without variants.
+"""
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def image_url(obj, width):
+    return obj.get_image_url(int(width))
+
+
+@register.filter
+def image_srcset(obj, fmt='jpeg'):
+    return obj.image_srcset(fmt)
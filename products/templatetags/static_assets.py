@@ -0,0 +1,34 @@
+"""
+``{% inline_static 'css/critical.css' %}``: the contents of a static file,
+for inlining into the page (critical CSS in a ``<style>`` element).
+
+The file is read through the staticfiles finders, or from ``STATIC_ROOT``
+when the source directories are not deployed, and kept in memory; with
+``DEBUG`` it is re-read on every render so edits show up immediately.
+"""
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+_contents = {}
+
+
+def read_static(path):
+    if path not in _contents or settings.DEBUG:
+        source = finders.find(path)
+        if source:
+            with open(source, encoding='utf-8') as f:
+                _contents[path] = f.read()
+        else:
+            with staticfiles_storage.open(path) as f:
+                _contents[path] = f.read().decode('utf-8')
+    return _contents[path]
+
+
+@register.simple_tag
+def inline_static(path):
+    return mark_safe(read_static(path))
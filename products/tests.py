@@ -1,3 +1,1418 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.http import QueryDict
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import autocomplete, benchmarks, datasets, facets, images, offers, recommendations, search
+from .benchmarks import compare_runs, latency_summary
+from .checkout import OutOfStock, place_order
+from .models import (Cart, CartItem, Category, Offer, Order, Product, ProductImage, RecommendationRun, RelatedProduct,
+                     Review)
+from .pagination import encode_cursor
+from .recommendations import refresh_recommendations
+from .search import search_products
+from .views import SORT_ORDERINGS, serve_media
+from .query_inspector import fingerprint, record_queries, repeated_queries
+
+
+class QueryPlanTests(TestCase):
+    """Every catalog query must be answered from an index.
+
+    Each test renders a view, captures the SQL it runs and checks the
+    ``EXPLAIN QUERY PLAN`` of every SELECT for full table scans and for
+    sorts spilled into a temporary B-tree.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.electronics = Category.objects.create(name='Electronics')
+        cls.books = Category.objects.create(name='Books')
+        now = timezone.now()
+        for i in range(30):
+            product = Product.objects.create(
+                name=f'Product {i}',
+                category=cls.electronics if i % 2 else cls.books,
+                description='Description',
+                price=Decimal(10 + i % 7),
+                rating=Decimal(i % 5),
+                stock=5,
+                featured=i % 3 == 0,
+                is_active=i != 7,
+            )
+            # Spread creation times, with some ties for the id tiebreaker
+            Product.objects.filter(pk=product.pk).update(created_at=now - timedelta(minutes=i // 2))
+        cls.product = Product.objects.filter(category=cls.electronics, is_active=True).first()
+        user = User.objects.create_user('reviewer', password='secret')
+        Review.objects.create(product=cls.product, user=user, rating=4, title='Good', comment='Nice')
+
+    def setUp(self):
+        cache.clear()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexedQueries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            for detail in self.explain(sql):
+                self.assertNotIn('TEMP B-TREE', detail, f'{url} sorts without an index:\n{sql}')
+                if detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail:
+                    self.assertIn(' INDEX ', detail, f'{url} scans a table:\n{sql}')
+        return response
+
+    def test_index(self):
+        self.assertIndexedQueries(reverse('products:index'))
+
+    def test_product_list_sorts(self):
+        url = reverse('products:product_list')
+        for sort in ['', 'newest', 'price_low', 'price_high', 'rating']:
+            with self.subTest(sort=sort):
+                self.assertIndexedQueries(f'{url}?sort={sort}')
+
+    def test_product_list_category_sorts(self):
+        url = reverse('products:product_list')
+        for sort in ['newest', 'price_low', 'price_high', 'rating']:
+            with self.subTest(sort=sort):
+                self.assertIndexedQueries(f'{url}?category={self.electronics.slug}&sort={sort}')
+
+    def test_product_list_deep_page(self):
+        url = reverse('products:product_list')
+        for sort in ['newest', 'price_low', 'price_high', 'rating']:
+            with self.subTest(sort=sort):
+                first = self.client.get(f'{url}?sort={sort}')
+                next_query = first.context['page_obj'].next_query
+                self.assertIsNotNone(next_query)
+                self.assertIndexedQueries(f'{url}?{next_query}')
+
+    def test_category_products(self):
+        url = reverse('products:category_products', args=[self.electronics.slug])
+        first = self.assertIndexedQueries(url)
+        self.assertIndexedQueries(f"{url}?{first.context['page_obj'].next_query}")
+
+    def test_product_detail(self):
+        self.assertIndexedQueries(reverse('products:product_detail', args=[self.product.slug]))
+
+    def test_product_detail_with_recommendations(self):
+        refresh_recommendations()
+        self.assertIndexedQueries(reverse('products:product_detail', args=[self.product.slug]))
+
+    def test_api_product_list(self):
+        url = reverse('products:api_product_list')
+        for sort in ['newest', 'price_low', 'price_high', 'rating']:
+            with self.subTest(sort=sort):
+                first = self.assertIndexedQueries(f'{url}?sort={sort}&limit=5')
+                self.assertIndexedQueries(first.json()['next'])
+
+
+class QueryBudgetTests(TestCase):
+    """Views stay within their declared @query_budget and run no N+1 queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name=f'Category {i}') for i in range(4)]
+        cls.products = [
+            Product.objects.create(
+                name=f'Product {i}', category=categories[i % 4], description='Description',
+                short_description='Short', price=Decimal('9.99'), stock=10, featured=i % 2 == 0,
+            )
+            for i in range(16)
+        ]
+        cls.user = User.objects.create_user('shopper', password='secret')
+        for product in cls.products[:5]:
+            Review.objects.create(product=product, user=cls.user, rating=5, title='Great', comment='Great')
+        cart = Cart.objects.create(user=cls.user)
+        for product in cls.products[:6]:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+    def assertWithinBudget(self, url):
+        budget = resolve(url.split('?')[0]).func.query_budget
+        with record_queries() as recorder:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(recorder), budget, [sql for sql, _, _ in recorder.queries])
+        self.assertEqual(repeated_queries(recorder.queries), [])
+
+    def setUp(self):
+        cache.clear()
+
+    def catalog_urls(self):
+        return [
+            reverse('products:index'),
+            reverse('products:product_list'),
+            reverse('products:product_list') + '?sort=price_low',
+            reverse('products:category_products', args=[self.products[0].category.slug]),
+            reverse('products:product_detail', args=[self.products[0].slug]),
+            reverse('products:search') + '?q=product',
+        ]
+
+    def test_catalog_pages_anonymous(self):
+        for url in self.catalog_urls():
+            with self.subTest(url=url):
+                self.assertWithinBudget(url)
+
+    def test_catalog_pages_authenticated(self):
+        self.client.force_login(self.user)
+        for url in self.catalog_urls():
+            with self.subTest(url=url):
+                self.assertWithinBudget(url)
+
+    def test_cart_detail(self):
+        self.client.force_login(self.user)
+        self.assertWithinBudget(reverse('products:cart_detail'))
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 1 AND b = 'x' AND c IN (%s, %s)"),
+            fingerprint("SELECT * FROM t WHERE a = 25 AND b = 'y''z' AND c IN (%s)"),
+        )
+
+    def test_repeated_queries_flags_n_plus_one(self):
+        with record_queries() as recorder:
+            for product in Product.objects.all()[:4]:
+                product.category.name
+        (shape, count, locations), = repeated_queries(recorder.queries)
+        self.assertIn('products_category', shape)
+        self.assertEqual(count, 4)
+        self.assertTrue(all(location.startswith('products/tests.py') for location in locations))
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.outdoor = Category.objects.create(name='Outdoor')
+        cls.jacket = Product.objects.create(name='Waterproof Jacket', category=cls.outdoor, description='For rain',
+                                            price=Decimal('90'), stock=3)
+        cls.poncho = Product.objects.create(name='Poncho', category=cls.outdoor,
+                                            description='A light waterproof layer', price=Decimal('20'), stock=3)
+
+    def search(self, query):
+        return list(search_products(Product.objects.filter(is_active=True), query).values_list('name', flat=True))
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('waterproof'), ['Waterproof Jacket', 'Poncho'])
+        self.assertEqual(self.search('waterpr'), ['Waterproof Jacket', 'Poncho'])
+
+    def test_index_follows_product_saves(self):
+        self.jacket.name = 'Storm Shell'
+        self.jacket.save()
+        self.assertEqual(self.search('storm'), ['Storm Shell'])
+        self.assertEqual(self.search('waterproof'), ['Poncho'])
+        self.poncho.delete()
+        self.assertEqual(self.search('waterproof'), [])
+
+    def test_index_follows_category_rename_and_delete(self):
+        self.outdoor.name = 'Hiking'
+        self.outdoor.save()
+        self.assertEqual(sorted(self.search('hiking')), ['Poncho', 'Waterproof Jacket'])
+        self.assertEqual(self.search('outdoor'), [])
+        self.outdoor.delete()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM products_product_fts')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_index_products_binds_ids_in_batches(self):
+        # update() sends no signal, so only index_products refreshes the rows
+        Product.objects.update(description='Packable')
+        with mock.patch.object(search, 'INDEX_BATCH_SIZE', 1):
+            search.index_products([self.jacket.pk, self.poncho.pk])
+        self.assertEqual(sorted(self.search('packable')), ['Poncho', 'Waterproof Jacket'])
+
+    def test_result_pages_keep_the_category_filter(self):
+        for i in range(12):
+            Product.objects.create(name=f'Rain Cover {i}', category=self.outdoor, description='d',
+                                   price=Decimal('5'), stock=1)
+        response = self.client.get(reverse('products:product_list'), {'q': 'rain', 'category': 'outdoor'})
+        self.assertContains(response, 'href="?q=rain&amp;category=outdoor&page=2"')
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.audio = Category.objects.create(name='Audio')
+        cls.headphones = Product.objects.create(name='Wireless Headphones', category=cls.audio, description='d',
+                                                price=Decimal('60'), stock=3, featured=True)
+        Product.objects.create(name='Wired Earbuds', category=cls.audio, description='d', price=Decimal('15'),
+                               stock=3)
+
+    def setUp(self):
+        autocomplete.reset_index()
+        self.addCleanup(autocomplete.reset_index)
+
+    def labels(self, query):
+        response = self.client.get(reverse('products:autocomplete'), {'q': query})
+        return [result['label'] for result in response.json()['results']]
+
+    def test_prefix_and_typo_matches(self):
+        self.assertEqual(self.labels('wir'), ['Wireless Headphones', 'Wired Earbuds'])
+        self.assertEqual(self.labels('wireless head'), ['Wireless Headphones'])
+        self.assertEqual(self.labels('aud'), ['Audio'])
+        # No word starts with "headphnes": corrected through trigrams
+        self.assertEqual(self.labels('headphnes'), ['Wireless Headphones'])
+        self.assertEqual(self.labels('w'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.labels('wir')
+        with self.captureOnCommitCallbacks(execute=True):
+            speaker = Product.objects.create(name='Wireless Speaker', category=self.audio, description='d',
+                                             price=Decimal('40'), stock=3)
+        self.assertIn('Wireless Speaker', self.labels('speak'))
+        with self.captureOnCommitCallbacks(execute=True):
+            speaker.name = 'Bluetooth Speaker'
+            speaker.save()
+        self.assertEqual(self.labels('speak'), ['Bluetooth Speaker'])
+        with self.captureOnCommitCallbacks(execute=True):
+            speaker.delete()
+        self.assertEqual(self.labels('speak'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.headphones.is_active = False
+            self.headphones.save()
+        self.assertEqual(self.labels('wir'), ['Wired Earbuds'])
+
+    def test_rolled_back_changes_stay_out_of_the_index(self):
+        self.labels('wir')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Product.objects.create(name='Wireless Speaker', category=self.audio, description='d',
+                                   price=Decimal('40'), stock=3)
+            self.audio.delete()
+            raise RuntimeError
+        self.assertEqual(self.labels('speak'), [])
+        self.assertEqual(self.labels('aud'), ['Audio'])
+
+    def test_full_index_evicts_the_lowest_ranked_product(self):
+        index = autocomplete.AutocompleteIndex(max_entries=2)
+        index.add('category', 1, 'Audio', '/c/audio/')
+        index.add('product', 1, 'Wired Earbuds', '/p/earbuds/')
+        with self.assertLogs('products.autocomplete', 'INFO'):
+            index.add('product', 2, 'Wireless Speaker', '/p/speaker/')
+        self.assertEqual([hit['label'] for hit in index.suggest('wi')], ['Wireless Speaker'])
+        self.assertEqual(len(index), 2)
+        with self.assertLogs('products.autocomplete', 'WARNING'):
+            index.add('category', 2, 'Video', '/c/video/')
+            index.add('category', 3, 'Games', '/c/games/')
+        self.assertEqual(index.suggest('games'), [])
+
+    def test_eviction_skips_removed_products(self):
+        index = autocomplete.AutocompleteIndex(max_entries=3)
+        for pk, name in enumerate(['Red Shirt', 'Blue Shirt', 'Green Shirt'], 1):
+            index.add('product', pk, name, f'/p/{pk}/')
+        index.remove('product', 3)
+        index.add('product', 4, 'Pink Shirt', '/p/4/')
+        index.add('product', 5, 'Grey Shirt', '/p/5/')
+        self.assertEqual([hit['label'] for hit in index.suggest('shirt')], ['Red Shirt', 'Blue Shirt', 'Grey Shirt'])
+
+class ReviewAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Clothing')
+        cls.shirt = Product.objects.create(name='Shirt', category=category, description='d', price=Decimal('20'),
+                                           rating=Decimal('4.5'), stock=5)
+        cls.jacket = Product.objects.create(name='Jacket', category=category, description='d', price=Decimal('80'),
+                                            stock=5)
+        cls.users = [User.objects.create_user(f'reviewer{i}') for i in range(2)]
+
+    def assertAggregates(self, product, rating, count, total):
+        product.refresh_from_db()
+        self.assertEqual((product.rating, product.review_count, product.rating_sum), (Decimal(rating), count, total))
+
+    def review(self, user, product, rating):
+        return Review.objects.create(product=product, user=self.users[user], rating=rating, title='t', comment='c')
+
+    def test_create_edit_move_and_delete(self):
+        # The seeded rating survives until the first review
+        self.assertAggregates(self.shirt, '4.5', 0, 0)
+        first = self.review(0, self.shirt, 5)
+        self.assertAggregates(self.shirt, '5', 1, 5)
+        second = self.review(1, self.shirt, 2)
+        self.assertAggregates(self.shirt, '3.5', 2, 7)
+
+        first.rating = 4
+        first.save()
+        self.assertAggregates(self.shirt, '3', 2, 6)
+
+        second.product = self.jacket
+        second.save()
+        self.assertAggregates(self.shirt, '4', 1, 4)
+        self.assertAggregates(self.jacket, '2', 1, 2)
+
+        first.delete()
+        self.assertAggregates(self.shirt, '0', 0, 0)
+        second.delete()
+        self.assertAggregates(self.jacket, '0', 0, 0)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Clothing')
+        start = timezone.now() - timedelta(days=30)
+        for i in range(30):
+            # Few distinct values, so most pages break ties by id
+            product = Product.objects.create(name=f'Item {i}', category=cls.category, description='d',
+                                             price=Decimal(10 + i % 4), rating=Decimal(i % 3), stock=1)
+            Product.objects.filter(pk=product.pk).update(created_at=start + timedelta(days=i % 5))
+
+    def expected(self, ordering):
+        field = ordering.lstrip('-')
+        products = sorted(Product.objects.all(), key=lambda product: (getattr(product, field), product.pk),
+                          reverse=ordering.startswith('-'))
+        return [product.name for product in products]
+
+    def walk(self, url, params):
+        """The pages from the first to the last and back, as lists of names"""
+        forward, backward = [], []
+        query = urlencode(params)
+        while query is not None:
+            page = self.client.get(f'{url}?{query}').context['page_obj']
+            forward.append([product.name for product in page])
+            query, previous = page.next_query, page.previous_query
+        while previous is not None:
+            page = self.client.get(f'{url}?{previous}').context['page_obj']
+            backward.insert(0, [product.name for product in page])
+            previous = page.previous_query
+        return forward, backward
+
+    def test_pages_round_trip_for_every_sort(self):
+        for sort, ordering in SORT_ORDERINGS.items():
+            with self.subTest(sort):
+                forward, backward = self.walk(reverse('products:product_list'), {'sort': sort})
+                self.assertEqual([len(page) for page in forward], [12, 12, 6])
+                self.assertEqual(sum(forward, []), self.expected(ordering))
+                self.assertEqual(backward, forward[:-1])
+        forward, backward = self.walk(reverse('products:category_products', args=[self.category.slug]), {})
+        self.assertEqual(sum(forward, []), self.expected('-created_at'))
+        self.assertEqual(backward, forward[:-1])
+
+    def test_ties_are_broken_by_id(self):
+        page = self.client.get(reverse('products:product_list'), {'sort': 'price_low'}).context['page_obj']
+        # Items 0, 4, 8, ... share the lowest price
+        self.assertEqual([product.name for product in page][:8],
+                         ['Item 0', 'Item 4', 'Item 8', 'Item 12', 'Item 16', 'Item 20', 'Item 24', 'Item 28'])
+
+    def test_invalid_cursors_show_the_first_page(self):
+        first = self.expected('price')[:12]
+        cursors = ['garbage', '!!', encode_cursor('sideways', '10', 1), encode_cursor('next', 'ten', 1),
+                   encode_cursor('next', 'NaN', 1), encode_cursor('next', 'Infinity', 1),
+                   encode_cursor('next', '10', 2 ** 70)]
+        for cursor in cursors:
+            with self.subTest(cursor):
+                response = self.client.get(reverse('products:product_list'), {'sort': 'price_low', 'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([product.name for product in response.context['page_obj']], first)
+        response = self.client.get(reverse('products:category_products', args=[self.category.slug]),
+                                   {'cursor': encode_cursor('next', 'yesterday', 1)})
+        self.assertEqual(len(response.context['page_obj']), 12)
+
+class AnonymousCartTests(TestCase):
+    """Anonymous carts live in a signed cookie and merge into the DB cart on login"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics')
+        cls.phone = Product.objects.create(name='Phone', category=category, description='d',
+                                           price=Decimal('100.00'), stock=5)
+        cls.cable = Product.objects.create(name='Cable', category=category, description='d',
+                                           price=Decimal('5.50'), stock=10)
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def test_anonymous_cart_writes_nothing(self):
+        with record_queries(locate=False) as recorder:
+            self.client.get(reverse('products:cart_detail'))
+            self.client.post(reverse('products:add_to_cart', args=[self.phone.pk]), {'quantity': 2})
+            response = self.client.get(reverse('products:cart_detail'))
+        writes = [sql for sql, _, _ in recorder.queries if sql.startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(response.context['total_items'], 2)
+        self.assertEqual(response.context['total_price'], Decimal('200.00'))
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies['cart'] = '{"%d":3}' % self.phone.pk
+        response = self.client.get(reverse('products:cart_detail'))
+        self.assertEqual(response.context['items'], [])
+
+    def test_login_merges_cookie_cart(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.phone, quantity=4)
+        self.client.post(reverse('products:add_to_cart', args=[self.phone.pk]), {'quantity': 3})
+        self.client.post(reverse('products:add_to_cart', args=[self.cable.pk]), {'quantity': 2})
+
+        response = self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret'})
+        self.assertEqual(response.cookies['cart'].value, '')
+        cart.refresh_from_db()
+        quantities = dict(cart.items.values_list('product__name', 'quantity'))
+        # The phone is capped at its stock of 5
+        self.assertEqual(quantities, {'Phone': 5, 'Cable': 2})
+        self.assertEqual(cart.item_count, 7)
+        self.assertEqual(cart.subtotal, Decimal('511.00'))
+
+    def test_login_merge_leaves_out_sold_out_products(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.cable, quantity=2)
+        self.client.post(reverse('products:add_to_cart', args=[self.phone.pk]), {'quantity': 1})
+        self.client.post(reverse('products:add_to_cart', args=[self.cable.pk]), {'quantity': 1})
+        Product.objects.update(stock=0)
+
+        self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret'})
+        self.assertEqual(dict(cart.items.values_list('product__name', 'quantity')), {'Cable': 2})
+
+    def test_retired_products_drop_out_of_the_cookie_cart(self):
+        self.client.post(reverse('products:add_to_cart', args=[self.phone.pk]), {'quantity': 1})
+        self.client.post(reverse('products:add_to_cart', args=[self.cable.pk]), {'quantity': 2})
+        Product.objects.filter(pk=self.phone.pk).update(is_active=False)
+        response = self.client.get(reverse('products:cart_detail'))
+        self.assertEqual([line.product for line in response.context['items']], [self.cable])
+        self.assertEqual(response.context['total_price'], Decimal('11.00'))
+
+
+class CartBadgeTests(TestCase):
+    """The navbar cart count is served from the cookie or the cache, not the cart tables"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics')
+        cls.product = Product.objects.create(name='Phone', category=category, description='d',
+                                             price=Decimal('100.00'), stock=5)
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertBadge(self, count):
+        with record_queries(locate=False) as recorder:
+            response = self.client.get(reverse('products:product_list'))
+        self.assertEqual(response.context['cart_count'], count)
+        self.assertFalse([sql for sql, _, _ in recorder.queries if 'products_cart' in sql])
+
+    def test_anonymous_badge(self):
+        self.client.post(reverse('products:add_to_cart', args=[self.product.pk]), {'quantity': 2})
+        self.assertBadge(2)
+
+    def test_authenticated_badge_follows_cart_views(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('products:add_to_cart', args=[self.product.pk]), {'quantity': 3})
+        self.assertBadge(3)
+        self.client.post(reverse('products:update_cart', args=[self.product.pk]), {'quantity': 1})
+        self.assertBadge(1)
+        self.client.post(reverse('products:remove_from_cart', args=[self.product.pk]))
+        self.assertBadge(0)
+
+
+class CartStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics')
+        cls.product = Product.objects.create(name='Phone', category=category, description='d',
+                                             price=Decimal('100.00'), stock=3)
+        cls.cart = Cart.objects.create(user=User.objects.create_user('shopper'))
+
+    def test_add_stops_at_stock(self):
+        self.assertTrue(self.cart.add(self.product, 2))
+        self.assertFalse(self.cart.add(self.product, 2))
+        self.assertTrue(self.cart.add(self.product, 1))
+        self.assertFalse(self.cart.set_quantity(self.product, 4))
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.item_count, 3)
+        self.assertEqual(self.cart.subtotal, Decimal('300.00'))
+
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Drives SQLite in WAL mode')
+class CartContentionTests(TransactionTestCase):
+    """32 buyers adding one product at once, each thread on its own connection to a WAL file database"""
+
+    def test_concurrent_adds_never_overfill_or_lose_a_line(self):
+        stock, threads, adds = 20, 32, 3
+        with benchmarks.wal_database():
+            category = Category.objects.create(name='Electronics')
+            product = Product.objects.create(name='Phone', category=category, description='d',
+                                             price=Decimal('100.00'), stock=stock)
+            buyers = [User.objects.create_user(f'buyer{i}') for i in range(threads)]
+            for scenario in ('one cart each', 'one shared cart'):
+                with self.subTest(scenario):
+                    Cart.objects.all().delete()
+                    if scenario == 'one cart each':
+                        carts = [Cart.objects.create(user=buyer) for buyer in buyers]
+                    else:
+                        carts = [Cart.objects.create(user=buyers[0])] * threads
+                    added, errors, _ = benchmarks.hammer(
+                        lambda cart: cart.add(product, 1), [(cart,) for cart in carts], adds
+                    )
+                    self.assertEqual(errors, {})
+                    self.assertFalse(CartItem.objects.filter(quantity__gt=stock).exists())
+                    self.assertEqual(CartItem.objects.aggregate(total=Sum('quantity'))['total'], added)
+                    if scenario == 'one shared cart':
+                        self.assertEqual(added, stock)
+
+class CartTotalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics')
+        cls.phone = Product.objects.create(name='Phone', category=category, description='d',
+                                           price=Decimal('100.00'), stock=10)
+        cls.case = Product.objects.create(name='Case', category=category, description='d',
+                                          price=Decimal('15.50'), stock=10)
+        cls.cart = Cart.objects.create(user=User.objects.create_user('shopper'))
+
+    def assertTotals(self, item_count, subtotal):
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.item_count, self.cart.subtotal), (item_count, Decimal(subtotal)))
+
+    def test_totals_follow_the_cart_lines(self):
+        self.cart.add(self.phone, 1)
+        self.cart.add(self.case, 2)
+        self.assertTotals(3, '131.00')
+        self.cart.set_quantity(self.phone, 3)
+        self.assertTotals(5, '331.00')
+        CartItem.objects.filter(cart=self.cart, product=self.case).get().delete()
+        self.assertTotals(3, '300.00')
+        self.cart.remove(self.phone)
+        self.assertTotals(0, '0.00')
+
+    def test_price_change_recomputes_open_carts(self):
+        self.cart.add(self.phone, 2)
+        self.phone.price = Decimal('80.00')
+        self.phone.save()
+        self.assertTotals(2, '160.00')
+
+    def test_check_command_repairs_corrupted_totals(self):
+        self.cart.add(self.phone, 2)
+        Cart.objects.filter(pk=self.cart.pk).update(item_count=7, subtotal=Decimal('1.00'))
+        with self.assertRaises(CommandError):
+            call_command('check_cart_totals', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('check_cart_totals', '--fix', stdout=out)
+        self.assertIn(f'Cart {self.cart.pk}: items 7 (expected 2)', out.getvalue())
+        self.assertIn('Recomputed totals for 1 carts', out.getvalue())
+        self.assertTotals(2, '200.00')
+        out = io.StringIO()
+        call_command('check_cart_totals', stdout=out)
+        self.assertIn('All 1 cart totals are consistent', out.getvalue())
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics')
+        cls.phone = Product.objects.create(name='Phone', category=category, description='d',
+                                           price=Decimal('100.00'), stock=5)
+        cls.cable = Product.objects.create(name='Cable', category=category, description='d',
+                                           price=Decimal('5.50'), stock=10)
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def setUp(self):
+        self.cart = Cart.objects.create(user=self.user)
+        self.cart.add(self.phone, 2)
+        self.cart.add(self.cable, 4)
+
+    def test_checkout_snapshots_prices_and_decrements_stock(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('products:checkout'))
+        order = Order.objects.get()
+        self.assertRedirects(response, order.get_absolute_url())
+        self.assertContains(self.client.get(order.get_absolute_url()), f'Order #{order.pk}')
+        Product.objects.filter(pk=self.phone.pk).update(price=Decimal('120.00'))
+
+        self.assertEqual(order.subtotal, Decimal('222.00'))
+        self.assertEqual(order.item_count, 6)
+        self.assertEqual(
+            sorted(order.lines.values_list('product_name', 'unit_price', 'quantity')),
+            [('Cable', Decimal('5.50'), 4), ('Phone', Decimal('100.00'), 2)],
+        )
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Phone': 3, 'Cable': 6})
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.items.count(), self.cart.item_count), (0, 0))
+
+    def test_short_line_rolls_back_everything(self):
+        Product.objects.filter(pk=self.cable.pk).update(stock=3)
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.cart)
+        self.assertEqual([product.name for product in raised.exception.products], ['Cable'])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Phone': 5, 'Cable': 3})
+        self.assertEqual(self.cart.items.count(), 2)
+
+
+class OfferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        window = {'valid_from': now - timedelta(days=1), 'valid_to': now + timedelta(days=1)}
+        cls.percent = Offer.objects.create(code='SAVE10', name='Ten off', description='d',
+                                           discount=Decimal('10'), minimum_amount=Decimal('50'),
+                                           usage_limit=2, **window)
+        Offer.objects.create(code='FIVER', name='Five off', description='d', discount_type='fixed',
+                             discount=Decimal('5'), **window)
+        category = Category.objects.create(name='Electronics')
+        cls.product = Product.objects.create(name='Phone', category=category, description='d',
+                                             price=Decimal('99.99'), stock=10)
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def setUp(self):
+        offers.invalidate()
+
+    def test_pricing_uses_no_queries_once_compiled(self):
+        offers.get_offers()
+        with self.assertNumQueries(0):
+            self.assertEqual(offers.price('save10', Decimal('99.99'))[1], Decimal('10.00'))
+            self.assertEqual(offers.price('FIVER', Decimal('3.00'))[1], Decimal('3.00'))
+            with self.assertRaises(offers.OfferNotApplicable):
+                offers.price('SAVE10', Decimal('49.99'))
+            with self.assertRaises(offers.OfferNotApplicable):
+                offers.price('NOPE', Decimal('100'))
+
+    def test_saving_an_offer_recompiles(self):
+        offers.get_offers()
+        # update() sends no signal, so the compiled copy is still served
+        Offer.objects.filter(pk=self.percent.pk).update(is_active=False)
+        offers.get_offer('SAVE10')
+        self.percent.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.percent.save()
+            # Only forgotten on commit, so no other request recompiles the old rows
+            self.assertEqual(offers.get_offer('SAVE10').code, 'SAVE10')
+        with self.assertRaises(offers.OfferNotApplicable):
+            offers.get_offer('SAVE10')
+
+    def test_redemption_stops_at_usage_limit(self):
+        offer = offers.get_offer('SAVE10')
+        self.assertEqual([offers.redeem(offer) for _ in range(3)], [True, True, False])
+        self.assertEqual(Offer.objects.get(pk=self.percent.pk).used_count, 2)
+
+    def test_used_up_code_is_refused_when_applied(self):
+        Offer.objects.filter(pk=self.percent.pk).update(used_count=2)
+        self.client.force_login(self.user)
+        self.client.post(reverse('products:add_to_cart', args=[self.product.pk]), {'quantity': 1})
+        response = self.client.post(reverse('products:apply_offer'), {'code': 'save10'}, follow=True)
+        self.assertContains(response, 'The code SAVE10 has been used up.')
+        self.assertEqual(Cart.objects.get(user=self.user).offer_code, '')
+
+    def test_checkout_redeems_applied_offer(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('products:add_to_cart', args=[self.product.pk]), {'quantity': 1})
+        self.client.post(reverse('products:apply_offer'), {'code': 'save10'})
+        response = self.client.get(reverse('products:cart_detail'))
+        self.assertEqual(response.context['grand_total'], Decimal('89.99'))
+
+        self.client.post(reverse('products:checkout'))
+        order = Order.objects.get()
+        self.assertEqual((order.offer_code, order.discount, order.total),
+                         ('SAVE10', Decimal('10.00'), Decimal('89.99')))
+        self.assertEqual(Offer.objects.get(pk=self.percent.pk).used_count, 1)
+
+    def test_used_up_offer_rolls_back_checkout(self):
+        Offer.objects.filter(pk=self.percent.pk).update(used_count=2)
+        cart = Cart.objects.create(user=self.user, offer_code='SAVE10')
+        cart.add(self.product, 1)
+        with self.assertRaises(offers.OfferNotApplicable):
+            place_order(cart)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Drives SQLite in WAL mode')
+class OfferContentionTests(TransactionTestCase):
+    def test_concurrent_redemptions_stop_at_usage_limit(self):
+        limit, threads, attempts = 10, 32, 3
+        with benchmarks.wal_database():
+            now = timezone.now()
+            offer = Offer.objects.create(code='FLASH', name='Flash Sale', description='d', discount=Decimal('15'),
+                                         usage_limit=limit, valid_from=now - timedelta(days=1),
+                                         valid_to=now + timedelta(days=1))
+            offers.invalidate()
+            compiled = offers.get_offer('FLASH')
+            redeemed, errors, _ = benchmarks.hammer(offers.redeem, [(compiled,)] * threads, attempts)
+            offers.invalidate()
+            self.assertEqual(errors, {})
+            self.assertEqual(redeemed, limit)
+            self.assertEqual(Offer.objects.get(pk=offer.pk).used_count, limit)
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class ProductCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Electronics')
+        cls.product = Product.objects.create(name='Phone', category=category, description='d',
+                                             short_description='Short', price=Decimal('99.99'), stock=3)
+        cls.user = User.objects.create_user('reviewer')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_card(self):
+        response = self.client.get(reverse('products:product_list'))
+        return response.content.decode()
+
+    def test_cards_are_cached_with_the_visitors_csrf_token(self):
+        first = self.get_card()
+        with self.assertTemplateNotUsed('products/includes/product_card.html'):
+            second = self.get_card()
+        tokens = [re.search(r'name="csrfmiddlewaretoken" value="(\w+)"', html).group(1)
+                  for html in (first, second)]
+        # Django masks the token differently on every render
+        self.assertNotEqual(tokens[0], tokens[1])
+        self.assertNotIn('product-card-csrf-token', second)
+
+    def test_edits_and_reviews_invalidate_the_card(self):
+        self.get_card()
+        self.product.price = Decimal('79.99')
+        self.product.save()
+        self.assertIn('$79.99', self.get_card())
+        Review.objects.create(product=self.product, user=self.user, rating=4, title='Ok', comment='Ok')
+        self.assertIn('(1)', self.get_card())
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Electronics')
+        cls.product = Product.objects.create(name='Phone', category=cls.category, description='d',
+                                             price=Decimal('99.99'), stock=3)
+        cls.user = User.objects.create_user('shopper')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hits_run_no_queries_and_get_a_fresh_csrf_token(self):
+        url = reverse('products:product_list')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        self.client = Client(enforce_csrf_checks=True)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        html = response.content.decode()
+        self.assertIn('Phone', html)
+        self.assertNotIn('page-cache-csrf-token', html)
+        token = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"', html).group(1)
+        response = self.client.post(reverse('products:add_to_cart', args=[self.product.pk]),
+                                    {'quantity': 1, 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+    def test_pages_vary_on_the_listing_parameters(self):
+        url = reverse('products:product_list')
+        self.client.get(url)
+        self.assertEqual(self.client.get(f'{url}?sort=price_low')['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(f'{url}?utm_source=mail')['X-Page-Cache'], 'hit')
+        self.client.get(f'{url}?price=25-50&price=under-25')
+        self.assertEqual(self.client.get(f'{url}?price=under-25')['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(f'{url}?price=under-25&price=25-50')['X-Page-Cache'], 'hit')
+
+    def test_personal_visitors_bypass_the_cache(self):
+        url = reverse('products:index')
+        self.client.get(url)
+        self.client.cookies['messages'] = 'pending'
+        self.assertNotIn('X-Page-Cache', self.client.get(url))
+        del self.client.cookies['messages']
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Page-Cache', self.client.get(url))
+
+    def test_saves_expire_the_tagged_pages(self):
+        detail = reverse('products:product_detail', args=[self.product.slug])
+        category = reverse('products:category_products', args=[self.category.slug])
+        self.client.get(detail)
+        self.client.get(category)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=self.user, rating=5, title='Great', comment='Yes')
+        self.assertEqual(self.client.get(detail)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(category)['X-Page-Cache'], 'miss')
+        other = Product.objects.create(name='Tablet', category=Category.objects.create(name='Tablets'),
+                                       description='d', price=Decimal('199.00'), stock=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        self.assertEqual(self.client.get(detail)['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(category)['X-Page-Cache'], 'miss')
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Electronics')
+        cls.product = Product.objects.create(name='Phone', category=cls.category, description='d',
+                                             price=Decimal('99.99'), stock=3)
+        cls.sibling = Product.objects.create(name='Tablet', category=cls.category, description='d',
+                                             price=Decimal('199.99'), stock=3)
+        cls.user = User.objects.create_user('shopper')
+
+    def detail_etag(self):
+        return self.client.get(reverse('products:product_detail', args=[self.product.slug]))['ETag']
+
+    def test_revalidation_is_answered_from_one_query(self):
+        for url in (reverse('products:product_detail', args=[self.product.slug]),
+                    reverse('products:category_products', args=[self.category.slug])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTrue(response['ETag'].startswith('W/"'))
+                self.assertTrue(response.has_header('Last-Modified'))
+                with self.assertNumQueries(1):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_changes_shown_on_the_page_move_the_etag(self):
+        etag = self.detail_etag()
+        self.sibling.save()
+        self.assertNotEqual(self.detail_etag(), etag)
+        etag = self.detail_etag()
+        review = Review.objects.create(product=self.product, user=self.user, rating=4, title='Ok', comment='Ok')
+        self.assertNotEqual(self.detail_etag(), etag)
+        etag = self.detail_etag()
+        review.comment = 'Better than expected'
+        review.save()
+        self.assertNotEqual(self.detail_etag(), etag)
+        etag = self.detail_etag()
+        self.category.name = 'Gadgets'
+        self.category.save()
+        self.assertNotEqual(self.detail_etag(), etag)
+
+    def test_personal_pages_have_no_validators(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('products:product_detail', args=[self.product.slug]))
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    def test_page_cache_hits_answer_revalidations(self):
+        cache.clear()
+        url = reverse('products:category_products', args=[self.category.slug])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='Phones')
+        books = Category.objects.create(name='Books')
+        for i in range(7):
+            Product.objects.create(name=f'Phone {i}', category=cls.phones, description='d',
+                                   price=Decimal(100 + i), stock=3)
+        Product.objects.create(name='Novel', category=books, description='d', price=Decimal('9.99'))
+        Product.objects.create(name='Old Phone', category=cls.phones, description='d',
+                               price=Decimal('5.00'), is_active=False)
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, params)
+        return response.status_code, response.json()
+
+    def test_cursor_pages_cover_the_filtered_listing(self):
+        url = reverse('products:api_product_list')
+        status, page = self.get_json(url, category=self.phones.slug, sort='price_high', limit=3,
+                                     fields='name,price')
+        names = []
+        while True:
+            self.assertEqual(status, 200)
+            self.assertTrue(all(set(row) == {'name', 'price'} for row in page['results']))
+            names += [row['name'] for row in page['results']]
+            if not page['next']:
+                break
+            status, page = self.get_json(page['next'])
+        self.assertEqual(names, [f'Phone {i}' for i in reversed(range(7))])
+
+    def test_rows_are_serialized_without_model_instances(self):
+        with mock.patch.object(Product, 'from_db') as from_db:
+            status, page = self.get_json(reverse('products:api_product_list'))
+            status, detail = self.get_json(reverse('products:api_product_detail', args=['novel']))
+        from_db.assert_not_called()
+        self.assertEqual(len(page['results']), 8)
+        self.assertEqual(detail['category'], 'books')
+        self.assertEqual(detail['price'], '9.99')
+
+    def test_errors_are_json(self):
+        self.assertEqual(self.get_json(reverse('products:api_product_list'), fields='name,secret'),
+                         (400, {'error': 'Unknown fields: secret'}))
+        self.assertEqual(self.get_json(reverse('products:api_product_list'), category='nope')[0], 404)
+        self.assertEqual(self.get_json(reverse('products:api_product_detail', args=['old-phone']))[0], 404)
+
+    def test_categories_count_active_products(self):
+        status, data = self.get_json(reverse('products:api_category_list'))
+        counts = {row['slug']: row['product_count'] for row in data['results']}
+        self.assertEqual(counts, {'books': 1, 'phones': 7})
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        phones = Category.objects.create(name='Phones')
+        books = Category.objects.create(name='Books')
+        Product.objects.create(name='Phone', category=phones, description='d', price=Decimal('99.99'))
+        Product.objects.create(name='Old Phone', category=phones, description='d', price=Decimal('9.00'),
+                               is_active=False)
+        Product.objects.create(name='Novel, "signed"', category=books, description='d', price=Decimal('5'))
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+
+    def export(self, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('products:export_products'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_export_filters_and_quotes(self):
+        response, body = self.export(category='phones', active='1')
+        rows = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual([row['name'] for row in rows], ['Phone'])
+        self.assertEqual(rows[0]['category'], 'phones')
+        response, body = self.export(category='books')
+        self.assertEqual(next(csv.DictReader(io.StringIO(body.decode())))['name'], 'Novel, "signed"')
+
+    def test_gzipped_jsonl_export(self):
+        response, body = self.export(format='jsonl', gzip='1', updated_after='2000-01-01')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['price'], '99.99')
+        self.assertEqual(self.export(format='jsonl', updated_before='2000-01-01')[1], b'')
+
+    def test_export_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.assertEqual(self.client.get(reverse('products:export_products')).status_code, 302)
+
+
+class ImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.clothing = Category.objects.create(name='Clothing')
+        cls.shirt = Product.objects.create(name='Blue Shirt', category=cls.clothing, description='d',
+                                           price=Decimal('10.00'), stock=1)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write_feed(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def run_import(self, *args):
+        out = io.StringIO()
+        call_command('import_products', *args, stdout=out)
+        return out.getvalue()
+
+    def test_upserts_by_slug_and_allocates_unique_slugs(self):
+        feed = self.write_feed('feed.csv', (
+            'slug,name,price,category_name,stock,featured\n'
+            'blue-shirt,,12.50,,7,\n'
+            ',Blue Shirt,20,Clothing,3,yes\n'
+            ',Blue Shirt,21,Clothing,3,no\n'
+            ',Red Hat,5,Hats,2,\n'
+            ',Broken,abc,Hats,2,\n'
+        ))
+        with self.assertNumQueries(11):
+            output = self.run_import(feed, '--batch-size', '10')
+        self.assertIn('3 created, 1 updated, 1 skipped, 1 new categories', output)
+        self.assertIn('row 5: price is not a number: abc', output)
+        self.shirt.refresh_from_db()
+        self.assertEqual((self.shirt.price, self.shirt.stock, self.shirt.name), (Decimal('12.50'), 7, 'Blue Shirt'))
+        self.assertEqual(
+            list(Product.objects.filter(name='Blue Shirt').order_by('slug').values_list('slug', 'price')),
+            [('blue-shirt', Decimal('12.50')), ('blue-shirt-2', Decimal('20.00')), ('blue-shirt-3', Decimal('21.00'))],
+        )
+        self.assertEqual(Product.objects.get(slug='red-hat').category.slug, 'hats')
+        self.assertEqual(search_products(Product.objects.all(), 'hat').get().slug, 'red-hat')
+
+    def test_dry_run_writes_nothing(self):
+        feed = self.write_feed('feed.jsonl', (
+            '{"name": "Red Hat", "price": 5, "category_name": "Hats"}\n'
+            '{"slug": "blue-shirt", "price": "1.00"}\n'
+        ))
+        output = self.run_import(feed, '--dry-run')
+        self.assertIn('Would import 2 rows', output)
+        self.assertIn('1 created, 1 updated', output)
+        self.assertFalse(Category.objects.filter(name='Hats').exists())
+        self.assertEqual(Product.objects.get(slug='blue-shirt').price, Decimal('10.00'))
+
+    def test_resumes_after_the_checkpointed_rows(self):
+        feed = self.write_feed('feed.csv', 'name,price,category\n' + ''.join(
+            f'Item {i},{i + 1},clothing\n' for i in range(5)
+        ))
+        checkpoint = os.path.join(self.directory, 'import.checkpoint')
+        with open(checkpoint, 'w') as f:
+            json.dump({'source': os.path.abspath(feed), 'rows': 3}, f)
+        output = self.run_import(feed, '--checkpoint', checkpoint, '--batch-size', '2')
+        self.assertIn('Resuming after row 3', output)
+        self.assertEqual(sorted(Product.objects.filter(name__startswith='Item').values_list('name', flat=True)),
+                         ['Item 3', 'Item 4'])
+        self.assertFalse(os.path.exists(checkpoint))
+
+
+class DatasetTests(TestCase):
+    def generate(self, seed=7):
+        datasets.DatasetGenerator(products=300, users=40, reviews=600, carts=15, seed=seed, batch_size=128).generate()
+        return (
+            list(Product.objects.order_by('slug').values_list('slug', 'category__slug', 'price', 'stock',
+                                                               'created_at', 'review_count', 'rating')),
+            list(Review.objects.order_by('product__slug', 'user__username')
+                 .values_list('product__slug', 'user__username', 'rating')),
+        )
+
+    def test_is_deterministic_and_consistent(self):
+        products, reviews = self.generate()
+        self.assertEqual(len(products), 300)
+        self.assertEqual(sum(row[5] for row in products), len(reviews))
+        # Zipf: the largest category holds far more than an even share
+        sizes = Category.objects.annotate(n=Count('products')).order_by('-n').values_list('n', flat=True)
+        self.assertGreater(sizes[0], 300 / len(sizes) * 2)
+        self.assertTrue(all(row[4] < datasets.ANCHOR for row in products))
+        # The seeded timestamps, not the time of the insert
+        for model in (Product, Review):
+            self.assertFalse(model.objects.exclude(updated_at=F('created_at')).exists())
+
+        for model in (CartItem, Cart, Review, Product, Category):
+            model.objects.all().delete()
+        User.objects.filter(username__startswith='shopper').delete()
+        self.assertEqual(self.generate(), (products, reviews))
+
+    def test_command_refuses_a_non_empty_catalog(self):
+        Category.objects.create(name='Clothing')
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', '--scale', '10', stdout=io.StringIO())
+
+
+class BenchTests(TestCase):
+    def test_latency_summary(self):
+        summary = latency_summary([float(ms) for ms in range(1, 101)])
+        self.assertEqual(summary['p50_ms'], 50.5)
+        self.assertEqual(summary['p99_ms'], 99.01)
+        self.assertEqual(latency_summary([4.0])['p95_ms'], 4.0)
+
+    def test_compare_runs_flags_slower_views_and_extra_queries(self):
+        row = {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'queries': 3}
+        old = {'views': {'index': row, 'search': row}}
+        new = {'views': {
+            'index': {**row, 'p50_ms': 10.9, 'p95_ms': 23.0},
+            'search': {**row, 'queries': 4},
+            'cart_detail': row,
+        }}
+        self.assertEqual(compare_runs(old, new, threshold=0.1), [
+            ('index', 'p95_ms', 20.0, 23.0),
+            ('search', 'queries', 3, 4),
+        ])
+
+
+def image_upload(name, width, height, fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGBA' if fmt == 'PNG' else 'RGB', (width, height), (200, 30, 30, 128)).save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ImageVariantTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Clothing')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media = directory.name
+        settings = override_settings(MEDIA_ROOT=self.media, PAGE_CACHE_ENABLED=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def create_product(self, image, name='Blue Shirt'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name=name, category=self.category, description='d',
+                                          price=Decimal('10.00'), stock=1, image=image)
+
+    def variant_path(self, product, width, fmt):
+        return os.path.join(self.media, images.variant_name(product.image.name, width, fmt))
+
+    def test_upload_generates_capped_variants(self):
+        product = self.create_product(image_upload('shirt.png', 500, 250))
+        product.refresh_from_db()
+        self.assertEqual(product.image_width, 500)
+        self.assertEqual(images.variant_widths(500), [160, 320, 500])
+        for width in (160, 320, 500):
+            for fmt in ('webp', 'jpeg'):
+                self.assertTrue(os.path.exists(self.variant_path(product, width, fmt)))
+        with Image.open(self.variant_path(product, 320, 'webp')) as variant:
+            self.assertEqual(variant.size, (320, 160))
+
+        stem = os.path.splitext(os.path.basename(product.image.name))[0]
+        self.assertTrue(product.get_image_url(200).endswith(f'/variants/{stem}-320w.jpg'))
+        self.assertTrue(product.get_image_url(2000, 'webp').endswith(f'/variants/{stem}-500w.webp'))
+        self.assertEqual(product.get_image_url(), product.image.url)
+        self.assertIn(f'{stem}-160w.webp 160w', product.image_srcset('webp'))
+
+        response = self.client.get(product.get_absolute_url())
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f'{stem}-160w.webp 160w')
+
+    def test_replacing_the_image_regenerates_variants(self):
+        product = self.create_product(image_upload('shirt.png', 400, 400))
+        product.refresh_from_db()
+        product.image = image_upload('shirt-back.jpg', 200, 100, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_width, 200)
+        self.assertTrue(os.path.exists(self.variant_path(product, 200, 'jpeg')))
+
+    def test_unreadable_upload_keeps_the_original(self):
+        with self.assertLogs('products.images', 'WARNING'):
+            product = self.create_product(SimpleUploadedFile('broken.jpg', b'not an image'))
+        product.refresh_from_db()
+        self.assertIsNone(product.image_width)
+        self.assertEqual(product.get_image_url(320), product.image.url)
+        self.assertEqual(product.image_srcset(), '')
+
+    def test_identical_uploads_share_one_file_until_the_last_reference_goes(self):
+        first = self.create_product(image_upload('shirt.png', 400, 200))
+        with mock.patch('products.images.generate_variants') as generate:
+            second = self.create_product(image_upload('copy-of-shirt.png', 400, 200), name='Red Shirt')
+            with self.captureOnCommitCallbacks(execute=True):
+                gallery = ProductImage.objects.create(product=second, image=image_upload('again.png', 400, 200))
+        generate.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        gallery.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image.name, gallery.image.name)
+        self.assertRegex(first.image.name, r'^product_images/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(second.image_width, 400)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 2)  # the file and variants/
+
+        path, variant = first.image.path, self.variant_path(first, 320, 'webp')
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+            gallery.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(variant))
+
+    def test_content_addressed_media_is_served_immutable(self):
+        product = self.create_product(image_upload('shirt.png', 200, 200))
+        request = RequestFactory().get(product.image.url)
+        self.assertIn('immutable', serve_media(request, product.image.name)['Cache-Control'])
+        with open(os.path.join(self.media, 'legacy.png'), 'wb') as f:
+            f.write(b'png')
+        self.assertFalse(serve_media(request, 'legacy.png').has_header('Cache-Control'))
+
+    def test_dedupe_media_merges_legacy_duplicates(self):
+        os.makedirs(os.path.join(self.media, 'product_images', 'variants'))
+        for name in ('a.png', 'b.png', 'orphan.png'):
+            with open(os.path.join(self.media, 'product_images', name), 'wb') as f:
+                f.write(image_upload(name, 300, 100).read())
+        with open(os.path.join(self.media, 'product_images', 'variants', 'a-160w.webp'), 'wb') as f:
+            f.write(b'variant')
+        product = Product.objects.create(name='Blue Shirt', category=self.category, description='d',
+                                         price=Decimal('10.00'), stock=1)
+        Product.objects.filter(pk=product.pk).update(image='product_images/a.png', image_width=300)
+        gallery = ProductImage.objects.create(product=product, image='product_images/b.png')
+
+        out = io.StringIO()
+        call_command('dedupe_media', '--delete-orphans', stdout=out)
+        self.assertIn('Moved 2 images in 1 distinct files, 1 orphans', out.getvalue())
+        product.refresh_from_db()
+        gallery.refresh_from_db()
+        self.assertEqual(product.image.name, gallery.image.name)
+        self.assertTrue(os.path.exists(product.image.path))
+        self.assertEqual((product.image_width, gallery.image_width), (300, 300))
+        self.assertTrue(os.path.exists(self.variant_path(product, 160, 'webp')))
+        legacy = [name for directory in ('product_images', 'product_images/variants')
+                  for name in os.listdir(os.path.join(self.media, directory))
+                  if os.path.isfile(os.path.join(self.media, directory, name))]
+        self.assertEqual(legacy, [])
+
+    def test_backfill_command(self):
+        product = self.create_product(image_upload('shirt.png', 300, 300))
+        gallery = ProductImage.objects.create(product=product, image=image_upload('side.png', 900, 300))
+        Product.objects.update(image_width=None)
+        ProductImage.objects.update(image_width=None)
+        out = io.StringIO()
+        call_command('generate_image_variants', '--workers', '1', stdout=out)
+        self.assertIn('Generated variants of 2 images', out.getvalue())
+        product.refresh_from_db()
+        gallery.refresh_from_db()
+        self.assertEqual((product.image_width, gallery.image_width), (300, 900))
+        self.assertTrue(os.path.exists(self.variant_path(gallery, 640, 'webp')))
+
+
+class StaticAssetTests(TestCase):
+    def test_pages_inline_the_critical_css_and_defer_the_rest(self):
+        response = self.client.get(reverse('products:index'))
+        self.assertContains(response, '<style>/* Critical CSS')
+        self.assertContains(response, '.hero-section {')
+        self.assertContains(response, 'rel="preload" as="style" href="/static/css/style.css"')
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        clothing, shoes = Category.objects.create(name='Clothing'), Category.objects.create(name='Shoes')
+        cls.shirt, cls.jacket, cls.scarf, cls.hat = (
+            Product.objects.create(name=name, category=clothing, description='Description', price=Decimal('10'),
+                                   stock=5)
+            for name in ('Shirt', 'Jacket', 'Scarf', 'Hat')
+        )
+        cls.boots = Product.objects.create(name='Boots', category=shoes, description='Description',
+                                           price=Decimal('50'), stock=5)
+        cls.users = [User.objects.create_user(f'shopper{i}') for i in range(3)]
+        for user, product, rating in [
+            (0, cls.shirt, 5), (0, cls.jacket, 5), (0, cls.boots, 4),
+            (1, cls.shirt, 4), (1, cls.jacket, 4),
+            (2, cls.scarf, 3),
+        ]:
+            Review.objects.create(product=product, user=cls.users[user], rating=rating, title='Review',
+                                  comment='Review')
+
+    def related(self, product):
+        return list(RelatedProduct.objects.filter(product=product).values_list('related__name', 'source'))
+
+    def test_co_reviewed_products_first_then_category(self):
+        self.assertEqual(refresh_recommendations(), (5, 5))
+        self.assertEqual(self.related(self.shirt), [
+            ('Jacket', 'reviews'), ('Boots', 'reviews'), ('Scarf', 'category'), ('Hat', 'category'),
+        ])
+        # Without reviews: the category's most reviewed products
+        self.assertEqual(self.related(self.hat), [
+            ('Shirt', 'category'), ('Jacket', 'category'), ('Scarf', 'category'),
+        ])
+        scores = RelatedProduct.objects.filter(product=self.shirt).values_list('score', flat=True)
+        self.assertAlmostEqual(scores[0], 1.0, places=5)
+        self.assertEqual(refresh_recommendations(), (5, 0))
+
+    def test_incremental_refresh_recomputes_affected_products(self):
+        refresh_recommendations()
+        written = RelatedProduct.objects.get(product=self.boots, rank=1).computed_at
+        Review.objects.create(product=self.hat, user=self.users[2], rating=3, title='Review', comment='Review')
+        out = io.StringIO()
+        call_command('compute_recommendations', stdout=out)
+        # Hat, Scarf (same reviewer) and the products listing Hat
+        self.assertIn('Computed related products of 4 products', out.getvalue())
+        self.assertEqual(self.related(self.scarf)[0], ('Hat', 'reviews'))
+        self.assertEqual(RelatedProduct.objects.filter(product=self.boots, rank=1).get().computed_at, written)
+        out = io.StringIO()
+        call_command('compute_recommendations', stdout=out)
+        self.assertIn('No product changed', out.getvalue())
+
+    def test_edits_during_a_run_are_left_for_the_next_one(self):
+        favourites = recommendations.category_favourites
+
+        def edit_jacket(top_k):
+            Product.objects.filter(pk=self.jacket.pk).update(stock=9, updated_at=timezone.now())
+            return favourites(top_k)
+
+        with mock.patch.object(recommendations, 'category_favourites', edit_jacket):
+            refresh_recommendations()
+        edited = Product.objects.get(pk=self.jacket.pk).updated_at
+        self.assertGreater(edited, recommendations.last_run())
+        self.assertIn(self.jacket.pk, recommendations.affected_products(recommendations.last_run()))
+        # Unchanged lists leave their products and rows alone
+        refresh_recommendations()
+        self.assertEqual(Product.objects.get(pk=self.jacket.pk).updated_at, edited)
+        self.assertEqual(RecommendationRun.objects.count(), 2)
+
+    def test_detail_page_shows_recommendations(self):
+        url = reverse('products:product_detail', args=[self.boots.slug])
+        self.assertEqual(list(self.client.get(url).context['related_products']), [])
+        refresh_recommendations()
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['related_products'])[:2], [self.shirt, self.jacket])
+        # A rewritten list moves the ETag even when no product changed
+        RelatedProduct.objects.filter(product=self.boots).update(computed_at=timezone.now() + timedelta(minutes=1))
+        cache.clear()
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.clothing, cls.shoes = Category.objects.create(name='Clothing'), Category.objects.create(name='Shoes')
+        for name, category, price, rating, stock in [
+            ('Shirt', cls.clothing, '19.99', '4.50', 5),
+            ('Jacket', cls.clothing, '89.00', '3.20', 0),
+            ('Scarf', cls.clothing, '24.99', '2.00', 3),
+            ('Boots', cls.shoes, '120.00', '4.10', 2),
+            ('Sandals', cls.shoes, '30.00', '0', 7),
+        ]:
+            Product.objects.create(name=name, category=category, description='Description', price=Decimal(price),
+                                   rating=Decimal(rating), stock=stock)
+        Product.objects.create(name='Retired', category=cls.shoes, description='Description',
+                               price=Decimal('10'), stock=1, is_active=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self, facet_list, key):
+        return {entry[key]: entry['count'] for entry in facet_list}
+
+    def test_normalize_filters(self):
+        params = QueryDict('category=shoes&category=clothing&category=shoes&price=50-100&price=under-25'
+                           '&price=cheap&rating=9&in_stock=1')
+        self.assertEqual(facets.normalize_filters(params), {
+            'category': ['clothing', 'shoes'], 'price': ['under-25', '50-100'], 'rating': None, 'in_stock': True,
+        })
+
+    def test_counts_ignore_their_own_selection(self):
+        state = facets.normalize_filters(QueryDict('category=clothing&price=under-25&in_stock=1'))
+        with self.assertNumQueries(1):
+            counts = facets.facet_counts(state)
+        # Categories under the price and stock filters
+        self.assertEqual(self.counts(counts['categories'], 'name'), {'Clothing': 2, 'Shoes': 0})
+        # Price bands within clothing in stock
+        self.assertEqual(self.counts(counts['price'], 'key'),
+                         {'under-25': 2, '25-50': 0, '50-100': 0, '100-250': 0, 'over-250': 0})
+        self.assertEqual(self.counts(counts['rating'], 'value'), {4: 1, 3: 1, 2: 2, 1: 2})
+        # Cheap clothing, in stock or not
+        self.assertEqual(counts['in_stock'], {'count': 2, 'selected': True})
+        with self.assertNumQueries(0):
+            facets.facet_counts(facets.normalize_filters(QueryDict('in_stock=on&price=under-25&category=clothing')))
+
+    def test_counts_expire_with_the_catalog(self):
+        state = facets.normalize_filters(QueryDict(''))
+        self.assertEqual(facets.facet_counts(state)['in_stock']['count'], 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            jacket = Product.objects.get(name='Jacket')
+            jacket.stock = 4
+            jacket.save()
+        self.assertEqual(facets.facet_counts(state)['in_stock']['count'], 5)
+
+    def test_selected_category_without_matches_counts_nothing(self):
+        state = facets.normalize_filters(QueryDict('category=shoes'))
+        counts = facets.facet_counts(state, 'shirt')
+        self.assertEqual(self.counts(counts['categories'], 'name'), {'Clothing': 1, 'Shoes': 0})
+        self.assertTrue(next(entry for entry in counts['categories'] if entry['slug'] == 'shoes')['selected'])
+        self.assertEqual(set(self.counts(counts['price'], 'key').values()), {0})
+        self.assertEqual(set(self.counts(counts['rating'], 'value').values()), {0})
+        self.assertEqual(counts['in_stock']['count'], 0)
+
+    def test_product_list_applies_multi_select_filters(self):
+        url = reverse('products:product_list')
+        response = self.client.get(f'{url}?category=clothing&category=shoes&price=under-25&price=100-250&rating=4')
+        self.assertEqual({product.name for product in response.context['page_obj']}, {'Shirt', 'Boots'})
+        self.assertContains(response, 'value="shoes" id="cat-shoes" checked')
+        self.assertContains(response, 'Under $25 <span class="text-muted">(1)</span>')
+        self.assertEqual(self.client.get(f'{url}?category=clothing&category=hats').status_code, 404)
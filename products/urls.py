@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'products'
 
@@ -10,9 +10,18 @@ urlpatterns = [
     path('category/<slug:slug>/', views.category_products, name='category_products'),
     path('cart/', views.cart_detail, name='cart_detail'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('update-cart/<int:item_id>/', views.update_cart, name='update_cart'),
-    path('remove-from-cart/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('update-cart/<int:product_id>/', views.update_cart, name='update_cart'),
+    path('remove-from-cart/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/offer/', views.apply_offer, name='apply_offer'),
+    path('cart/offer/remove/', views.remove_offer, name='remove_offer'),
+    path('checkout/', views.checkout, name='checkout'),
+    path('orders/<int:pk>/', views.order_detail, name='order_detail'),
     path('add-review/<slug:slug>/', views.add_review, name='add_review'),
     path('search/', views.search, name='search'),
+    path('search/autocomplete/', views.autocomplete, name='autocomplete'),
     path('register/', views.register, name='register'),
+    path('api/products/', api.product_list, name='api_product_list'),
+    path('api/products/<slug:slug>/', api.product_detail, name='api_product_detail'),
+    path('api/categories/', api.category_list, name='api_category_list'),
+    path('export/', views.export_products, name='export_products'),
 ]
@@ -1,20 +1,82 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Avg
+from django.conf import settings
 from django.core.paginator import Paginator
+from django.db.models import Count, Exists, Max, OuterRef
 from django.views.decorators.http import require_POST
+from django.views.static import serve
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
-from .models import Product, Category, Review, Cart, CartItem, Offer
+from .models import Product, Category, Review, Cart, Offer, Order, RelatedProduct
 from .forms import ReviewForm
+from .cart import CartFull, get_cookie_cart, remember_cart_count, update_cart_count
+from .checkout import EmptyCart, OutOfStock, place_order
+from .page_cache import cache_anonymous_page, conditional_page, product_tags, tag_page
+from .pagination import CursorPaginator
+from .search import search_products
+from .storage import is_content_addressed
+from . import autocomplete as autocomplete_index
+from . import exports
+from . import facets
+from . import offers
+from .query_inspector import query_budget
 
+# ``sort`` query parameter -> keyset ordering used by the listings
+SORT_ORDERINGS = {
+    'newest': '-created_at',
+    'price_low': 'price',
+    'price_high': '-price',
+    'rating': '-rating',
+}
 
+# One year, the longest lifetime caches honour
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def filter_products(params, state=None):
+    """Apply the listing's filter, ``q`` and ``sort`` parameters to the active products.
+
+    ``category`` and ``price`` may be given several times; see
+    ``products.facets``. ``state`` is their normalized filter state, if the
+    caller already has it. Returns ``(products, ordering)``; ``ordering`` is
+    None for search results ranked by relevance. Raises ``Http404`` for an
+    unknown category.
+    """
+    products = Product.objects.filter(is_active=True)
+    
+    # Filter by categories, price bands, rating and stock
+    if state is None:
+        state = facets.normalize_filters(params)
+    category_ids = None
+    if state['category']:
+        category_ids = list(Category.objects.filter(slug__in=state['category']).values_list('pk', flat=True))
+        if len(category_ids) != len(state['category']):
+            raise Http404('No Category matches the given query.')
+    products = facets.apply_filters(products, state, category_ids)
+    
+    # Search functionality (ranked by relevance unless a sort is chosen)
+    query = params.get('q')
+    if query:
+        products = search_products(products, query)
+    
+    # Sort by price
+    ordering = SORT_ORDERINGS.get(params.get('sort'))
+    if ordering is None and not query:
+        ordering = '-created_at'
+    return products, ordering
+
+
+@query_budget(5)
+@cache_anonymous_page('catalog')
 def index(request):
     """Home page with featured products and categories"""
     featured_products = Product.objects.filter(featured=True, is_active=True)[:8]
-    categories = Category.objects.all()[:6]
+    categories = Category.objects.annotate(product_count=Count('products'))[:6]
     latest_products = Product.objects.filter(is_active=True).order_by('-created_at')[:8]
     
     context = {
@@ -25,66 +87,73 @@ def index(request):
     return render(request, 'products/index.html', context)
 
 
+@query_budget(6)
+@cache_anonymous_page('catalog')
 def product_list(request):
-    """Display all products with filtering and pagination"""
-    products = Product.objects.filter(is_active=True)
-    categories = Category.objects.all()
-    
-    # Filter by category
-    category_slug = request.GET.get('category')
-    if category_slug:
-        category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=category)
-    
-    # Search functionality
+    """Display all products with faceted filtering and pagination"""
+    state = facets.normalize_filters(request.GET)
+    products, ordering = filter_products(request.GET, state)
     query = request.GET.get('q')
-    if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
-    
-    # Sort by price
     sort = request.GET.get('sort')
-    if sort == 'price_low':
-        products = products.order_by('price')
-    elif sort == 'price_high':
-        products = products.order_by('-price')
-    elif sort == 'rating':
-        products = products.order_by('-rating')
-    else:
-        products = products.order_by('-created_at')
+    facet_counts = facets.facet_counts(state, query)
     
-    # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination: keyset cursors for sorted listings, page numbers for
+    # relevance-ranked search results
+    if ordering:
+        page_obj = CursorPaginator(products, ordering, 12).get_page(request.GET)
+    else:
+        paginator = Paginator(products, 12)
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
     
+    filter_query = facets.filter_query(state)
     context = {
         'page_obj': page_obj,
-        'categories': categories,
+        'facets': facet_counts,
         'query': query,
         'sort': sort,
-        'category_slug': category_slug,
+        'filters': state,
+        'page_query': urlencode([('q', query or ''), *filter_query]),
+        'clear_query': urlencode([(name, request.GET[name]) for name in ('q', 'sort') if request.GET.get(name)]),
     }
     return render(request, 'products/product_list.html', context)
 
 
+@query_budget(5)
+@cache_anonymous_page()
+@conditional_page(
+    lambda slug: Product.objects.filter(pk__in=RelatedProduct.objects.filter(
+        product__slug=slug
+    ).order_by().values('related_id').union(
+        Product.objects.filter(category__products__slug=slug).order_by().values('pk'), all=True
+    )),
+    # A recomputed list can reorder the related products without changing them
+    modified=lambda slug: RelatedProduct.objects.filter(product__slug=slug).values('product').annotate(
+        latest=Max('computed_at')
+    ).values('latest'),
+)
 def product_detail(request, slug):
     """Display product detail page with reviews"""
-    product = get_object_or_404(Product, slug=slug, is_active=True)
-    reviews = product.reviews.all()[:10]
-    related_products = Product.objects.filter(
-        category=product.category,
+    product = get_object_or_404(
+        Product.objects.select_related('category').annotate(
+            has_recommendations=Exists(RelatedProduct.objects.filter(product=OuterRef('pk')))
+        ),
+        slug=slug,
         is_active=True
-    ).exclude(id=product.id)[:4]
-    
-    # Update product rating based on reviews
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-    if avg_rating:
-        product.rating = round(avg_rating, 1)
-        product.save()
+    )
+    reviews = product.reviews.select_related('user')[:10]
+    if product.has_recommendations:
+        # Precomputed by compute_recommendations
+        related_products = Product.objects.filter(
+            recommended_for__product=product,
+            is_active=True
+        ).order_by('recommended_for__rank')[:4]
+    else:
+        related_products = Product.objects.filter(
+            category=product.category,
+            is_active=True
+        ).exclude(id=product.id)[:4]
+    tag_page(request, *product_tags(product), *(f'product:{related.pk}' for related in related_products))
     
     context = {
         'product': product,
@@ -95,19 +164,22 @@ def product_detail(request, slug):
     return render(request, 'products/product_detail.html', context)
 
 
+@query_budget(5)
+@cache_anonymous_page('catalog')
+@conditional_page(lambda slug: Product.objects.filter(category__slug=slug))
 def category_products(request, slug):
     """Display products for a specific category"""
     category = get_object_or_404(Category, slug=slug)
     products = Product.objects.filter(category=category, is_active=True)
     
     # Pagination
-    paginator = Paginator(products, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = CursorPaginator(products, '-created_at', 12).get_page(request.GET)
     
     context = {
         'category': category,
         'page_obj': page_obj,
+        # Only the first page pays for the total
+        'product_count': None if request.GET.get('cursor') else products.count(),
     }
     return render(request, 'products/category_products.html', context)
 
@@ -133,16 +205,12 @@ def add_review(request, slug):
 
 
 def get_cart(request):
-    """Get or create cart for user/session"""
+    """The logged-in user's cart, or the anonymous visitor's cookie cart"""
     if request.user.is_authenticated:
         cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-    return cart
+        return cart
+    # No session or Cart row for anonymous visitors until they log in
+    return get_cookie_cart(request)
 
 
 @require_POST
@@ -156,67 +224,132 @@ def add_to_cart(request, product_id):
         messages.error(request, f'Only {product.stock} items available in stock.')
         return redirect('products:product_detail', slug=product.slug)
     
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': quantity}
-    )
+    # The stock check and the increment happen in one statement
+    try:
+        added = cart.add(product, quantity)
+    except CartFull as e:
+        messages.error(request, str(e))
+        return redirect('products:cart_detail')
     
-    if not created:
-        new_quantity = cart_item.quantity + quantity
-        if new_quantity > product.stock:
-            messages.error(request, f'Cannot add more. Only {product.stock} items available.')
-        else:
-            cart_item.quantity = new_quantity
-            cart_item.save()
-            messages.success(request, f'{product.name} added to cart!')
-    else:
+    if added:
+        update_cart_count(cart)
         messages.success(request, f'{product.name} added to cart!')
+    else:
+        messages.error(request, f'Cannot add more. Only {product.stock} items available.')
     
     return redirect('products:cart_detail')
 
 
+@query_budget(4)
 def cart_detail(request):
     """Display cart contents"""
     cart = get_cart(request)
+    items = cart.line_items()
+    # The badge in the navbar reads the count just loaded with the cart
+    remember_cart_count(cart)
+    offer, discount = None, 0
+    if cart.offer_code:
+        try:
+            offer, discount = offers.price(cart.offer_code, cart.subtotal)
+        except offers.OfferNotApplicable as e:
+            messages.warning(request, str(e))
     context = {
         'cart': cart,
+        'items': items,
+        'total_items': cart.item_count,
+        'total_price': cart.subtotal,
+        'offer': offer,
+        'discount': discount,
+        'grand_total': cart.subtotal - discount,
     }
     return render(request, 'products/cart_detail.html', context)
 
 
 @require_POST
-def update_cart(request, item_id):
+def apply_offer(request):
+    """Apply a coupon code to the cart"""
+    if not request.user.is_authenticated:
+        messages.error(request, 'Please log in to use a coupon code.')
+        return redirect('products:cart_detail')
+    cart = get_cart(request)
+    try:
+        offer, discount = offers.price(request.POST.get('code', ''), cart.subtotal)
+        offers.check_available(offer)
+    except offers.OfferNotApplicable as e:
+        messages.error(request, str(e))
+    else:
+        Cart.objects.filter(pk=cart.pk).update(offer_code=offer.code)
+        messages.success(request, f'{offer.name} applied: you save ${discount}.')
+    return redirect('products:cart_detail')
+
+
+@require_POST
+def remove_offer(request):
+    """Take the coupon code off the cart"""
+    if request.user.is_authenticated:
+        Cart.objects.filter(user=request.user).update(offer_code='')
+    return redirect('products:cart_detail')
+
+
+@require_POST
+def update_cart(request, product_id):
     """Update cart item quantity"""
+    product = get_object_or_404(Product, id=product_id)
     cart = get_cart(request)
-    cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+    if not cart.get_quantity(product):
+        raise Http404('This product is not in your cart.')
     quantity = int(request.POST.get('quantity', 1))
     
-    if quantity > 0:
-        if quantity <= cart_item.product.stock:
-            cart_item.quantity = quantity
-            cart_item.save()
-            messages.success(request, 'Cart updated!')
-        else:
-            messages.error(request, f'Only {cart_item.product.stock} items available.')
+    if not cart.set_quantity(product, quantity):
+        messages.error(request, f'Only {product.stock} items available.')
     else:
-        cart_item.delete()
-        messages.success(request, 'Item removed from cart!')
+        update_cart_count(cart)
+        messages.success(request, 'Cart updated!' if quantity > 0 else 'Item removed from cart!')
     
     return redirect('products:cart_detail')
 
 
 @require_POST
-def remove_from_cart(request, item_id):
+def remove_from_cart(request, product_id):
     """Remove item from cart"""
+    product = get_object_or_404(Product, id=product_id)
     cart = get_cart(request)
-    cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
-    product_name = cart_item.product.name
-    cart_item.delete()
-    messages.success(request, f'{product_name} removed from cart!')
+    if not cart.get_quantity(product):
+        raise Http404('This product is not in your cart.')
+    cart.remove(product)
+    update_cart_count(cart)
+    messages.success(request, f'{product.name} removed from cart!')
     return redirect('products:cart_detail')
 
 
+@login_required
+def checkout(request):
+    """Place an order for everything in the cart"""
+    if request.method != 'POST':
+        return redirect('products:cart_detail')
+    cart = get_cart(request)
+    try:
+        order = place_order(cart)
+    except (EmptyCart, OutOfStock, offers.OfferNotApplicable) as e:
+        messages.error(request, str(e))
+        return redirect('products:cart_detail')
+    update_cart_count(cart)
+    messages.success(request, f'Thank you! Your order #{order.pk} has been placed.')
+    return redirect(order)
+
+
+@query_budget(4)
+@login_required
+def order_detail(request, pk):
+    """Display a placed order"""
+    order = get_object_or_404(Order, pk=pk, user=request.user)
+    context = {
+        'order': order,
+        'lines': list(order.lines.all()),
+    }
+    return render(request, 'products/order_detail.html', context)
+
+
 def register(request):
     """User registration"""
     if request.method == 'POST':
@@ -231,21 +364,63 @@ def register(request):
     return render(request, 'registration/register.html', {'form': form})
 
 
+@query_budget(5)
 def search(request):
     """Search products"""
     query = request.GET.get('q', '')
-    products = []
+    page_obj = None
     
     if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query),
-            is_active=True
-        )
+        products = search_products(Product.objects.filter(is_active=True), query)
+        paginator = Paginator(products, 12)
+        page_obj = paginator.get_page(request.GET.get('page'))
     
     context = {
-        'products': products,
+        'page_obj': page_obj,
+        'products': page_obj,
         'query': query,
     }
     return render(request, 'products/search_results.html', context)
+
+
+def autocomplete(request):
+    """JSON suggestions for the navbar search box"""
+    query = request.GET.get('q', '')
+    return JsonResponse({
+        'query': query,
+        'results': autocomplete_index.suggest(query),
+    })
+
+
+@staff_member_required
+def export_products(request):
+    """Stream the catalog as CSV or JSON Lines (``?format=jsonl``), gzipped with ``?gzip=1``"""
+    params = request.GET
+    fmt = params.get('format', 'csv')
+    compress = params.get('gzip') == '1'
+    try:
+        rows = exports.export_rows(
+            categories=params.getlist('category'),
+            active={'1': True, '0': False}.get(params.get('active')),
+            updated_after=exports.parse_moment(params.get('updated_after')),
+            updated_before=exports.parse_moment(params.get('updated_before')),
+        )
+        chunks = exports.stream_export(rows, fmt, compress)
+    except exports.ExportError as exc:
+        return HttpResponseBadRequest(str(exc))
+    
+    filename = f'products.{fmt}' + ('.gz' if compress else '')
+    content_type = 'application/gzip' if compress else (
+        'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    )
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def serve_media(request, path):
+    """Serve uploads in development; content-addressed files never change, so cache them for good"""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_content_addressed(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
@@ -41,17 +41,38 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'products.query_inspector.QueryInspectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'products.cart.CartCookieMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query inspector: logs repeated same-shape queries (N+1) and views that
+# exceed their @query_budget. Development only.
+QUERY_INSPECTOR_ENABLED = DEBUG
+QUERY_INSPECTOR_REPEAT_THRESHOLD = 3
+
 ROOT_URLCONF = 'pyshop.urls'
 
+# Per-process memory cache; point this at Redis or Memcached when running
+# several workers so they share cached values such as the cart badge count
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Serve the catalog pages from the cache to anonymous visitors without a
+# session, messages or cart (see products/page_cache.py)
+PAGE_CACHE_ENABLED = True
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -63,6 +84,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'products.context_processors.cart',
             ],
         },
     },
@@ -122,6 +144,21 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Outside DEBUG, collectstatic writes content-hashed copies of every file
+# (style.3f2a9c.css) plus precompressed .gz and .br (needs Brotli) versions,
+# and WhiteNoise serves the hashed names with a one-year immutable
+# Cache-Control. DEBUG keeps the plain names, so no collectstatic is needed.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': ('django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+                    else 'whitenoise.storage.CompressedManifestStaticFilesStorage'),
+    },
+}
 
 # Media files (uploads)
 MEDIA_URL = '/media/'
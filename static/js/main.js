@@ -49,6 +49,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 searchInput.focus();
             }
         });
+        initSearchAutocomplete(searchForm);
     }
 
     // Cart update forms
@@ -182,7 +183,7 @@ document.addEventListener('DOMContentLoaded', function() {
             `;
             
             const modalImage = document.createElement('img');
-            modalImage.src = this.src;
+            modalImage.src = this.dataset.zoomSrc || this.src;
             modalImage.style.cssText = `
                 max-width: 90%;
                 max-height: 90%;
@@ -199,6 +200,103 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Search autocomplete: debounced requests, stale responses are aborted
+function initSearchAutocomplete(form) {
+    const input = form.querySelector('input[name="q"]');
+    const menu = document.getElementById('search-suggestions');
+    const url = form.dataset.autocompleteUrl;
+    if (!input || !menu || !url || !window.fetch) {
+        return;
+    }
+
+    let timer = null;
+    let controller = null;
+    let active = -1;
+
+    function hide() {
+        menu.classList.remove('show');
+        menu.innerHTML = '';
+        active = -1;
+    }
+
+    function render(results) {
+        menu.innerHTML = '';
+        active = -1;
+        results.forEach(result => {
+            const item = document.createElement('li');
+            const link = document.createElement('a');
+            link.className = 'dropdown-item';
+            link.href = result.url;
+            const icon = document.createElement('i');
+            icon.className = result.type === 'category' ? 'fas fa-folder me-2 text-muted' : 'fas fa-box me-2 text-muted';
+            link.appendChild(icon);
+            link.appendChild(document.createTextNode(result.label));
+            item.appendChild(link);
+            menu.appendChild(item);
+        });
+        menu.classList.toggle('show', results.length > 0);
+    }
+
+    function highlight(index) {
+        const links = menu.querySelectorAll('.dropdown-item');
+        if (!links.length) {
+            return;
+        }
+        active = (index + links.length) % links.length;
+        links.forEach((link, i) => link.classList.toggle('active', i === active));
+    }
+
+    function fetchSuggestions(query) {
+        if (controller) {
+            controller.abort();
+        }
+        controller = new AbortController();
+        fetch(`${url}?q=${encodeURIComponent(query)}`, { signal: controller.signal })
+            .then(response => response.json())
+            .then(data => {
+                if (data.query === input.value.trim()) {
+                    render(data.results);
+                }
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    hide();
+                }
+            });
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const query = this.value.trim();
+        if (query.length < 2) {
+            hide();
+            return;
+        }
+        timer = setTimeout(() => fetchSuggestions(query), 150);
+    });
+
+    input.addEventListener('keydown', function(e) {
+        if (e.key === 'ArrowDown') {
+            e.preventDefault();
+            highlight(active + 1);
+        } else if (e.key === 'ArrowUp') {
+            e.preventDefault();
+            highlight(active - 1);
+        } else if (e.key === 'Enter' && active >= 0) {
+            e.preventDefault();
+            window.location = menu.querySelectorAll('.dropdown-item')[active].href;
+        } else if (e.key === 'Escape') {
+            hide();
+        }
+    });
+
+    document.addEventListener('click', function(e) {
+        if (!form.contains(e.target)) {
+            hide();
+        }
+    });
+}
+
 // Helper functions
 function formatCurrency(amount) {
     return new Intl.NumberFormat('en-US', {